@@ -0,0 +1 @@
+"""日田市ナビゲーションアプリのコアロジック（Streamlitに依存しない）"""
@@ -0,0 +1,241 @@
+"""観光ルート・スケジュール・避難所の一括計算（夜間のまとめて作成など）
+
+JSON Lines の1行を1件の依頼として複数プロセスで並列に計算し、入力と同じ
+順序で1行ずつ結果を書き出す（全件の完了を待たずに順次出力する）。
+
+依頼の例:
+    {"request_id": "r1", "mode": "route", "start": [33.32, 130.94], "destinations": [1001, 1003]}
+    {"request_id": "r2", "mode": "schedule", "start": [33.32, 130.94], "destinations": [1001, 2001],
+     "transport_mode": "walk", "start_time": "09:00", "meal": true}
+    {"request_id": "r3", "mode": "shelters", "start": [33.32, 130.94], "k": 5}
+    {"request_id": "r4", "mode": "reachable", "start": [33.32, 130.94], "minutes": 10,
+     "transport_mode": "walk", "group": "tourism"}
+
+使い方: python -m hita_navi.batch 依頼.jsonl [-o 結果.jsonl] [--workers 4]
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from hita_navi.planner import DATA_DIR, Planner, calculate_travel_time
+from hita_navi.scheduler import DEFAULT_MEAL_WINDOW, format_clock, parse_clock
+
+# 1ワーカーあたりの先行して投入する依頼数（出力待ちで溜まる結果の上限）
+QUEUE_PER_WORKER = 4
+
+TRANSPORT_MODES = ("walk", "bicycle", "car")
+
+# 時刻の形式（"HH:MM"）
+CLOCK_PATTERN = re.compile(r"([01]?\d|2[0-4]):[0-5]\d")
+
+_PLANNER = None
+
+
+def _point(place, **extra):
+    return {"id": place['id'], "name": place['name'], "lat": place['lat'], "lon": place['lon'], **extra}
+
+
+def _start(request):
+    """出発地 [緯度, 経度]"""
+    start = request.get("start")
+    try:
+        lat, lon = (float(v) for v in start)
+    except (TypeError, ValueError):
+        raise ValueError("start に [緯度, 経度] を指定してください") from None
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise ValueError("start に [緯度, 経度] を指定してください")
+    return [lat, lon]
+
+
+def _positive(request, name, default, message, integer=False):
+    """正の数の値（integer なら整数）"""
+    value = request.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(message)
+    if not math.isfinite(value) or value <= 0 or (integer and value != int(value)):
+        raise ValueError(message)
+    return int(value) if integer else float(value)
+
+
+def _clock(value, name):
+    """"HH:MM" 形式の時刻"""
+    if not isinstance(value, str) or not CLOCK_PATTERN.fullmatch(value):
+        raise ValueError(f'{name} に "HH:MM" 形式の時刻を指定してください')
+    return value
+
+
+def _meal_window(request):
+    """食事の時間帯 ("HH:MM", "HH:MM")"""
+    window = request.get("meal_window", DEFAULT_MEAL_WINDOW)
+    message = 'meal_window に ["HH:MM", "HH:MM"]（開始, 終了）を指定してください'
+    if not isinstance(window, (list, tuple)) or len(window) != 2:
+        raise ValueError(message)
+    start, end = (_clock(value, "meal_window") for value in window)
+    if parse_clock(start) >= parse_clock(end):
+        raise ValueError(message)
+    return (start, end)
+
+
+def _places(planner, request):
+    ids = request.get("destinations") or []
+    missing = [poi_id for poi_id in ids if poi_id not in planner.poi_index]
+    if missing:
+        raise ValueError(f"存在しないIDです: {missing}")
+    return planner.poi_index.records(ids)
+
+
+def _route(planner, request, start):
+    transport_mode = request.get("transport_mode", "walk")
+    route, result = planner.optimize_route(start, _places(planner, request))
+    legs = planner.leg_distances(start, route)
+    return {
+        "stops": [_point(place, distance_km=round(float(leg), 3)) for place, leg in zip(route, legs)],
+        "total_km": round(float(legs.sum()), 3),
+        "travel_minutes": round(float(calculate_travel_time(float(legs.sum()), transport_mode)), 1),
+        "improvement_pct": round(result.improvement_pct, 2),
+    }
+
+
+def _schedule(planner, request, start):
+    meal = request.get("meal", False)
+    start_time = _clock(request.get("start_time", "09:00"), "start_time")
+    meal_window = _meal_window(request) if meal else None
+    schedule = planner.plan_schedule(
+        start, _places(planner, request),
+        transport_mode=request.get("transport_mode", "walk"),
+        start_time=start_time,
+        meal_options=planner.restaurants.records() if meal else (),
+        meal_window=meal_window,
+    )
+    return {
+        "stops": [_point(stop.place, arrival=format_clock(stop.arrival), start=format_clock(stop.start),
+                         departure=format_clock(stop.departure), is_meal=stop.is_meal)
+                  for stop in schedule.stops],
+        "start_time": format_clock(schedule.start_time),
+        "end_time": format_clock(schedule.end_time),
+        "total_minutes": round(schedule.total_minutes, 1),
+        "feasible": schedule.feasible,
+        "optimal": schedule.optimal,
+        "timed_out": schedule.timed_out,
+        "relaxed": schedule.relaxed,
+    }
+
+
+def _shelters(planner, request, start):
+    k = _positive(request, "k", 5, "k に1以上の整数を指定してください", integer=True)
+    shelters, distances, scores = planner.rank_shelters(start, k)
+    return {"shelters": [
+        _point(shelter, distance_km=round(float(distance), 3), safety_score=round(float(score), 1),
+               capacity=shelter['capacity'])
+        for shelter, distance, score in zip(shelters, distances, scores)
+    ]}
+
+
+def _reachable(planner, request, start):
+    group = request.get("group", "tourism")
+    if group not in planner.tables:
+        raise ValueError(f"未対応の group です: {group}")
+    minutes = _positive(request, "minutes", 10, "minutes に正の数（分）を指定してください")
+    area = planner.isochrone(start, minutes, request.get("transport_mode", "walk"))
+    places = planner.tables[group]
+    inside = area.contains(places.column('lat'), places.column('lon'))
+    return {"minutes": minutes, "places": [_point(places[i]) for i in np.flatnonzero(inside)],
+            "polygons": area.rings()}
+
+
+HANDLERS = {"route": _route, "schedule": _schedule, "shelters": _shelters, "reachable": _reachable}
+
+
+def handle_request(planner, request):
+    """1件の依頼（辞書）を計算して結果の辞書を返す。不正な依頼は error を含む結果にする"""
+    output = {"request_id": request.get("request_id"), "mode": request.get("mode", "route")}
+    try:
+        handler = HANDLERS.get(output["mode"])
+        if handler is None:
+            raise ValueError(f"未対応の mode です: {output['mode']}")
+        if request.get("transport_mode", "walk") not in TRANSPORT_MODES:
+            raise ValueError(f"未対応の transport_mode です: {request['transport_mode']}")
+        output.update(handler(planner, request, _start(request)))
+    except (ValueError, TypeError, KeyError) as error:
+        output["error"] = str(error)
+    return output
+
+
+def handle_line(planner, line):
+    """JSON Lines の1行を計算する"""
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as error:
+        return {"request_id": None, "error": f"JSONとして読めません: {error}"}
+    if not isinstance(request, dict):
+        return {"request_id": None, "error": "1行に1つのオブジェクトを記載してください"}
+    return handle_request(planner, request)
+
+
+def _init_worker(data_dir, options):
+    global _PLANNER
+    _PLANNER = Planner.open(data_dir, **options)
+
+
+def _handle_line(line):
+    return handle_line(_PLANNER, line)
+
+
+def run_batch(lines, data_dir=DATA_DIR, workers=None, **options):
+    """依頼の行を並列に計算し、入力の順に結果を返すジェネレーター（options は Planner に渡す）"""
+    lines = (line for line in lines if line.strip())
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        planner = Planner.open(data_dir, **options)
+        for line in lines:
+            yield handle_line(planner, line)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(str(data_dir), options)) as executor:
+        pending = deque()
+        for line in lines:
+            pending.append(executor.submit(_handle_line, line))
+            if len(pending) >= workers * QUEUE_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="観光ルート・スケジュール・避難所の一括計算")
+    parser.add_argument("input", help="依頼の JSON Lines ファイル（- で標準入力）")
+    parser.add_argument("-o", "--output", help="結果の出力先（省略時は標準出力）")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="データのディレクトリ")
+    parser.add_argument("--workers", type=int, default=None, help="並列数（省略時はCPUコア数）")
+    parser.add_argument("--time-budget", type=float, default=None, help="1ルートあたりの局所探索の制限時間（秒）")
+    args = parser.parse_args(argv)
+
+    options = {} if args.time_budget is None else {"time_budget": args.time_budget}
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    target = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8")
+    began = time.perf_counter()
+    count = errors = 0
+    try:
+        for result in run_batch(source, args.data_dir, args.workers, **options):
+            target.write(json.dumps(result, ensure_ascii=False) + "\n")
+            target.flush()
+            count += 1
+            errors += "error" in result
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    print(f"{count}件を処理しました（エラー {errors}件、{time.perf_counter() - began:.1f}秒）", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""地図表示範囲による間引きとサーバー側のマーカークラスタリング
+
+表示範囲（st_folium が返す bounds）の外の点は送らず、範囲内の点は
+ズームレベルに応じた画面上の格子でまとめる。地図に送るマーカー数は
+データ件数ではなく、画面に見えている格子の数で決まる。
+"""
+import math
+
+import numpy as np
+
+# クラスタにまとめる格子の大きさ（画面上のピクセル）
+CLUSTER_CELL_PX = 60
+
+# この件数以下なら個別のマーカーで表示する
+CLUSTER_MIN_POINTS = 30
+
+# 表示範囲の外側に余分に含める割合（少しの移動では再計算しない）
+VIEWPORT_MARGIN = 0.2
+
+# Webメルカトルのタイル1枚のピクセル数
+TILE_PX = 256
+
+
+def degrees_per_pixel(zoom):
+    """ズームレベルでの経度1ピクセルあたりの度数"""
+    return 360.0 / (TILE_PX * 2 ** zoom)
+
+
+def default_bounds(center, zoom, width_px=700, height_px=500):
+    """地図の中心とズームから表示範囲 (南, 西, 北, 東) を概算する"""
+    lat, lon = center
+    lon_span = degrees_per_pixel(zoom) * width_px
+    lat_span = degrees_per_pixel(zoom) * height_px * math.cos(math.radians(lat))
+    return (lat - lat_span / 2, lon - lon_span / 2, lat + lat_span / 2, lon + lon_span / 2)
+
+
+def parse_bounds(bounds):
+    """st_folium の bounds（_southWest / _northEast）を (南, 西, 北, 東) に変換。無効なら None"""
+    try:
+        south_west, north_east = bounds["_southWest"], bounds["_northEast"]
+        box = (south_west["lat"], south_west["lng"], north_east["lat"], north_east["lng"])
+    except (KeyError, TypeError):
+        return None
+    if any(value is None for value in box):
+        return None
+    return tuple(float(value) for value in box)
+
+
+def viewport_indices(lats, lons, bounds, margin=VIEWPORT_MARGIN):
+    """表示範囲（余白込み）に含まれる点の番号"""
+    south, west, north, east = bounds
+    pad_lat = (north - south) * margin
+    pad_lon = (east - west) * margin
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    inside = ((lats >= south - pad_lat) & (lats <= north + pad_lat)
+              & (lons >= west - pad_lon) & (lons <= east + pad_lon))
+    return np.flatnonzero(inside)
+
+
+def grid_clusters(lats, lons, indices, zoom, cell_px=CLUSTER_CELL_PX):
+    """点を画面上の格子ごとにまとめる。[(点の番号の配列, 重心の緯度, 重心の経度)] を返す"""
+    indices = np.asarray(indices, dtype=np.int64)
+    if not len(indices):
+        return []
+    lats = np.asarray(lats, dtype=float)[indices]
+    lons = np.asarray(lons, dtype=float)[indices]
+    cell = degrees_per_pixel(zoom) * cell_px
+    rows = np.floor(lats / cell).astype(np.int64)
+    cols = np.floor(lons / cell).astype(np.int64)
+    rows -= rows.min()
+    cols -= cols.min()
+    # 格子の (行, 列) を1つの整数にまとめてから集計する
+    keys = rows * (int(cols.max()) + 1) + cols
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    center_lat = np.bincount(inverse, weights=lats) / counts
+    center_lon = np.bincount(inverse, weights=lons) / counts
+    order = np.argsort(inverse, kind="stable")
+    groups = np.split(indices[order], np.cumsum(counts)[:-1])
+    return [(members, float(lat), float(lon))
+            for members, lat, lon in zip(groups, center_lat, center_lon)]
+
+
+def visible_groups(lats, lons, bounds, zoom, min_points=CLUSTER_MIN_POINTS):
+    """表示範囲内の点。少なければ1点ずつ、多ければ格子ごとにまとめて返す"""
+    indices = viewport_indices(lats, lons, bounds)
+    if len(indices) <= min_points:
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        return [(np.array([i]), float(lats[i]), float(lons[i])) for i in indices]
+    return grid_clusters(lats, lons, indices, zoom)
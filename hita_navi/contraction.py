@@ -0,0 +1,337 @@
+"""縮約階層（Contraction Hierarchies）による高速な経路距離クエリ
+
+道路グラフを事前に縮約してショートカット辺を加え、ディスクに保存する。
+クエリは「上向き」の辺だけをたどる双方向探索で、通常のダイクストラ法より
+はるかに少ない節点数で最短距離が求まる。避難所のように何度も問い合わせる
+目的地は後ろ向きの探索結果をキャッシュし、1回のクエリは前向きの探索1回で済む。
+事前計算とベンチマーク: python -m hita_navi.contraction 道路.osm|.npz 出力.ch.npz
+"""
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from hita_navi.spatial_index import GridIndex
+
+# 証人探索（ショートカットが必要かの判定）で確定させる節点数とたどる辺の数の上限
+# （上限で打ち切った場合は念のためショートカットを加えるので、結果の距離は変わらない）
+WITNESS_SETTLE_LIMIT = 500
+WITNESS_HOP_LIMIT = 8
+# 縮約順序を決めるための見積もりでは、より小さい上限で済ませる
+PRIORITY_SETTLE_LIMIT = 50
+PRIORITY_HOP_LIMIT = 3
+
+# 最寄り節点と後ろ向きの探索結果をキャッシュする目的地の数
+TARGET_CACHE_SIZE = 1024
+
+
+def _witness_search(out_adj, source, excluded, targets, max_cost, settle_limit, hop_limit):
+    """excluded を通らない source からの最短距離（targets がすべて確定するか上限で打ち切り）"""
+    best = {source: 0.0}
+    hops = {source: 0}
+    done = set()
+    remaining = set(targets)
+    heap = [(0.0, source)]
+    while heap and len(done) < settle_limit:
+        g, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        if g > max_cost:
+            break
+        done.add(u)
+        remaining.discard(u)
+        if not remaining:
+            break
+        if hops[u] >= hop_limit:
+            continue
+        for v, w in out_adj[u].items():
+            if v == excluded:
+                continue
+            ng = g + w
+            if ng < best.get(v, math.inf):
+                best[v] = ng
+                hops[v] = hops[u] + 1
+                heapq.heappush(heap, (ng, v))
+    return best
+
+
+def _shortcuts(out_adj, in_adj, v, settle_limit=WITNESS_SETTLE_LIMIT, hop_limit=WITNESS_HOP_LIMIT):
+    """節点 v を縮約するときに必要なショートカット (u, w, 距離) の一覧"""
+    shortcuts = []
+    outgoing = out_adj[v]
+    if not outgoing:
+        return shortcuts
+    for u, w_uv in in_adj[v].items():
+        targets = [w for w in outgoing if w != u]
+        if not targets:
+            continue
+        max_cost = w_uv + max(outgoing[w] for w in targets)
+        reach = _witness_search(out_adj, u, v, targets, max_cost, settle_limit, hop_limit)
+        for w in targets:
+            via = w_uv + outgoing[w]
+            if reach.get(w, math.inf) > via:
+                shortcuts.append((u, w, via))
+    return shortcuts
+
+
+def _adjacency(csr):
+    """CSR配列を節点ごとの (行き先, 距離) のリストにする"""
+    indptr, indices, weights = (np.asarray(a).tolist() for a in csr)
+    return [list(zip(indices[start:end], weights[start:end])) for start, end in zip(indptr, indptr[1:])]
+
+
+def _to_csr(n, edges):
+    """(始点, 終点, 距離) のリストをCSR配列に変換"""
+    if edges:
+        src, dst, wt = (np.array(col) for col in zip(*edges))
+    else:
+        src = dst = np.zeros(0, dtype=np.int64)
+        wt = np.zeros(0)
+    order = np.argsort(src, kind="stable")
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src.astype(np.int64), minlength=n))))
+    return indptr.astype(np.int64), dst[order].astype(np.int64), wt[order].astype(float)
+
+
+class ContractionHierarchy:
+    """縮約階層。上向きの前向き辺（up）と上向きの後ろ向き辺（down）をCSR形式で持つ"""
+
+    def __init__(self, node_lat, node_lon, rank, up, down):
+        self.node_lat = np.asarray(node_lat, dtype=float)
+        self.node_lon = np.asarray(node_lon, dtype=float)
+        self.rank = np.asarray(rank, dtype=np.int64)
+        self.up = tuple(np.asarray(a) for a in up)
+        self.down = tuple(np.asarray(a) for a in down)
+        self._index = GridIndex(self.node_lat, self.node_lon)
+        # 探索の内側ループでは節点ごとの (行き先, 距離) のリストをたどるのが最も速い
+        self._up = _adjacency(self.up)
+        self._down = _adjacency(self.down)
+        self._snap_cache = OrderedDict()
+        self._backward_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rank)
+
+    @property
+    def edge_count(self):
+        return len(self.up[1]) + len(self.down[1])
+
+    @classmethod
+    def build(cls, graph, progress=None):
+        """道路グラフ（RoadGraph）を縮約する。progress(縮約済み数, 全体) で進捗を通知"""
+        n = len(graph)
+        out_adj = [dict() for _ in range(n)]
+        in_adj = [dict() for _ in range(n)]
+        for u in range(n):
+            for v, w in graph.neighbors(u):
+                if u != v and w < out_adj[u].get(v, math.inf):
+                    out_adj[u][v] = w
+                    in_adj[v][u] = w
+
+        deleted_neighbors = [0] * n
+        level = [0] * n
+
+        def priority(v):
+            # 辺差分（追加されるショートカット数 − 削除される辺数）＋縮約済みの隣接数＋階層の深さ
+            added = len(_shortcuts(out_adj, in_adj, v, PRIORITY_SETTLE_LIMIT, PRIORITY_HOP_LIMIT))
+            return 2 * (added - len(out_adj[v]) - len(in_adj[v])) + deleted_neighbors[v] + level[v]
+
+        heap = [(priority(v), v) for v in range(n)]
+        heapq.heapify(heap)
+        rank = np.full(n, -1, dtype=np.int64)
+        up_edges, down_edges = [], []
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if rank[v] >= 0:
+                continue
+            # 遅延更新: 優先度を再計算し、最小でなければ戻す
+            current = priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+
+            for u, w, via in _shortcuts(out_adj, in_adj, v, WITNESS_SETTLE_LIMIT, WITNESS_HOP_LIMIT):
+                if via < out_adj[u].get(w, math.inf):
+                    out_adj[u][w] = via
+                    in_adj[w][u] = via
+            # v に残っている辺は、すべて v より上位の節点との辺になる
+            for w, wt in out_adj[v].items():
+                up_edges.append((v, w, wt))
+                del in_adj[w][v]
+                deleted_neighbors[w] += 1
+                level[w] = max(level[w], level[v] + 1)
+            for u, wt in in_adj[v].items():
+                down_edges.append((v, u, wt))
+                del out_adj[u][v]
+                deleted_neighbors[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            out_adj[v].clear()
+            in_adj[v].clear()
+            rank[v] = order
+            order += 1
+            if progress is not None and order % 1000 == 0:
+                progress(order, n)
+
+        return cls(graph.node_lat, graph.node_lon, rank, _to_csr(n, up_edges), _to_csr(n, down_edges))
+
+    def save(self, path):
+        """縮約結果を .npz に保存"""
+        np.savez_compressed(path, node_lat=self.node_lat, node_lon=self.node_lon, rank=self.rank,
+                            up_indptr=self.up[0], up_indices=self.up[1], up_weights=self.up[2],
+                            down_indptr=self.down[0], down_indices=self.down[1],
+                            down_weights=self.down[2])
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["node_lat"], data["node_lon"], data["rank"],
+                   (data["up_indptr"], data["up_indices"], data["up_weights"]),
+                   (data["down_indptr"], data["down_indices"], data["down_weights"]))
+
+    def nearest_node(self, lat, lon):
+        idx, dist = self._index.nearest(lat, lon, 1)
+        return int(idx[0]), float(dist[0])
+
+    def _cached(self, cache, key, compute):
+        """目的地ごとの結果の LRU キャッシュ（避難所のように同じ目的地が繰り返し問い合わされる）"""
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = compute()
+        with self._lock:
+            cache[key] = value
+            while len(cache) > TARGET_CACHE_SIZE:
+                cache.popitem(last=False)
+        return value
+
+    @staticmethod
+    def _upward(adjacency, opposite, source):
+        """上向きの辺だけをたどる探索（探索空間全体の距離を返す）
+
+        stall-on-demand: 上位節点から逆向きの辺でより短く到達できる節点は
+        最短経路上にないので、そこから先へは広げない。
+        """
+        best = {source: 0.0}
+        get = best.get
+        done = {}
+        heap = [(0.0, source)]
+        pop, push = heapq.heappop, heapq.heappush
+        while heap:
+            g, u = pop(heap)
+            if u in done:
+                continue
+            done[u] = g
+            for x, w in opposite[u]:
+                if get(x, math.inf) + w < g:
+                    break
+            else:
+                for v, w in adjacency[u]:
+                    ng = g + w
+                    if ng < get(v, math.inf):
+                        best[v] = ng
+                        push(heap, (ng, v))
+        return done
+
+    def _forward(self, source):
+        return self._upward(self._up, self._down, source)
+
+    def _backward(self, target):
+        """target への後ろ向きの探索空間（節点ごとにキャッシュ）"""
+        return self._cached(self._backward_cache, target, lambda: self._upward(self._down, self._up, target))
+
+    @staticmethod
+    def _meet(forward, backward):
+        if len(forward) > len(backward):
+            forward, backward = backward, forward
+        return min((g + backward[u] for u, g in forward.items() if u in backward), default=math.inf)
+
+    def distance(self, source, target):
+        """節点間の最短距離（km）。到達できない場合は inf"""
+        if source == target:
+            return 0.0
+        return self._meet(self._forward(source), self._backward(target))
+
+    def distances_to(self, origin, destinations):
+        """1地点から複数地点への距離（km）。前向き探索は1回だけ行う"""
+        source, snap_a = self.nearest_node(origin[0], origin[1])
+        forward = self._forward(source)
+        result = []
+        for lat, lon in destinations:
+            lat, lon = float(lat), float(lon)
+            target, snap_b = self._cached(self._snap_cache, (lat, lon), lambda: self.nearest_node(lat, lon))
+            best = 0.0 if target == source else self._meet(forward, self._backward(target))
+            result.append(best + snap_a + snap_b)
+        return np.array(result)
+
+
+def benchmark(graph, hierarchy, queries=200, seed=0, shelters=40, nearest=10):
+    """A*法・ダイクストラ法と縮約階層の1秒あたりクエリ数を比較する
+
+    1対1の距離と、防災モードと同じ「現在地から近い避難所 nearest 件への距離」
+    （避難所は shelters 件の固定の節点、現在地はクエリごとに異なる）の2種類を測る。
+    """
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(graph), size=(queries, 2))
+    points = np.column_stack((graph.node_lat, graph.node_lon))
+
+    start = time.perf_counter()
+    baseline = [graph.astar(int(s), int(t))[0] for s, t in pairs]
+    plain = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [hierarchy.distance(int(s), int(t)) for s, t in pairs]
+    ch = time.perf_counter() - start
+
+    shelter_points = points[rng.choice(len(graph), size=min(shelters, len(graph)), replace=False)]
+    origins = points[pairs[:, 0]]
+    candidates = [
+        shelter_points[np.argsort(np.hypot(*(shelter_points - origin).T))[:nearest]] for origin in origins
+    ]
+    start = time.perf_counter()
+    baseline_many = [graph.distances_to(origin, targets) for origin, targets in zip(origins, candidates)]
+    plain_many = time.perf_counter() - start
+
+    hierarchy.distances_to(origins[0], shelter_points)  # 避難所の後ろ向きの探索をキャッシュしておく
+    start = time.perf_counter()
+    fast_many = [hierarchy.distances_to(origin, targets) for origin, targets in zip(origins, candidates)]
+    ch_many = time.perf_counter() - start
+
+    found = list(zip(baseline, fast))
+    found += [(a, b) for expected, got in zip(baseline_many, fast_many) for a, b in zip(expected, got)]
+    mismatch = sum(1 for a, b in found if not (math.isinf(a) and math.isinf(b)) and abs(a - b) > 1e-6)
+    return {"queries": queries, "astar_qps": queries / plain, "ch_qps": queries / ch,
+            "nearest": nearest, "dijkstra_many_qps": queries / plain_many, "ch_many_qps": queries / ch_many,
+            "mismatch": mismatch, "checked": len(found)}
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    from hita_navi.road_graph import RoadGraph
+
+    if len(sys.argv) < 2:
+        print("使い方: python -m hita_navi.contraction 道路.osm|.npz [出力.ch.npz]")
+        sys.exit(1)
+    road = RoadGraph.load(sys.argv[1])
+    output = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+    if output is not None and output.exists():
+        ch = ContractionHierarchy.load(output)
+    else:
+        began = time.perf_counter()
+        ch = ContractionHierarchy.build(road, progress=lambda done, total: print(f"縮約中 {done}/{total}"))
+        print(f"縮約: {time.perf_counter() - began:.1f}秒（辺 {road.edge_count} → {ch.edge_count}）")
+        if output is not None:
+            ch.save(output)
+    result = benchmark(road, ch)
+    print(f"節点 {len(road)}・1対1: A*法 {result['astar_qps']:.0f} クエリ/秒 → 縮約階層 {result['ch_qps']:.0f} クエリ/秒"
+          f"（{result['ch_qps'] / result['astar_qps']:.1f}倍、{1000 / result['ch_qps']:.2f}ミリ秒）")
+    print(f"近い避難所 {result['nearest']} 件: ダイクストラ法 {result['dijkstra_many_qps']:.0f} クエリ/秒 → "
+          f"縮約階層 {result['ch_many_qps']:.0f} クエリ/秒（{result['ch_many_qps'] / result['dijkstra_many_qps']:.1f}倍、"
+          f"{1000 / result['ch_many_qps']:.2f}ミリ秒）")
+    print(f"結果の不一致: {result['mismatch']}/{result['checked']}")
@@ -0,0 +1,192 @@
+"""避難所の到達表（格子ごとの近い避難所の事前計算）
+
+日田市内を一定の大きさの格子に分け、格子ごとに近い避難所 k 件の
+（避難所ID, 移動距離, ルートの安全スコア）を事前に計算して .npy に保存する。
+実行時はメモリマップで開き、現在地の格子を引くだけで一覧を返す（計算なし）。
+位置情報は同名の .json（北端・西端・セルの大きさ・署名）に置く。署名は避難所データと
+道路グラフ・ラスタのバージョンから作り、どれかが変わったら表は使わない（都度計算に戻る）。
+事前計算: python -m hita_navi.coverage [--data-dir data] [-o data/shelter_coverage.npy]
+"""
+import hashlib
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+from hita_navi.distance import distance_matrix
+from hita_navi.spatial_index import KM_PER_DEG_LAT
+
+# 格子の大きさ（m）と、格子ごとに保存する避難所の件数
+COVERAGE_CELL_M = 100.0
+COVERAGE_K = 10
+
+# 避難所の外側に広げる範囲（km）
+COVERAGE_MARGIN_KM = 3.0
+
+COVERAGE_DTYPE = np.dtype([("shelter", "<i8"), ("distance_km", "<f4"), ("safety", "<f4")])
+
+
+def coverage_signature(shelters, road_version="", safety_version=""):
+    """到達表の署名（避難所のID・位置、道路グラフ・ラスタのバージョンのどれかが変わったらやり直す）"""
+    payload = np.column_stack((shelters.ids().astype(float), shelters.column('lat'), shelters.column('lon')))
+    digest = hashlib.sha1(np.ascontiguousarray(payload).tobytes())
+    digest.update(f"\0{road_version}\0{safety_version}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class ShelterCoverage:
+    """メモリマップした到達表（行は北から南、列は西から東、各セルは近い順に k 件）"""
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path.with_suffix(".json"), encoding="utf-8") as f:
+            georef = json.load(f)
+        self.table = np.load(path, mmap_mode="r")
+        self.north = float(georef["north"])
+        self.west = float(georef["west"])
+        self.cell_lat = float(georef["cell_lat"])
+        self.cell_lon = float(georef["cell_lon"])
+        self.signature = georef.get("signature", "")
+        self.k = self.table.shape[2]
+
+    @classmethod
+    def open(cls, path, shelters=None, road_version="", safety_version=""):
+        """path が無い、または署名が一致しない（避難所・道路グラフ・ラスタが更新された）場合は None"""
+        path = Path(path)
+        if not path.exists() or not path.with_suffix(".json").exists():
+            return None
+        coverage = cls(path)
+        if shelters is not None and coverage.signature != coverage_signature(shelters, road_version, safety_version):
+            return None
+        return coverage
+
+    def cell(self, lat, lon):
+        """地点の格子の (行, 列)。範囲外は None"""
+        row = math.floor((self.north - lat) / self.cell_lat)
+        col = math.floor((lon - self.west) / self.cell_lon)
+        if 0 <= row < self.table.shape[0] and 0 <= col < self.table.shape[1]:
+            return row, col
+        return None
+
+    def lookup(self, lat, lon, k=None):
+        """近い避難所の (IDの配列, 距離kmの配列, 安全スコアの配列)。範囲外・件数不足は None"""
+        k = self.k if k is None else k
+        cell = self.cell(lat, lon)
+        if cell is None or k > self.k:
+            return None
+        entries = np.asarray(self.table[cell[0], cell[1], :k])
+        found = entries["shelter"] >= 0
+        return (entries["shelter"][found], entries["distance_km"][found].astype(float),
+                entries["safety"][found].astype(float))
+
+
+def _grid(shelters, cell_m, margin_km):
+    lats, lons = shelters.column('lat'), shelters.column('lon')
+    cell_lat = cell_m / 1000 / KM_PER_DEG_LAT
+    cell_lon = cell_lat / max(math.cos(math.radians(float(np.mean(lats)))), 1e-6)
+    margin_lat = margin_km / KM_PER_DEG_LAT
+    margin_lon = margin_lat * cell_lon / cell_lat
+    north, west = float(lats.max()) + margin_lat, float(lons.min()) - margin_lon
+    rows = int(math.ceil((north - (float(lats.min()) - margin_lat)) / cell_lat))
+    cols = int(math.ceil((float(lons.max()) + margin_lon - west) / cell_lon))
+    return north, west, cell_lat, cell_lon, rows, cols
+
+
+def _shelter_reach(graph, shelters):
+    """避難所ごとの全節点までの道路上の距離（避難所の行×節点、到達できない場合は inf）"""
+    reach = np.full((len(shelters), len(graph)), np.inf, dtype=np.float32)
+    for j, (lat, lon) in enumerate(shelters.points()):
+        # 歩行者用の道路は双方向とみなし、避難所からの最短距離を使う
+        source, snap = graph.nearest_node(lat, lon)
+        done = graph.dijkstra(source)
+        reach[j, np.fromiter(done.keys(), dtype=np.int64, count=len(done))] = list(done.values())
+        reach[j] += snap
+    return reach
+
+
+def _road_distances(graph, reach, points):
+    """格子の中心（points）から各避難所までの道路上の距離"""
+    snapped = [graph.nearest_node(lat, lon) for lat, lon in points]
+    nodes = np.array([node for node, _ in snapped])
+    snaps = np.array([snap for _, snap in snapped])
+    return reach[:, nodes].T + snaps[:, None]
+
+
+def build_coverage(planner, path, cell_m=COVERAGE_CELL_M, k=COVERAGE_K, margin_km=COVERAGE_MARGIN_KM,
+                   progress=None, road_version="", safety_version=""):
+    """planner の避難所・道路・ラスタで到達表を計算して path（.npy と .json）に保存する
+
+    road_version・safety_version は planner の道路グラフ・ラスタのバージョン（署名に含める）。
+    """
+    shelters = planner.shelters
+    records = shelters.records()
+    width, k = k, min(k, len(shelters))
+    north, west, cell_lat, cell_lon, rows, cols = _grid(shelters, cell_m, margin_km)
+    shelter_points = shelters.points()
+    ids = shelters.ids()
+    # ラスタが無い場合の安全スコアは避難所の地点のみで決まる
+    fallback = np.array([planner.safety_score(shelter['lat'], shelter['lon']) for shelter in records])
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = np.lib.format.open_memmap(path, mode="w+", dtype=COVERAGE_DTYPE, shape=(rows, cols, width))
+    table["shelter"] = -1
+    reach = None if planner.road_graph is None else _shelter_reach(planner.road_graph, shelters)
+    col_lons = west + (np.arange(cols) + 0.5) * cell_lon
+    for row in range(rows):
+        # 1行分の格子の中心から全避難所への距離（道路があれば道路上の距離を優先）
+        points = np.column_stack((np.full(cols, north - (row + 0.5) * cell_lat), col_lons))
+        distances = distance_matrix(points, shelter_points)
+        if planner.road_graph is not None:
+            road = _road_distances(planner.road_graph, reach, points)
+            distances = np.where(np.isfinite(road), road, distances)
+        nearest = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        nearest_km = np.take_along_axis(distances, nearest, axis=1)
+        # 格子の中心から避難所までの直線上の最も危険な地点で評価（Planner.rank_shelters と同じ）
+        route_safety = planner.score_routes([
+            [point, shelter_points[j]] for point, candidates in zip(points, nearest) for j in candidates
+        ])
+        safety = np.array([
+            found.minimum if found is not None else fallback[j]
+            for found, j in zip(route_safety, nearest.ravel())
+        ]).reshape(nearest.shape)
+        # 距離順、同じ距離なら安全スコアの高い順
+        for col in range(cols):
+            order = np.lexsort((-safety[col], nearest_km[col]))
+            table[row, col, :k] = list(zip(ids[nearest[col, order]], nearest_km[col, order], safety[col, order]))
+        if progress is not None:
+            progress(row + 1, rows)
+    table.flush()
+    del table
+
+    georef = {"north": north, "west": west, "cell_lat": cell_lat, "cell_lon": cell_lon,
+              "cell_m": cell_m, "signature": coverage_signature(shelters, road_version, safety_version)}
+    with open(path.with_suffix(".json"), "w", encoding="utf-8") as f:
+        json.dump(georef, f)
+    return ShelterCoverage(path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from hita_navi.planner import COVERAGE_FILE, DATA_DIR, Planner, road_graph_version, safety_version
+
+    parser = argparse.ArgumentParser(description="避難所の到達表の事前計算")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="データのディレクトリ")
+    parser.add_argument("-o", "--output", default=None, help=f"出力先（省略時は データ/{COVERAGE_FILE}）")
+    parser.add_argument("--cell-m", type=float, default=COVERAGE_CELL_M, help="格子の大きさ（m）")
+    parser.add_argument("--margin-km", type=float, default=COVERAGE_MARGIN_KM, help="避難所の外側に広げる範囲（km）")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    planner = Planner.open(args.data_dir, coverage=None)
+    output = args.output or Path(args.data_dir) / COVERAGE_FILE
+    coverage = build_coverage(
+        planner, output, cell_m=args.cell_m, margin_km=args.margin_km,
+        progress=lambda done, total: print(f"\r{done}/{total}行", end="", flush=True),
+        road_version=road_graph_version(args.data_dir), safety_version=safety_version(args.data_dir)
+    )
+    rows, cols, k = coverage.table.shape
+    print(f"\n{output} に保存しました（{rows}×{cols}格子・{k}件、{time.perf_counter() - began:.1f}秒）")
@@ -0,0 +1,212 @@
+"""観光地・飲食店・避難所データの外部ファイル読み込み
+
+CSV / Parquet / GeoJSON を列指向の PoiTable（列名→NumPy配列）として読み込む。
+ファイルの更新時刻でキャッシュし、ファイルが変更されると自動的に再読み込みする。
+各POIは整数の 'id' 列（GeoJSON は Feature の id）で識別し、選択状態などは
+IDのリストで持って PoiIndex から元のデータを引く。
+"""
+import json
+import math
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# CSV / Parquet で "|" 区切りの文字列として保存するリスト列
+LIST_COLUMNS = ("facilities",)
+LIST_SEPARATOR = "|"
+
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def _clean(value):
+    """NumPyの値をPythonの値に変換（欠損値は None）"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class PoiTable:
+    """列指向のPOIテーブル"""
+
+    def __init__(self, columns, name="", version="", record_type=None):
+        self._columns = {key: np.asarray(values) for key, values in columns.items()}
+        lengths = {len(values) for values in self._columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"列の長さが揃っていません: {name}")
+        self._length = lengths.pop() if lengths else 0
+        for required in ("name", "lat", "lon"):
+            if required not in self._columns:
+                raise ValueError(f"{name}: 必須列 '{required}' がありません")
+        self._columns["lat"] = self._columns["lat"].astype(float)
+        self._columns["lon"] = self._columns["lon"].astype(float)
+        self._row_of = {}
+        if "id" in self._columns:
+            self._columns["id"] = self._columns["id"].astype(np.int64)
+            self._row_of = {poi_id: row for row, poi_id in enumerate(self._columns["id"].tolist())}
+            if len(self._row_of) != self._length:
+                raise ValueError(f"{name}: 'id' が重複しています")
+        self.name = name
+        self.version = version
+        self.record_type = record_type
+        self._records = None
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def __getitem__(self, i):
+        return self.records()[i]
+
+    @property
+    def column_names(self):
+        return list(self._columns)
+
+    def column(self, key):
+        """列の配列"""
+        return self._columns[key]
+
+    def ids(self):
+        """POIのIDの配列（'id' 列が無い場合は空）"""
+        return self._columns.get("id", np.zeros(0, dtype=np.int64))
+
+    def row_of(self, poi_id):
+        """IDの行番号。無い場合は None"""
+        return self._row_of.get(poi_id)
+
+    def points(self):
+        """(緯度, 経度) の2列配列"""
+        return np.column_stack((self._columns["lat"], self._columns["lon"]))
+
+    def records(self):
+        """表示用に1行ずつのレコード（record_type、未指定なら辞書）へ変換したリスト（初回のみ作成）"""
+        if self._records is None:
+            keys = list(self._columns)
+            rows = (
+                {key: _clean(self._columns[key][i]) for key in keys}
+                for i in range(self._length)
+            )
+            if self.record_type is None:
+                self._records = list(rows)
+            else:
+                self._records = [self.record_type.from_row(row) for row in rows]
+        return self._records
+
+
+class PoiIndex:
+    """複数の PoiTable にまたがる ID → データの索引"""
+
+    def __init__(self, *tables):
+        self.tables = tables
+        self._location = {}
+        for table in tables:
+            for poi_id in table.ids().tolist():
+                if poi_id in self._location:
+                    raise ValueError(f"{table.name}: 'id' {poi_id} が他のデータと重複しています")
+                self._location[poi_id] = (table, table.row_of(poi_id))
+
+    def __contains__(self, poi_id):
+        return poi_id in self._location
+
+    def record(self, poi_id):
+        """IDのデータ（辞書）"""
+        table, row = self._location[poi_id]
+        return table[row]
+
+    def records(self, ids):
+        """IDのリストの順にデータを返す（削除されたIDは除く）"""
+        return [self.record(poi_id) for poi_id in ids if poi_id in self._location]
+
+    def table_of(self, poi_id):
+        return self._location[poi_id][0]
+
+
+def _split_lists(frame):
+    for key in LIST_COLUMNS:
+        if key in frame.columns:
+            frame[key] = [
+                [] if value is None or (isinstance(value, float) and math.isnan(value))
+                else list(value) if not isinstance(value, str)
+                else [v for v in value.split(LIST_SEPARATOR) if v]
+                for value in frame[key]
+            ]
+    return frame
+
+
+def _object_column(values):
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _frame_to_columns(frame):
+    columns = {}
+    for key in frame.columns:
+        values = frame[key].tolist()
+        if key in LIST_COLUMNS:
+            columns[key] = _object_column(values)
+        else:
+            columns[key] = frame[key].to_numpy()
+    return columns
+
+
+def _read_geojson(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+    rows = []
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "Point":
+            raise ValueError(f"{path}: Point 以外のジオメトリには対応していません")
+        lon, lat = geometry["coordinates"][:2]
+        row = {"id": feature["id"]} if "id" in feature else {}
+        rows.append({**row, **feature.get("properties", {}), "lat": lat, "lon": lon})
+    keys = list(dict.fromkeys(key for row in rows for key in row))
+    columns = {}
+    for key in keys:
+        values = [row.get(key) for row in rows]
+        if key in LIST_COLUMNS or any(isinstance(v, (list, dict)) for v in values):
+            columns[key] = _object_column(values)
+        else:
+            columns[key] = np.array(values)
+    return columns
+
+
+def read_table(path, record_type=None):
+    """ファイルを読み込んで PoiTable を返す（キャッシュなし）"""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        columns = _frame_to_columns(_split_lists(pd.read_csv(path)))
+    elif suffix == ".parquet":
+        columns = _frame_to_columns(_split_lists(pd.read_parquet(path)))
+    elif suffix in (".geojson", ".json"):
+        columns = _read_geojson(path)
+    else:
+        raise ValueError(f"未対応のファイル形式です: {path}")
+    stat = path.stat()
+    return PoiTable(columns, name=path.stem, version=f"{path.stem}:{stat.st_mtime_ns}:{stat.st_size}",
+                    record_type=record_type)
+
+
+def load_table(path, record_type=None):
+    """更新時刻でキャッシュした PoiTable を返す。ファイルが変更されていれば再読み込み"""
+    path = os.fspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _LOCK:
+        cached = _CACHE.get((path, record_type))
+        if cached and cached[0] == key:
+            return cached[1]
+    table = read_table(path, record_type)
+    with _LOCK:
+        _CACHE[(path, record_type)] = (key, table)
+    return table
@@ -0,0 +1,123 @@
+"""NumPyによる一括距離計算（1対多・多対多）"""
+import numpy as np
+
+# 地球の平均半径（km）
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS84楕円体（Vincenty法で使用）
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+# 距離計算の精度モード
+METHODS = ("haversine", "vincenty")
+
+
+def _as_points(points):
+    """[[lat, lon], ...] 形式を (緯度配列, 経度配列) に変換"""
+    arr = np.asarray(points, dtype=float).reshape(-1, 2)
+    return arr[:, 0], arr[:, 1]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ハバーサイン公式による球面距離（km）。配列はブロードキャストされる"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """Vincenty法による楕円体距離（km）。収束しない組はハバーサインで補う"""
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2))
+    )
+    f = WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 +
+                                (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # 赤道上の測線では cos2_alpha = 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - lam_prev) < tol
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        dist = WGS84_B * A * (sigma - delta_sigma)
+
+    dist = np.where(sin_sigma == 0, 0.0, dist)
+    # 対蹠点付近など収束しなかった組
+    bad = ~converged | ~np.isfinite(dist)
+    if bad.any():
+        dist = np.where(bad, haversine(lat1, lon1, lat2, lon2), dist)
+    return dist
+
+
+def _pairwise(method):
+    if method == "haversine":
+        return haversine
+    if method == "vincenty":
+        return vincenty
+    raise ValueError(f"未対応の距離計算モードです: {method}")
+
+
+def distances_from(origin, points, method="haversine"):
+    """1地点から複数地点への距離（km）を1次元配列で返す"""
+    lats, lons = _as_points(points)
+    return _pairwise(method)(origin[0], origin[1], lats, lons)
+
+
+def distance_matrix(origins, destinations=None, method="haversine"):
+    """多対多の距離行列（km）。destinations 省略時は origins 同士"""
+    lat1, lon1 = _as_points(origins)
+    if destinations is None:
+        lat2, lon2 = lat1, lon1
+    else:
+        lat2, lon2 = _as_points(destinations)
+    return _pairwise(method)(lat1[:, None], lon1[:, None], lat2[None, :], lon2[None, :])
+
+
+def point_distance(lat1, lon1, lat2, lon2, method="haversine"):
+    """2点間の距離（km）"""
+    return float(_pairwise(method)(lat1, lon1, lat2, lon2))
+
+
+# 交通手段別の平均速度（km/h）
+TRANSPORT_SPEEDS = {
+    "walk": 4.8,      # 徒歩
+    "bicycle": 15,    # 自転車
+    "car": 30,        # 車（市街地）
+    "train": 45       # 鉄道（平均）
+}
+
+
+def travel_minutes(distance_km, transport_mode):
+    """交通手段別の所要時間（分）。配列もそのまま計算できる"""
+    return distance_km / TRANSPORT_SPEEDS[transport_mode] * 60
@@ -0,0 +1,278 @@
+"""浸水想定区域などの危険エリアを避ける避難ルート
+
+危険エリアはポリゴンで表し、通行止め（penalty なし）または距離の割り増し
+（penalty 倍）として扱う。エリアは実行中に追加・削除でき、道路グラフは
+作り直さずに辺の重みだけを差し替えて探索する。
+道路グラフが無い場合は、エリアの頂点を経由する迂回路（可視グラフ）を求める。
+"""
+import heapq
+import json
+import math
+import os
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from hita_navi.distance import haversine
+from hita_navi.road_graph import Route
+from hita_navi.spatial_index import BoxTree
+
+# 迂回路の経由点をポリゴンの外側へずらす量（度、約20m）
+DETOUR_MARGIN_DEG = 0.0002
+
+# 出発地・目的地を含む通行止めエリアは、抜け出せるよう割り増しとして扱う
+ESCAPE_PENALTY = 5.0
+
+
+@dataclass(frozen=True)
+class HazardArea:
+    """危険エリア。polygon は [[緯度, 経度], ...]、penalty が None なら通行止め"""
+    name: str
+    polygon: tuple
+    penalty: float = None
+    message: str = ""
+
+    @property
+    def blocked(self):
+        return self.penalty is None
+
+
+def _orient(p, q, r):
+    """3点の向き（外積の符号付き値）。配列はブロードキャストされる"""
+    return ((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1])
+            - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+
+def points_in_polygon(points, polygon):
+    """点群がポリゴン内にあるか（レイキャスティング法、ベクトル化）"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    a = np.asarray(polygon, dtype=float)
+    b = np.roll(a, -1, axis=0)
+    y, x = points[:, 0:1], points[:, 1:2]
+    straddle = (a[:, 0] > y) != (b[:, 0] > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cross_x = a[:, 1] + (y - a[:, 0]) * (b[:, 1] - a[:, 1]) / (b[:, 0] - a[:, 0])
+    return np.count_nonzero(straddle & (x < cross_x), axis=1) % 2 == 1
+
+
+def segments_hit_polygon(starts, ends, polygon):
+    """線分群がポリゴンと交わるか（端点・中点が内側、または辺と交差）"""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    a = np.asarray(polygon, dtype=float)
+    b = np.roll(a, -1, axis=0)
+    p, q = starts[:, None, :], ends[:, None, :]
+    o1 = _orient(p, q, a[None])
+    o2 = _orient(p, q, b[None])
+    o3 = _orient(a[None], b[None], p)
+    o4 = _orient(a[None], b[None], q)
+    crossing = np.any((o1 * o2 < 0) & (o3 * o4 < 0), axis=1)
+    inside = (points_in_polygon(starts, polygon) | points_in_polygon(ends, polygon)
+              | points_in_polygon((starts + ends) / 2, polygon))
+    return crossing | inside
+
+
+class HazardSet:
+    """実行中に更新できる危険エリアの集合
+
+    各エリアの外接矩形の R-tree（BoxTree）で、問い合わせ範囲と重なるエリアだけを
+    詳細判定する。更新のたびに version が進み、道路グラフの辺の重みは
+    (version, グラフ) ごとにキャッシュする。
+    """
+
+    def __init__(self, areas=()):
+        self._lock = threading.Lock()
+        self._weights = {}
+        self.version = 0
+        self._set_areas(list(areas))
+
+    def __len__(self):
+        return len(self.areas)
+
+    def __iter__(self):
+        return iter(self.areas)
+
+    def _set_areas(self, areas):
+        self.areas = tuple(areas)
+        boxes = [(min(p[0] for p in a.polygon), min(p[1] for p in a.polygon),
+                  max(p[0] for p in a.polygon), max(p[1] for p in a.polygon)) for a in self.areas]
+        self._boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+        self._tree = BoxTree(self._boxes)
+        self.version += 1
+        self._weights.clear()
+
+    def replace(self, areas):
+        """エリアをすべて入れ替える"""
+        with self._lock:
+            self._set_areas(areas)
+
+    def add(self, area):
+        with self._lock:
+            self._set_areas([a for a in self.areas if a.name != area.name] + [area])
+
+    def remove(self, name):
+        with self._lock:
+            self._set_areas([a for a in self.areas if a.name != name])
+
+    def candidates(self, lat_min, lon_min, lat_max, lon_max):
+        """外接矩形が範囲と重なるエリアの番号"""
+        return self._tree.query(lat_min, lon_min, lat_max, lon_max)
+
+    def areas_at(self, lat, lon):
+        """地点を含むエリアの一覧"""
+        return [self.areas[i] for i in self.candidates(lat, lon, lat, lon)
+                if points_in_polygon([[lat, lon]], self.areas[i].polygon)[0]]
+
+    def segment_factors(self, starts, ends, exempt=()):
+        """線分ごとの距離の倍率（通行止めは inf、危険エリア外は 1）"""
+        starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        factors = np.ones(len(starts))
+        if not len(starts):
+            return factors
+        lo = np.minimum(starts, ends)
+        hi = np.maximum(starts, ends)
+        for i in self.candidates(lo[:, 0].min(), lo[:, 1].min(), hi[:, 0].max(), hi[:, 1].max()):
+            area = self.areas[i]
+            box = self._boxes[i]
+            near = np.flatnonzero((lo[:, 0] <= box[2]) & (hi[:, 0] >= box[0])
+                                  & (lo[:, 1] <= box[3]) & (hi[:, 1] >= box[1]))
+            if not len(near):
+                continue
+            hit = near[segments_hit_polygon(starts[near], ends[near], area.polygon)]
+            if area.blocked and area.name not in exempt:
+                factor = math.inf
+            else:
+                factor = area.penalty if area.penalty is not None else ESCAPE_PENALTY
+            factors[hit] = np.maximum(factors[hit], factor)
+        return factors
+
+    def _exempt(self, origin, destination):
+        """出発地・目的地を含む通行止めエリア（その中からは抜け出せるようにする）"""
+        return frozenset(a.name for point in (origin, destination)
+                         for a in self.areas_at(point[0], point[1]) if a.blocked)
+
+    def edge_weights(self, graph, exempt=frozenset()):
+        """危険エリアを反映した道路グラフの辺の重み（リスト）"""
+        key = (self.version, id(graph), exempt)
+        cached = self._weights.get(key)
+        if cached is not None:
+            return cached
+        sources = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+        starts = np.column_stack((graph.node_lat[sources], graph.node_lon[sources]))
+        ends = np.column_stack((graph.node_lat[graph.indices], graph.node_lon[graph.indices]))
+        weights = (graph.weights * self.segment_factors(starts, ends, exempt)).tolist()
+        with self._lock:
+            self._weights[key] = weights
+        return weights
+
+    def route(self, graph, origin, destination):
+        """道路グラフ上で危険エリアを避けた最短経路（距離は倍率を掛ける前の道のり）"""
+        weights = self.edge_weights(graph, self._exempt(origin, destination)) if self.areas else None
+        return graph.route(origin, destination, weights=weights)
+
+    def detour(self, origin, destination):
+        """道路グラフが無い場合の迂回路。エリアの頂点を少し外側へずらした点を経由する"""
+        exempt = self._exempt(origin, destination)
+        points = [list(origin), list(destination)]
+        for area in self.areas:
+            polygon = np.asarray(area.polygon, dtype=float)
+            center = polygon.mean(axis=0)
+            offset = polygon - center
+            norm = np.maximum(np.linalg.norm(offset, axis=1, keepdims=True), 1e-12)
+            points += (polygon + offset / norm * DETOUR_MARGIN_DEG).tolist()
+        points = np.array(points)
+
+        # 可視グラフ: すべての点の組の線分に倍率を掛けた距離
+        i, j = np.triu_indices(len(points), k=1)
+        length = haversine(points[i, 0], points[i, 1], points[j, 0], points[j, 1])
+        cost = length * self.segment_factors(points[i], points[j], exempt)
+        adjacency = [[] for _ in range(len(points))]
+        for a, b, c in zip(i.tolist(), j.tolist(), cost.tolist()):
+            if math.isfinite(c):
+                adjacency[a].append((b, c))
+                adjacency[b].append((a, c))
+
+        best = {0: 0.0}
+        prev = {}
+        done = set()
+        heap = [(0.0, 0)]
+        while heap:
+            g, u = heapq.heappop(heap)
+            if u == 1:
+                break
+            if u in done:
+                continue
+            done.add(u)
+            for v, c in adjacency[u]:
+                if g + c < best.get(v, math.inf):
+                    best[v] = g + c
+                    prev[v] = u
+                    heapq.heappush(heap, (g + c, v))
+        else:
+            return Route(math.inf, [list(origin), list(destination)], [])
+
+        path = [1]
+        while path[-1] != 0:
+            path.append(prev[path[-1]])
+        path.reverse()
+        geometry = points[path].tolist()
+        distance = float(sum(haversine(a[0], a[1], b[0], b[1]) for a, b in zip(geometry, geometry[1:])))
+        return Route(distance, geometry, [], best[1])
+
+
+def read_hazards(path):
+    """GeoJSON（Polygon / MultiPolygon）から危険エリアを読み込む"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+    areas = []
+    for n, feature in enumerate(features):
+        geometry = feature.get("geometry") or {}
+        properties = feature.get("properties") or {}
+        if geometry.get("type") == "Polygon":
+            rings = [geometry["coordinates"][0]]
+        elif geometry.get("type") == "MultiPolygon":
+            rings = [polygon[0] for polygon in geometry["coordinates"]]
+        else:
+            raise ValueError(f"{path}: Polygon / MultiPolygon 以外のジオメトリには対応していません")
+        name = str(properties.get("name", f"area-{n}"))
+        penalty = properties.get("penalty")
+        for k, ring in enumerate(rings):
+            # GeoJSON は [経度, 緯度] の順。閉じた最後の点は除く
+            if len(ring) > 1 and ring[0] == ring[-1]:
+                ring = ring[:-1]
+            polygon = tuple((float(lat), float(lon)) for lon, lat, *_ in ring)
+            areas.append(HazardArea(name if len(rings) == 1 else f"{name}#{k}", polygon,
+                                    None if penalty is None else float(penalty),
+                                    properties.get("message", "")))
+    return areas
+
+
+_SETS = {}
+_SETS_LOCK = threading.Lock()
+
+
+def load_hazards(path):
+    """ファイルごとに共有される HazardSet。ファイルが更新されていればエリアを入れ替える（無ければ空）"""
+    path = os.fspath(path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+    key = None if stat is None else (stat.st_mtime_ns, stat.st_size)
+    with _SETS_LOCK:
+        cached = _SETS.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    areas = [] if stat is None else read_hazards(path)
+    with _SETS_LOCK:
+        cached = _SETS.get(path)
+        if cached:
+            cached[1].replace(areas)
+            hazards = cached[1]
+        else:
+            hazards = HazardSet(areas)
+        _SETS[path] = (key, hazards)
+    return hazards
@@ -0,0 +1,215 @@
+"""到達圏（N分以内に行ける範囲）の計算
+
+出発地から所要時間の上限までの距離を道路ネットワーク上で探索し（道路グラフが
+無い場合は直線距離）、到達できる範囲を格子に塗ってから輪郭の多角形にする。
+道路から外れる部分は、節点から残りの距離（最大 OFFROAD_M）の範囲を到達圏に含める。
+結果は (出発地の格子, 交通手段, 分) ごとにキャッシュし、POIが到達圏内かどうかは
+格子を引くだけで判定できる。
+"""
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from hita_navi.distance import TRANSPORT_SPEEDS
+from hita_navi.route_cache import start_cell
+from hita_navi.spatial_index import KM_PER_DEG_LAT
+
+# 到達圏を塗る格子の大きさ（m）
+ISOCHRONE_CELL_M = 50.0
+
+# 道路の節点から道路外へ歩ける距離の上限（m）
+OFFROAD_M = 100.0
+
+# 出発地をまとめる格子の大きさ（m）とキャッシュの件数
+ORIGIN_CELL_M = 100.0
+ISOCHRONE_CACHE_SIZE = 128
+
+
+def reach_km(minutes, transport_mode):
+    """交通手段別に minutes 分で進める距離（km）"""
+    return TRANSPORT_SPEEDS[transport_mode] * minutes / 60
+
+
+@dataclass
+class Isochrone:
+    """到達圏の格子（mask の行は北から南、列は西から東）"""
+    origin: tuple
+    minutes: float
+    transport_mode: str
+    north: float
+    west: float
+    step_lat: float
+    step_lon: float
+    mask: np.ndarray
+
+    def contains(self, lats, lons):
+        """各地点が到達圏内か（配列で返す）"""
+        rows = np.floor((self.north - np.asarray(lats, dtype=float)) / self.step_lat).astype(np.int64)
+        cols = np.floor((np.asarray(lons, dtype=float) - self.west) / self.step_lon).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.mask.shape[0]) & (cols >= 0) & (cols < self.mask.shape[1])
+        reachable = np.zeros(len(rows), dtype=bool)
+        reachable[inside] = self.mask[rows[inside], cols[inside]]
+        return reachable
+
+    def contains_point(self, lat, lon):
+        return bool(self.contains([lat], [lon])[0])
+
+    def rings(self):
+        """輪郭の多角形の一覧（[[緯度, 経度], ...] の閉じた環。穴も同じ一覧に含む）"""
+        return [[[self.north - row * self.step_lat, self.west + col * self.step_lon] for row, col in ring]
+                for ring in outline_rings(self.mask)]
+
+
+def outline_rings(mask):
+    """格子の塗った部分の境界を (行, 列) の格子点の環にする（塗った側を左に見る向き）"""
+    padded = np.pad(np.asarray(mask, dtype=bool), 1)
+    inner = padded[1:-1, 1:-1]
+    # 各セルの4辺のうち、隣が塗られていない辺を境界の有向辺にする
+    edges = {}
+    for dr, dc, start, end in ((-1, 0, (0, 1), (0, 0)),   # 北の辺は東→西
+                               (1, 0, (1, 0), (1, 1)),    # 南の辺は西→東
+                               (0, -1, (0, 0), (1, 0)),   # 西の辺は北→南
+                               (0, 1, (1, 1), (0, 1))):   # 東の辺は南→北
+        neighbor = padded[1 + dr:padded.shape[0] - 1 + dr, 1 + dc:padded.shape[1] - 1 + dc]
+        for row, col in zip(*np.nonzero(inner & ~neighbor)):
+            a = (int(row) + start[0], int(col) + start[1])
+            b = (int(row) + end[0], int(col) + end[1])
+            edges.setdefault(a, []).append(b)
+    rings = []
+    while edges:
+        first = next(iter(edges))
+        ring = [first]
+        point = first
+        while True:
+            targets = edges[point]
+            nxt = targets.pop()
+            if not targets:
+                del edges[point]
+            if nxt == first:
+                break
+            ring.append(nxt)
+            point = nxt
+        rings.append(_simplify(ring))
+    return rings
+
+
+def _simplify(ring):
+    """一直線上に並ぶ途中の格子点を除く"""
+    kept = []
+    count = len(ring)
+    for i, point in enumerate(ring):
+        before, after = ring[i - 1], ring[(i + 1) % count]
+        if (point[0] - before[0]) * (after[1] - point[1]) != (point[1] - before[1]) * (after[0] - point[0]):
+            kept.append(point)
+    return kept + kept[:1]
+
+
+class IsochroneEngine:
+    """到達圏の計算とキャッシュ（スレッドセーフ）。道路グラフが無い場合は直線距離の円"""
+
+    def __init__(self, road_graph=None, cell_m=ISOCHRONE_CELL_M, offroad_m=OFFROAD_M,
+                 origin_cell_m=ORIGIN_CELL_M, maxsize=ISOCHRONE_CACHE_SIZE):
+        self.road_graph = road_graph
+        self.cell_m = cell_m
+        self.offroad_m = offroad_m
+        self.origin_cell_m = origin_cell_m
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _origin(self, location):
+        """出発地を格子の中心に丸める（同じ格子の出発地は同じ到達圏になる）"""
+        row, col = start_cell(location, self.origin_cell_m)
+        step_lat = self.origin_cell_m / 1000 / KM_PER_DEG_LAT
+        step_lon = step_lat / max(math.cos(math.radians(float(location[0]))), 1e-6)
+        return (row, col), ((row + 0.5) * step_lat, (col + 0.5) * step_lon)
+
+    def isochrone(self, location, minutes, transport_mode="walk"):
+        """location から minutes 分以内に transport_mode で到達できる範囲"""
+        cell, origin = self._origin(location)
+        key = (cell, transport_mode, float(minutes))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+        result = self._compute(origin, float(minutes), transport_mode)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return result
+
+    def _sources(self, origin, limit_km):
+        """到達できる地点と、そこから道路外へ進める残りの距離（km）"""
+        if self.road_graph is None:
+            return np.array([origin]), np.array([limit_km])
+        source, snap = self.road_graph.nearest_node(origin[0], origin[1])
+        reached = self.road_graph.dijkstra(source, limit_km=limit_km - snap)
+        nodes = np.fromiter(reached.keys(), dtype=np.int64, count=len(reached))
+        slack = limit_km - snap - np.fromiter(reached.values(), dtype=float, count=len(reached))
+        points = np.asarray(self.road_graph.node_geometry(nodes), dtype=float).reshape(-1, 2)
+        # 出発地から最寄りの節点までは道路外を歩く
+        points = np.vstack((points, [origin]))
+        slack = np.concatenate((np.minimum(slack, self.offroad_m / 1000), [min(snap, limit_km)]))
+        return points, slack
+
+    def _compute(self, origin, minutes, transport_mode):
+        limit_km = reach_km(minutes, transport_mode)
+        step_lat = self.cell_m / 1000 / KM_PER_DEG_LAT
+        step_lon = step_lat / max(math.cos(math.radians(origin[0])), 1e-6)
+        margin_lat = limit_km / KM_PER_DEG_LAT + step_lat
+        margin_lon = margin_lat * step_lon / step_lat
+        north, west = origin[0] + margin_lat, origin[1] - margin_lon
+        shape = (int(math.ceil(2 * margin_lat / step_lat)), int(math.ceil(2 * margin_lon / step_lon)))
+        mask = np.zeros(shape, dtype=bool)
+
+        points, slack = self._sources(origin, limit_km)
+        for (lat, lon), radius_km in zip(points, slack):
+            # 地点を中心に残りの距離の円を塗る（円を囲む範囲のセルの中心で判定）
+            radius_lat = radius_km / KM_PER_DEG_LAT
+            radius_lon = radius_lat * step_lon / step_lat
+            r0 = max(int((north - lat - radius_lat) / step_lat), 0)
+            r1 = min(int((north - lat + radius_lat) / step_lat) + 1, shape[0])
+            c0 = max(int((lon - radius_lon - west) / step_lon), 0)
+            c1 = min(int((lon + radius_lon - west) / step_lon) + 1, shape[1])
+            if r0 >= r1 or c0 >= c1:
+                continue
+            rows = north - (np.arange(r0, r1) + 0.5) * step_lat
+            cols = west + (np.arange(c0, c1) + 0.5) * step_lon
+            d_lat = (rows - lat)[:, None] / radius_lat if radius_lat else np.inf
+            d_lon = (cols - lon)[None, :] / radius_lon if radius_lon else np.inf
+            mask[r0:r1, c0:c1] |= d_lat ** 2 + d_lon ** 2 <= 1.0
+        # 出発地のセルは常に含める
+        mask[int(margin_lat / step_lat), int(margin_lon / step_lon)] = True
+        return Isochrone(tuple(origin), minutes, transport_mode, north, west, step_lat, step_lon, mask)
+
+    def reachable(self, location, minutes, transport_mode, places):
+        """places（レコードの一覧）のうち到達圏内のもの"""
+        if not places:
+            return []
+        area = self.isochrone(location, minutes, transport_mode)
+        inside = area.contains([place['lat'] for place in places], [place['lon'] for place in places])
+        return [place for place, ok in zip(places, inside) if ok]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "maxsize": self.maxsize}
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    mode = sys.argv[2] if len(sys.argv) > 2 else "walk"
+    engine = IsochroneEngine()
+    began = time.perf_counter()
+    area = engine.isochrone((33.32, 130.9417), minutes, mode)
+    print(f"{minutes:.0f}分（{mode}）: {area.mask.sum()}セル・{len(area.rings())}個の輪郭"
+          f"（{time.perf_counter() - began:.3f}秒）")
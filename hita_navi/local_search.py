@@ -0,0 +1,206 @@
+"""巡回ルートの局所探索による改善（2-opt / Or-opt / 焼きなまし法）
+
+どの初期解（近隣法など）にも後段として適用できる。
+"""
+import math
+import random
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from hita_navi.tsp import HELD_KARP_MAX_STOPS, nearest_neighbor_tour, route_length, solve_route
+
+# 改善とみなす最小の短縮量（km）
+EPSILON = 1e-9
+
+
+@dataclass
+class ImprovementResult:
+    """局所探索の結果（iterations は経路を短くする手を適用した回数の合計）"""
+    order: list
+    initial_length: float
+    length: float
+    iterations: int
+
+    @property
+    def improvement_pct(self):
+        """初期解からの短縮率（%）"""
+        if self.initial_length <= 0:
+            return 0.0
+        return (self.initial_length - self.length) / self.initial_length * 100
+
+
+def _extended(dist):
+    """終点用のダミー地点（全地点から距離0）を末尾に加えた距離行列"""
+    n = len(dist)
+    ext = np.zeros((n + 1, n + 1))
+    ext[:n, :n] = dist
+    return ext
+
+
+def _deadline_passed(deadline):
+    """deadline は打ち切る時刻（perf_counter）か、打ち切るときに True を返す関数"""
+    if callable(deadline):
+        return deadline()
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def _make_deadline(time_budget=None, should_stop=None):
+    """制限時間と中止の判定をまとめた deadline"""
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    if should_stop is None:
+        return deadline
+    return lambda: should_stop() or _deadline_passed(deadline)
+
+
+def two_opt(dist, order, deadline=None):
+    """2-opt法: 区間を反転して交差する経路を解消する"""
+    ext = _extended(dist)
+    path = np.array([0] + list(order) + [len(dist)])
+    m = len(order)
+    iterations = 0
+    improved = True
+    while improved and not _deadline_passed(deadline):
+        improved = False
+        for i in range(1, m):
+            ks = np.arange(i + 1, m + 1)
+            a, b = path[i - 1], path[i]
+            delta = (ext[a, path[ks]] + ext[b, path[ks + 1]]
+                     - ext[a, b] - ext[path[ks], path[ks + 1]])
+            best = int(np.argmin(delta))
+            if delta[best] < -EPSILON:
+                k = ks[best]
+                path[i:k + 1] = path[i:k + 1][::-1]
+                iterations += 1
+                improved = True
+    return path[1:-1].tolist(), iterations
+
+
+def or_opt(dist, order, deadline=None, max_segment=3):
+    """Or-opt法: 1〜3地点の区間を別の位置へ移動する（反転も考慮）"""
+    ext = _extended(dist)
+    path = [0] + list(order) + [len(dist)]
+    m = len(order)
+    iterations = 0
+    improved = True
+    while improved and not _deadline_passed(deadline):
+        improved = False
+        for seg_len in range(1, min(max_segment, m - 1) + 1):
+            for i in range(1, m - seg_len + 2):
+                p = np.array(path)
+                first, last = p[i], p[i + seg_len - 1]
+                prev, nxt = p[i - 1], p[i + seg_len]
+                removal = ext[prev, first] + ext[last, nxt] - ext[prev, nxt]
+
+                # 区間を除いた経路上の挿入先（辺 rest[j]→rest[j+1]）
+                rest = np.concatenate((p[:i], p[i + seg_len:]))
+                a, b = rest[:-1], rest[1:]
+                forward = ext[a, first] + ext[last, b] - ext[a, b]
+                backward = ext[a, last] + ext[first, b] - ext[a, b]
+                forward[i - 1] = np.inf  # 元の位置
+                backward[i - 1] = np.inf
+
+                j_fwd, j_bwd = int(np.argmin(forward)), int(np.argmin(backward))
+                if forward[j_fwd] <= backward[j_bwd]:
+                    j, gain, segment = j_fwd, removal - forward[j_fwd], p[i:i + seg_len]
+                else:
+                    j, gain, segment = j_bwd, removal - backward[j_bwd], p[i:i + seg_len][::-1]
+                if gain > EPSILON:
+                    rest = rest.tolist()
+                    path = rest[:j + 1] + segment.tolist() + rest[j + 1:]
+                    iterations += 1
+                    improved = True
+    return path[1:-1], iterations
+
+
+def simulated_annealing(dist, order, deadline=None, seed=None,
+                        initial_temperature=None, cooling=0.9995):
+    """焼きなまし法: ランダムな区間反転を確率的に受理する（制限時間内）
+
+    回数は 2-opt / Or-opt と同じく、受理した手のうち経路を短くしたものを数える。
+    """
+    if deadline is None:
+        deadline = time.perf_counter() + 1.0
+    rng = random.Random(seed)
+    ext = _extended(dist)
+    path = [0] + list(order) + [len(dist)]
+    m = len(order)
+    if m < 3:
+        return list(order), 0
+
+    current = route_length(dist, order)
+    best_path, best = list(path), current
+    temperature = initial_temperature or current / m * 0.1
+    iterations = 0
+    while not _deadline_passed(deadline) and temperature > 1e-6:
+        i = rng.randint(1, m - 1)
+        k = rng.randint(i + 1, m)
+        a, b, c, d = path[i - 1], path[i], path[k], path[k + 1]
+        delta = ext[a, c] + ext[b, d] - ext[a, b] - ext[c, d]
+        if delta < 0 or rng.random() < math.exp(-delta / temperature):
+            path[i:k + 1] = path[i:k + 1][::-1]
+            current += delta
+            if delta < -EPSILON:
+                iterations += 1
+            if current < best - EPSILON:
+                best_path, best = list(path), current
+        temperature *= cooling
+    return best_path[1:-1], iterations
+
+
+# 利用可能な改善ステージ
+IMPROVERS = {
+    "2opt": two_opt,
+    "oropt": or_opt,
+    "sa": simulated_annealing,
+}
+
+
+def improve_route(dist, order, stages=("2opt", "oropt"), time_budget=None,
+                  on_progress=None, should_stop=None):
+    """指定したステージを順に適用し、改善がなくなるまで繰り返す
+
+    on_progress(ステージ名, 訪問順, 総距離) は改善のたびに呼ばれる。
+    should_stop() が True を返すと、その時点の最良解で打ち切る。
+    """
+    deadline = _make_deadline(time_budget, should_stop)
+    initial = route_length(dist, order)
+    best_order, best = list(order), initial
+    iterations = 0
+    improved = True
+    while improved and not _deadline_passed(deadline):
+        improved = False
+        for stage in stages:
+            if stage not in IMPROVERS:
+                raise ValueError(f"未対応の改善ステージです: {stage}")
+            if stage == "sa" and time_budget is None:
+                continue  # 焼きなまし法は制限時間がある場合のみ
+            candidate, count = IMPROVERS[stage](dist, best_order, deadline=deadline)
+            length = route_length(dist, candidate)
+            iterations += count
+            if length < best - EPSILON:
+                best_order, best = candidate, length
+                improved = True
+                if on_progress is not None:
+                    on_progress(stage, best_order, best)
+    return ImprovementResult(best_order, initial, best, iterations)
+
+
+def solve_and_improve(dist, stages=("2opt", "oropt"), time_budget=None,
+                      exact_limit=HELD_KARP_MAX_STOPS, on_progress=None, should_stop=None):
+    """厳密解が得られる規模はそのまま、それ以上は近似解に局所探索を適用する
+
+    on_progress を指定すると、厳密解の計算前にも近隣法の解を途中経過として渡す。
+    """
+    if on_progress is not None and len(dist) > 2:
+        # 厳密解・局所探索の前に、すぐ求まる近隣法の解を知らせる
+        order = nearest_neighbor_tour(dist)
+        on_progress("nearest", order, route_length(dist, order))
+    order = solve_route(dist, exact_limit=exact_limit)
+    if len(order) <= exact_limit:
+        length = route_length(dist, order)
+        if on_progress is not None:
+            on_progress("exact", order, length)
+        return ImprovementResult(order, length, length, 0)
+    return improve_route(dist, order, stages, time_budget, on_progress, should_stop)
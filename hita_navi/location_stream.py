@@ -0,0 +1,40 @@
+"""ブラウザの位置情報を受け取る Streamlit コンポーネント
+
+ブラウザ側（location_frontend/index.html）は watchPosition で位置の変化を
+受け取り、前回送った位置から一定距離以上動いた場合だけ、最短間隔を空けて
+Python 側へ送る。送られた位置はコンポーネントの値として返り、呼び出し側で
+st.session_state.current_location に反映する。
+"""
+from pathlib import Path
+
+import streamlit.components.v1 as components
+
+from hita_navi.distance import point_distance
+
+# 位置を送る最小の移動距離（m）と最短間隔（ミリ秒）
+LOCATION_MIN_DISTANCE_M = 25.0
+LOCATION_DEBOUNCE_MS = 3000
+
+_FRONTEND_DIR = Path(__file__).resolve().parent / "location_frontend"
+_component = components.declare_component("hita_location", path=str(_FRONTEND_DIR))
+
+
+def location_stream(key="location", enabled=True, min_distance_m=LOCATION_MIN_DISTANCE_M,
+                    debounce_ms=LOCATION_DEBOUNCE_MS, high_accuracy=True):
+    """最後に受け取った位置 {lat, lon, accuracy, timestamp}。エラー時は {error, code}、未取得は None"""
+    return _component(enabled=enabled, min_distance_m=float(min_distance_m), debounce_ms=int(debounce_ms),
+                      high_accuracy=high_accuracy, key=key, default=None)
+
+
+def moved(current, position, min_distance_m=LOCATION_MIN_DISTANCE_M):
+    """position（コンポーネントの値）が current から min_distance_m 以上離れた位置か"""
+    if not position or "lat" not in position:
+        return False
+    distance_km = point_distance(current[0], current[1], position["lat"], position["lon"])
+    return distance_km * 1000 >= min_distance_m
+
+
+def in_bounds(position, bounds):
+    """position（コンポーネントの値）が bounds（南端, 西端, 北端, 東端）の範囲内か"""
+    south, west, north, east = bounds
+    return south <= position["lat"] <= north and west <= position["lon"] <= east
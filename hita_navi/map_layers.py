@@ -0,0 +1,37 @@
+"""静的レイヤーを使い回す folium 地図
+
+背景地図と観光地・避難所などの静的レイヤーはセッションごとに1回だけ作成して
+使い回し、再実行のたびには現在地やルートなどの動的レイヤーだけを作る。
+地図はセッション間で共有しない（st_folium が表示のたびに地図を書き換えるため）。
+"""
+from contextlib import contextmanager
+
+import folium
+
+
+def _stable_ids(element, base="div"):
+    """要素のIDを地図内の位置から決まる値にする（乱数のIDだと再実行ごとにHTMLが変わり、地図全体が再描画される）"""
+    element._id = base
+    for i, child in enumerate(element._children.values()):
+        _stable_ids(child, f"{base}_{i}")
+
+
+class LayeredMap:
+    """静的レイヤーを作成済みの地図（1つのセッションの中で使い回す）"""
+
+    def __init__(self, center, zoom, static_layers=()):
+        self.map = folium.Map(location=center, zoom_start=zoom)
+        for layer in static_layers:
+            layer.add_to(self.map)
+        _stable_ids(self.map)
+
+    @contextmanager
+    def dynamic(self, layers):
+        """動的レイヤーを st_folium の feature_group_to_add で表示する間だけ使う地図"""
+        try:
+            yield self.map
+        finally:
+            # st_folium は feature_group_to_add のレイヤーを地図に追加するため、表示後に取り外す
+            # （残すと次の再実行で静的レイヤーとして送られ、地図全体が再描画される）
+            for layer in layers:
+                self.map._children.pop(layer.get_name(), None)
@@ -0,0 +1,62 @@
+"""セッション単位の計算結果のメモ化
+
+現在地（一定の誤差で丸めた値）や選択中の地点などをキーに、距離順の一覧や
+ルートの集計結果を使い回す。件数の上限を超えると最も古く使われた結果から
+捨てる（LRU）。ヒット・ミスの回数は画面のデバッグ表示に使う。
+"""
+import math
+from collections import OrderedDict
+
+from hita_navi.spatial_index import KM_PER_DEG_LAT
+
+# 1セッションで保持する結果の件数
+MEMO_SIZE = 64
+
+# 現在地をこの距離（m）単位に丸めてキーにする
+LOCATION_TOLERANCE_M = 10.0
+
+
+def location_key(location, tolerance_m=LOCATION_TOLERANCE_M):
+    """現在地を tolerance_m 程度の格子に丸めたキー"""
+    lat, lon = float(location[0]), float(location[1])
+    step_lat = tolerance_m / 1000 / KM_PER_DEG_LAT
+    step_lon = step_lat / max(math.cos(math.radians(lat)), 1e-6)
+    return (round(lat / step_lat), round(lon / step_lon))
+
+
+class LRUMemo:
+    """件数上限付きのメモ（最も古く使われたものから削除）"""
+
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, compute):
+        """key の結果があれば返し、無ければ compute() で計算して保存する"""
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        value = compute()
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self), "maxsize": self.maxsize,
+                "hit_rate": self.hit_rate}
@@ -0,0 +1,163 @@
+"""プロセスプールによる多スタート局所探索
+
+ランダム化した近隣法で作った複数の初期解に局所探索を適用し、制限時間内で
+最も短いものを返す。初期解ごとに別のプロセス（別のコア）で計算し、
+ワーカーが空くたびに制限時間まで新しい初期解を試す。
+距離行列は pickle で各プロセスへ送らず、共有メモリに1回だけ書き込んで
+全プロセスから参照する。共有メモリの末尾1バイトは中止の合図に使う。
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from hita_navi.local_search import ImprovementResult, improve_route
+from hita_navi.tsp import nearest_neighbor_tour, route_length
+
+# 近隣法で次の地点を選ぶ候補数（近い順にこの数の中からランダムに選ぶ）
+RANDOM_CANDIDATES = 3
+
+# 制限時間を過ぎてから結果を待つ猶予（秒）
+RESULT_GRACE = 0.5
+
+# 途中経過・中止の確認間隔（秒）
+POLL_SECONDS = 0.1
+
+
+def default_workers():
+    """ワーカー数（1コアは画面の処理用に残す）"""
+    return max((os.cpu_count() or 2) - 1, 1)
+
+
+def randomized_nearest_tour(dist, rng, candidates=RANDOM_CANDIDATES):
+    """ランダム化した近隣法（未訪問の近い順 candidates 件から1つを選ぶ）"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    order = []
+    current = 0
+    for remaining in range(n - 1, 0, -1):
+        row = np.where(visited, np.inf, dist[current])
+        k = min(candidates, remaining)
+        nearest = np.argpartition(row, k - 1)[:k]
+        current = int(rng.choice(nearest))
+        visited[current] = True
+        order.append(current)
+    return order
+
+
+def _run_start(name, shape, seed, stages, deadline):
+    """ワーカー: 1つの初期解を作って局所探索する。(訪問順, 総距離, 改善回数) か None を返す"""
+    try:
+        # spawn で起動したワーカーは親と同じ resource_tracker を使うため、削除は親に任せる
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return None  # 開始前に求解が終わった
+    try:
+        return _improve_start(shm, shape, seed, stages, deadline)
+    finally:
+        shm.close()
+
+
+def _improve_start(shm, shape, seed, stages, deadline):
+    dist = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    stop = np.ndarray((1,), dtype=np.uint8, buffer=shm.buf, offset=dist.nbytes)
+    remaining = deadline - time.time()
+    if remaining <= 0 or stop[0]:
+        return None
+    if seed is None:
+        order = nearest_neighbor_tour(dist)
+    else:
+        order = randomized_nearest_tour(dist, np.random.default_rng(seed))
+    result = improve_route(dist, order, stages, remaining, should_stop=lambda: bool(stop[0]))
+    return [int(i) for i in result.order], result.length, result.iterations
+
+
+class ParallelSolver:
+    """多スタート局所探索を実行するプロセスプール（プロセスは最初の求解時に起動）"""
+
+    def __init__(self, workers=None):
+        self.workers = workers or default_workers()
+        # Streamlit のスレッドを複製しないよう fork ではなく spawn で起動する
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    def solve(self, dist, time_budget=2.0, stages=("2opt", "oropt"), starts=None, seed=None,
+              on_progress=None, should_stop=None):
+        """制限時間内で最も短い巡回順を返す
+
+        1つ目の初期解は通常の近隣法。starts は試す初期解の上限（None なら制限時間まで）。
+        """
+        dist = np.ascontiguousarray(dist, dtype=np.float64)
+        rng = np.random.default_rng(seed)
+        initial = route_length(dist, nearest_neighbor_tour(dist))
+        deadline = time.time() + time_budget
+
+        shm = shared_memory.SharedMemory(create=True, size=dist.nbytes + 1)
+        try:
+            np.ndarray(dist.shape, dtype=np.float64, buffer=shm.buf)[:] = dist
+            shm.buf[dist.nbytes] = 0
+
+            def launch(start_seed):
+                return self._executor.submit(_run_start, shm.name, dist.shape, start_seed, stages, deadline)
+
+            first = min(self.workers, starts or self.workers)
+            pending = {launch(None if i == 0 else int(rng.integers(2 ** 63))) for i in range(first)}
+            launched = first
+            best_order, best, iterations = None, np.inf, 0
+            while pending and time.time() < deadline + RESULT_GRACE:
+                if should_stop is not None and should_stop():
+                    break
+                done, pending = wait(pending, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found = future.result()
+                    if found is None:
+                        continue
+                    iterations += found[2]
+                    if found[1] < best:
+                        best_order, best = found[0], found[1]
+                        if on_progress is not None:
+                            on_progress("multistart", best_order, best)
+                    # 空いたワーカーで次の初期解を試す
+                    if (starts is None or launched < starts) and time.time() < deadline:
+                        pending.add(launch(int(rng.integers(2 ** 63))))
+                        launched += 1
+            # 実行中のワーカーには中止を知らせ、未開始の初期解は取り消す
+            shm.buf[dist.nbytes] = 1
+            for future in pending:
+                future.cancel()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        if best_order is None:
+            best_order = nearest_neighbor_tour(dist)
+            best = route_length(dist, best_order)
+        return ImprovementResult(best_order, initial, best, iterations)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from hita_navi.local_search import solve_and_improve
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    points = np.random.default_rng(0).random((n + 1, 2))
+    matrix = np.linalg.norm(points[:, None] - points[None], axis=2)
+
+    began = time.perf_counter()
+    single = solve_and_improve(matrix, time_budget=budget)
+    print(f"単一スタート: {single.length:.3f}（{time.perf_counter() - began:.1f}秒）")
+
+    solver = ParallelSolver()
+    began = time.perf_counter()
+    multi = solver.solve(matrix, time_budget=budget)
+    print(f"多スタート（{solver.workers}プロセス）: {multi.length:.3f}（{time.perf_counter() - began:.1f}秒）")
+    solver.shutdown()
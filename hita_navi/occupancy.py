@@ -0,0 +1,244 @@
+"""避難所の入所状況（現在の避難者数）の共有ストア
+
+保存先はメモリ・SQLite・Redis から選べる（open_backend の URL で指定）。
+多数のセッションが定期的に読むため、読み取りは有効期限の短いキャッシュを
+通し、保存先へは期限切れ後の最初の1回だけ問い合わせる。入所・退所の記録は
+まとめて一定間隔で書き込む（書き込み前の分も読み取り結果には反映する）。
+"""
+import atexit
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 読み取りキャッシュの有効期限（秒）
+OCCUPANCY_TTL = 2.0
+
+# 記録をまとめて書き込む間隔（秒）と、間隔を待たずに書き込む件数
+FLUSH_SECONDS = 1.0
+FLUSH_MAX_PENDING = 256
+
+REDIS_KEY = "hita_navi:occupancy"
+
+# 上書きと増減を1回で適用する（増減後の人数は 0 未満にしない。SQLite の MAX(count + ?, 0) と同じ）
+# ARGV: 上書きの件数, 避難所ID, 人数, ..., 避難所ID, 増減, ...
+REDIS_WRITE_SCRIPT = """
+local absolute = tonumber(ARGV[1])
+for i = 2, 2 * absolute, 2 do
+  redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+for i = 2 * absolute + 2, #ARGV, 2 do
+  local count = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0') + tonumber(ARGV[i + 1])
+  redis.call('HSET', KEYS[1], ARGV[i], math.max(count, 0))
+end
+"""
+
+
+class MemoryBackend:
+    """プロセス内のメモリに保存する（単一プロセスでの利用・動作確認用）"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def read_all(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def write(self, absolute, deltas):
+        """absolute（避難所ID → 人数）で上書きしてから deltas（避難所ID → 増減）を加える"""
+        with self._lock:
+            self._counts.update(absolute)
+            for shelter_id, delta in deltas.items():
+                self._counts[shelter_id] = max(self._counts.get(shelter_id, 0) + delta, 0)
+
+
+class SqliteBackend:
+    """SQLite のファイルに保存する（同じマシン上の複数プロセスで共有できる）"""
+
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS occupancy "
+                             "(shelter_id INTEGER PRIMARY KEY, count INTEGER NOT NULL, updated REAL NOT NULL)")
+            self._db.commit()
+
+    def read_all(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT shelter_id, count FROM occupancy").fetchall())
+
+    def write(self, absolute, deltas):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO occupancy VALUES (?, ?, ?) "
+                "ON CONFLICT(shelter_id) DO UPDATE SET count = excluded.count, updated = excluded.updated",
+                [(shelter_id, count, now) for shelter_id, count in absolute.items()]
+            )
+            self._db.executemany(
+                "INSERT INTO occupancy VALUES (?, MAX(?, 0), ?) "
+                "ON CONFLICT(shelter_id) DO UPDATE SET count = MAX(count + ?, 0), updated = excluded.updated",
+                [(shelter_id, delta, now, delta) for shelter_id, delta in deltas.items()]
+            )
+
+
+class RedisBackend:
+    """Redis（または互換サーバー）のハッシュに保存する（複数台のサーバーで共有する場合）"""
+
+    def __init__(self, url, key=REDIS_KEY):
+        try:
+            import redis
+        except ImportError as error:
+            raise RuntimeError("Redis への保存には redis が必要です（pip install redis）") from error
+        self._client = redis.Redis.from_url(url)
+        self._write = self._client.register_script(REDIS_WRITE_SCRIPT)
+        self.key = key
+
+    def read_all(self):
+        return {int(shelter_id): max(int(count), 0)
+                for shelter_id, count in self._client.hgetall(self.key).items()}
+
+    def write(self, absolute, deltas):
+        # スクリプトはサーバー上で不可分に実行されるため、他のサーバーの書き込みと混ざらない
+        if not absolute and not deltas:
+            return
+        args = [len(absolute)]
+        for items in (absolute.items(), deltas.items()):
+            for shelter_id, value in items:
+                args += [shelter_id, int(value)]
+        self._write(keys=[self.key], args=args)
+
+
+def open_backend(url):
+    """URL から保存先を作る: "memory://" / "sqlite:///パス" / "redis://ホスト:ポート/番号" """
+    if url.startswith("memory:"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SqliteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"未対応の保存先です: {url}")
+
+
+class OccupancyStore:
+    """読み取りキャッシュと書き込みのまとめを挟んだ入所状況の窓口（スレッドセーフ）"""
+
+    def __init__(self, backend, ttl=OCCUPANCY_TTL, flush_seconds=FLUSH_SECONDS,
+                 max_pending=FLUSH_MAX_PENDING):
+        self.backend = backend
+        self.ttl = ttl
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._cached = {}
+        self._cached_at = -np.inf
+        self._absolute = {}
+        self._deltas = {}
+        self._wake = threading.Event()
+        self._closed = False
+        self.reads = 0
+        self.backend_reads = 0
+        self.flushes = 0
+        self._flusher = threading.Thread(target=self._flush_loop, name="occupancy-flush", daemon=True)
+        self._flusher.start()
+        # 終了時にまだ書き込んでいない記録を保存する
+        atexit.register(self.close)
+
+    def counts(self):
+        """避難所ID → 現在の避難者数（まだ書き込んでいない記録も反映）"""
+        self.reads += 1
+        if time.monotonic() - self._cached_at > self.ttl:
+            # 期限切れ時は1スレッドだけが保存先を読み、他は読み終わりを待って同じ結果を使う
+            with self._read_lock:
+                if time.monotonic() - self._cached_at > self.ttl:
+                    cached = self.backend.read_all()
+                    with self._lock:
+                        self._cached, self._cached_at = cached, time.monotonic()
+                    self.backend_reads += 1
+        with self._lock:
+            counts = dict(self._cached)
+            counts.update(self._absolute)
+            for shelter_id, delta in self._deltas.items():
+                counts[shelter_id] = max(counts.get(shelter_id, 0) + delta, 0)
+        return counts
+
+    def occupancy(self, shelter_ids):
+        """shelter_ids の順の避難者数の配列"""
+        counts = self.counts()
+        return np.array([counts.get(int(shelter_id), 0) for shelter_id in shelter_ids], dtype=np.int64)
+
+    def remaining(self, shelters):
+        """避難所の表（PoiTable）の行の順に、残りの収容人数（0未満は0）の配列"""
+        return np.maximum(shelters.column('capacity') - self.occupancy(shelters.ids()), 0)
+
+    def add(self, shelter_id, delta):
+        """入所（正）・退所（負）を記録する"""
+        with self._lock:
+            self._deltas[int(shelter_id)] = self._deltas.get(int(shelter_id), 0) + int(delta)
+            pending = len(self._absolute) + len(self._deltas)
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def report(self, shelter_id, count):
+        """数え直した現在の避難者数を記録する（それまでの増減の記録は置き換える）"""
+        with self._lock:
+            self._absolute[int(shelter_id)] = max(int(count), 0)
+            self._deltas.pop(int(shelter_id), None)
+            pending = len(self._absolute) + len(self._deltas)
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def flush(self):
+        """まとめた記録を保存先へ書き込む"""
+        # 書き込み中に保存先を読み直さないよう、読み取りと同じロックを取る
+        with self._read_lock:
+            with self._lock:
+                absolute, deltas = self._absolute, self._deltas
+                self._absolute, self._deltas = {}, {}
+                if not absolute and not deltas:
+                    return
+                # 書き込み中の読み取りでも記録が消えて見えないよう、キャッシュへ先に反映する
+                self._cached = dict(self._cached)
+                self._cached.update(absolute)
+                for shelter_id, delta in deltas.items():
+                    self._cached[shelter_id] = max(self._cached.get(shelter_id, 0) + delta, 0)
+            try:
+                self.backend.write(absolute, deltas)
+            except Exception:
+                # 書き込めなかった記録は戻して次回に再送し、キャッシュは保存先から読み直す
+                with self._lock:
+                    newer = set(self._absolute)
+                    for shelter_id, count in absolute.items():
+                        self._absolute.setdefault(shelter_id, count)
+                    for shelter_id, delta in deltas.items():
+                        if shelter_id not in newer:
+                            self._deltas[shelter_id] = delta + self._deltas.get(shelter_id, 0)
+                    self._cached_at = -np.inf
+                raise
+        self.flushes += 1
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass  # 保存先に接続できない間は記録を保持して次の間隔で再試行する
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+
+    def stats(self):
+        return {"reads": self.reads, "backend_reads": self.backend_reads, "flushes": self.flushes}
@@ -0,0 +1,279 @@
+"""観光ルート・避難所の計算（Streamlit に依存しない）
+
+画面（streamlit_app.py）と一括処理の CLI（python -m hita_navi.batch）の
+両方から使う。データの読み込みは Planner.open で行い、セッションごとの
+キャッシュや表示は呼び出し側に任せる。
+"""
+from pathlib import Path
+
+import numpy as np
+
+from hita_navi.contraction import ContractionHierarchy
+from hita_navi.coverage import ShelterCoverage
+from hita_navi.datastore import PoiIndex, load_table
+from hita_navi.distance import point_distance, travel_minutes
+from hita_navi.hazard import HazardSet, load_hazards
+from hita_navi.isochrone import IsochroneEngine
+from hita_navi.local_search import solve_and_improve
+from hita_navi.poi_matrix import PoiMatrix, place_key
+from hita_navi.records import Place, Shelter
+from hita_navi.road_graph import RoadGraph
+from hita_navi.safety_raster import SafetyModel
+from hita_navi.scheduler import plan_schedule
+from hita_navi.spatial_index import GridIndex
+from hita_navi.tsp import HELD_KARP_MAX_STOPS
+
+# データファイル（data_dir からの相対パス）
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+TOURISM_FILE = "tourism_spots.csv"
+RESTAURANT_FILE = "restaurants.csv"
+SHELTER_FILE = "evacuation_centers.geojson"
+ROAD_GRAPH_FILES = ("hita_roads.npz", "hita_roads.osm")
+ROUTE_HIERARCHY_FILE = "hita_roads.ch.npz"
+HAZARD_FILE = "hazard_areas.geojson"
+RASTER_DIR = "rasters"
+COVERAGE_FILE = "shelter_coverage.npy"
+
+# 大規模ルートの改善ステージと制限時間（秒）の既定値
+ROUTE_IMPROVERS = ("2opt", "oropt")
+ROUTE_TIME_BUDGET = 2.0
+
+
+def calculate_distance(lat1, lon1, lat2, lon2, method="haversine"):
+    """2点間の距離を計算（km）"""
+    return point_distance(lat1, lon1, lat2, lon2, method=method)
+
+
+def calculate_travel_time(distance_km, transport_mode):
+    """交通手段別の所要時間を計算（分）"""
+    return travel_minutes(distance_km, transport_mode)
+
+
+def file_version(path):
+    """ファイルのバージョン（ファイル名と更新時刻）"""
+    path = Path(path)
+    return f"{path.name}:{path.stat().st_mtime_ns}"
+
+
+def road_graph_path(data_dir=DATA_DIR):
+    """使う道路グラフのファイル（変換済みの .npz を優先）。無い場合は None"""
+    return next((Path(data_dir) / name for name in ROAD_GRAPH_FILES if (Path(data_dir) / name).exists()), None)
+
+
+def road_graph_version(data_dir=DATA_DIR):
+    """道路グラフのバージョン。ファイルが無い場合は空文字列"""
+    path = road_graph_path(data_dir)
+    return file_version(path) if path is not None else ""
+
+
+def safety_version(data_dir=DATA_DIR):
+    """標高・浸水深ラスタのバージョン（全ファイルのファイル名と更新時刻）"""
+    raster_dir = Path(data_dir) / RASTER_DIR
+    files = sorted(raster_dir.glob("*.npy")) if raster_dir.exists() else []
+    return "|".join(file_version(path) for path in files)
+
+
+def estimated_safety_score(lat, lon):
+    """ラスタが無い場合の簡易的な安全性スコア"""
+    # 川からの距離、標高、建物密度などを考慮
+    # 実際の実装では地理データベースとの連携が必要
+    river_distance = abs(lat - 33.3223)  # 三隈川からの距離
+    elevation_factor = (lat - 33.31) * 100  # 簡易標高計算
+    return min(100, max(0, 50 + river_distance * 1000 + elevation_factor))
+
+
+class Planner:
+    """観光地・飲食店・避難所と道路・危険エリア・ラスタをまとめた計算の窓口"""
+
+    def __init__(self, tourism, restaurants, shelters, road_graph=None, hierarchy=None,
+                 hazards=None, safety=None, method="haversine", improvers=ROUTE_IMPROVERS,
+                 time_budget=ROUTE_TIME_BUDGET, parallel_solver=None,
+                 poi_matrix=None, spatial_index=None, poi_index=None, isochrones=None, coverage=None):
+        self.tables = {"tourism": tourism, "restaurants": restaurants, "shelters": shelters}
+        self.road_graph = road_graph
+        self.hierarchy = hierarchy
+        self.hazards = hazards if hazards is not None else HazardSet()
+        self.safety = safety if safety is not None else SafetyModel()
+        self.method = method
+        self.improvers = tuple(improvers)
+        self.time_budget = time_budget
+        # 指定すると厳密解の規模を超えるルートを多スタート探索する（hita_navi.multistart）
+        self.parallel_solver = parallel_solver
+        # 事前計算に時間のかかるものは呼び出し側で共有したものを渡せる
+        self.poi_matrix = poi_matrix or PoiMatrix(self.tables, method=method, road_graph=road_graph,
+                                                    hierarchy=hierarchy)
+        self.spatial_index = spatial_index or {
+            name: GridIndex(places.column('lat'), places.column('lon'))
+            for name, places in self.tables.items()
+        }
+        self.poi_index = poi_index or PoiIndex(tourism, restaurants, shelters)
+        self.isochrones = isochrones or IsochroneEngine(road_graph)
+        # 事前計算した避難所の到達表（hita_navi.coverage）。あれば rank_shelters は表を引くだけ
+        self.coverage = coverage
+
+    @classmethod
+    def open(cls, data_dir=DATA_DIR, **options):
+        """data_dir のファイルから読み込む（道路・縮約階層・危険エリア・ラスタ・到達表は無ければ使わない）"""
+        data_dir = Path(data_dir)
+        road_path = road_graph_path(data_dir)
+        road_graph = RoadGraph.load(str(road_path)) if road_path is not None else None
+        hierarchy = None
+        if road_graph is not None and (data_dir / ROUTE_HIERARCHY_FILE).exists():
+            hierarchy = ContractionHierarchy.load(data_dir / ROUTE_HIERARCHY_FILE)
+            if len(hierarchy) != len(road_graph):
+                hierarchy = None
+        hazard_path = data_dir / HAZARD_FILE
+        shelters = load_table(data_dir / SHELTER_FILE, Shelter)
+        if "coverage" not in options:
+            options["coverage"] = ShelterCoverage.open(
+                data_dir / COVERAGE_FILE, shelters, road_graph_version(data_dir), safety_version(data_dir)
+            )
+        return cls(
+            load_table(data_dir / TOURISM_FILE, Place),
+            load_table(data_dir / RESTAURANT_FILE, Place),
+            shelters,
+            road_graph=road_graph,
+            hierarchy=hierarchy,
+            hazards=load_hazards(hazard_path) if hazard_path.exists() else None,
+            safety=SafetyModel.open(data_dir / RASTER_DIR),
+            **options
+        )
+
+    @property
+    def tourism(self):
+        return self.tables["tourism"]
+
+    @property
+    def restaurants(self):
+        return self.tables["restaurants"]
+
+    @property
+    def shelters(self):
+        return self.tables["shelters"]
+
+    def distance(self, origin, destination):
+        """2地点間の直線距離（km）"""
+        return calculate_distance(origin[0], origin[1], destination[0], destination[1], self.method)
+
+    def nearest(self, group, location, k, keep=None):
+        """現在地から近い順に最大 k 件の (POIのリスト, 距離kmの配列) を返す。keep で絞り込み条件を指定"""
+        places = self.tables[group]
+        limit = k
+        while True:
+            idx, dist = self.spatial_index[group].nearest(location[0], location[1], limit)
+            found = [j for j, i in enumerate(idx) if keep is None or keep(places[i])]
+            if len(found) >= k or limit >= len(places):
+                found = found[:k]
+                return [places[idx[j]] for j in found], dist[found]
+            limit *= 2
+
+    def isochrone(self, location, minutes, transport_mode="walk"):
+        """minutes 分以内に到達できる範囲（hita_navi.isochrone.Isochrone）"""
+        return self.isochrones.isochrone(location, minutes, transport_mode)
+
+    def network_distances(self, origin, points):
+        """道路ネットワーク上の1地点から複数地点への距離（km）。道路データが無い場合は None"""
+        if self.hierarchy is not None:
+            return self.hierarchy.distances_to(origin, points)
+        if self.road_graph is not None:
+            return self.road_graph.distances_to(origin, points)
+        return None
+
+    def road_route(self, origin, destination):
+        """道路ネットワーク上の経路の距離（km）と形状（道路グラフが無い・到達できない場合は直線）"""
+        if self.road_graph is not None:
+            route = self.road_graph.route(origin, destination)
+            if route.found:
+                return route.distance_km, route.geometry
+        return self.distance(origin, destination), [list(origin), list(destination)]
+
+    def safe_route(self, origin, destination):
+        """危険エリアを避けた避難ルートの距離（km）と形状（避けられない場合は通常の経路）"""
+        if self.road_graph is not None:
+            route = self.hazards.route(self.road_graph, origin, destination)
+        else:
+            route = self.hazards.detour(origin, destination)
+        if route.found:
+            return route.distance_km, route.geometry
+        return self.road_route(origin, destination)
+
+    def route_geometry(self, start_location, route):
+        """ルート全体の地図表示用の形状"""
+        geometry = [list(start_location)]
+        previous = start_location
+        for spot in route:
+            point = [spot['lat'], spot['lon']]
+            geometry += self.road_route(previous, point)[1][1:]
+            previous = point
+        return geometry
+
+    def leg_distances(self, start_location, route):
+        """ルート各区間（前の地点→次の地点）の距離を計算（km）"""
+        if not route:
+            return np.zeros(0)
+        dist = self.poi_matrix.sub_matrix(start_location, route)
+        return dist[np.arange(len(route)), np.arange(1, len(route) + 1)]
+
+    def safety_score(self, lat, lon):
+        """地点の安全性スコア（ラスタがあれば標高・浸水深から、無ければ簡易版）"""
+        if self.safety.available:
+            score = self.safety.score_point(lat, lon)
+            if score is not None:
+                return score
+        return estimated_safety_score(lat, lon)
+
+    def score_routes(self, geometries):
+        """ルートごとの安全度（最小・平均）。ラスタが無い・範囲外のルートは None"""
+        if not self.safety.available:
+            return [None] * len(geometries)
+        return self.safety.score_routes(geometries)
+
+    def rank_shelters(self, location, k):
+        """近い避難所 k 件の (避難所のリスト, 距離の配列, 安全スコアの配列) を距離順・安全スコア順に返す"""
+        if self.coverage is not None:
+            found = self.coverage.lookup(location[0], location[1], k)
+            if found is not None:
+                ids, distances, safety_scores = found
+                return self.poi_index.records(ids.tolist()), distances, safety_scores
+        candidates, distances = self.nearest("shelters", location, k)
+        road_distances = self.network_distances(
+            location, [[shelter['lat'], shelter['lon']] for shelter in candidates]
+        )
+        if road_distances is not None:
+            distances = np.where(np.isfinite(road_distances), road_distances, distances)
+        # 安全スコアは現在地から避難所までの直線上の最も危険な地点で評価（ラスタが無ければ避難所の地点のみ）
+        route_safety = self.score_routes([
+            [location, [shelter['lat'], shelter['lon']]] for shelter in candidates
+        ])
+        safety_scores = np.array([
+            safety.minimum if safety is not None else self.safety_score(shelter['lat'], shelter['lon'])
+            for shelter, safety in zip(candidates, route_safety)
+        ])
+        order = np.lexsort((-safety_scores, distances))
+        return [candidates[i] for i in order], distances[order], safety_scores[order]
+
+    def solve_matrix(self, dist, on_progress=None, should_stop=None):
+        """距離行列（0番目が出発地）から訪問順を求める"""
+        if self.parallel_solver is not None and len(dist) - 1 > HELD_KARP_MAX_STOPS:
+            return self.parallel_solver.solve(
+                dist, time_budget=self.time_budget, stages=self.improvers,
+                on_progress=on_progress, should_stop=should_stop
+            )
+        return solve_and_improve(
+            dist, stages=self.improvers, time_budget=self.time_budget,
+            on_progress=on_progress, should_stop=should_stop
+        )
+
+    def optimize_route(self, start_location, destinations):
+        """最適ルート（訪問順の目的地）と局所探索による改善結果を返す
+
+        目的地は正規化した順に並べてから解くため、同じ目的地の組なら結果の順序は一定。
+        """
+        destinations = sorted(destinations, key=place_key)
+        result = self.solve_matrix(self.poi_matrix.sub_matrix(start_location, destinations))
+        return [destinations[i - 1] for i in result.order], result
+
+    def plan_schedule(self, start_location, places, **options):
+        """待ち時間・滞在時間・営業時間を含めたスケジュール（hita_navi.scheduler.plan_schedule）"""
+        return plan_schedule(start_location, places, method=self.method,
+                             poi_matrix=self.poi_matrix, **options)
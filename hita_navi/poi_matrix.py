@@ -0,0 +1,133 @@
+"""POI間の距離・所要時間行列の事前計算
+
+観光地・飲食店・避難所などの固定データ同士の行列はデータセットごとに
+1回だけ計算し、操作ごとには現在地からの1行だけを計算する。
+道路グラフを渡すとネットワーク距離（到達できない組は直線距離）を使う。
+ネットワーク距離は全組を事前計算せず、選ばれたPOIの組だけ計算して覚えておく
+（縮約階層を渡すとそのクエリを使う）。
+"""
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+from hita_navi.distance import distance_matrix, distances_from, travel_minutes
+
+
+def dataset_version(*datasets):
+    """データセットのバージョン文字列（PoiTable はファイルのバージョン、リストは内容のハッシュ）"""
+    parts = []
+    for data in datasets:
+        if hasattr(data, 'version'):
+            parts.append(data.version)
+        else:
+            payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+            parts.append(hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12])
+    return "|".join(parts)
+
+
+def place_key(place):
+    """POIを識別するキー（IDがあればID、無ければ名前と座標）"""
+    if place.get('id') is not None:
+        return int(place['id'])
+    return (place['name'], float(place['lat']), float(place['lon']))
+
+
+def _place_keys(places):
+    """各POIのキーと (緯度, 経度) の列。ID付きの PoiTable は列をそのまま使う"""
+    if hasattr(places, 'column'):
+        lats, lons = places.column('lat'), places.column('lon')
+        if len(places.ids()) == len(places):
+            return places.ids().tolist(), lats, lons
+        return list(zip(places.column('name'), lats.tolist(), lons.tolist())), lats, lons
+    return ([place_key(p) for p in places],
+            np.array([p['lat'] for p in places], dtype=float),
+            np.array([p['lon'] for p in places], dtype=float))
+
+
+class PoiMatrix:
+    """全POIの直線距離行列（km）と、選ばれた組のネットワーク距離。所要時間（分）は必要な部分だけ距離から換算する"""
+
+    def __init__(self, datasets, method="haversine", road_graph=None, hierarchy=None):
+        self.method = method
+        self.road_graph = road_graph
+        self.hierarchy = hierarchy
+        self.groups = {}
+        lats, lons = [], []
+        self._index = {}
+        count = 0
+        for name, places in datasets.items():
+            keys, group_lats, group_lons = _place_keys(places)
+            for i, key in enumerate(keys):
+                self._index.setdefault(key, count + i)
+            lats.append(group_lats)
+            lons.append(group_lons)
+            self.groups[name] = slice(count, count + len(group_lats))
+            count += len(group_lats)
+        self.points = np.column_stack((np.concatenate(lats), np.concatenate(lons))) if lats else np.zeros((0, 2))
+        self.distance = distance_matrix(self.points, method=method)
+        # 計算済みのネットワーク距離 {(行番号, 行番号): km}
+        self._network = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.points)
+
+    def distances_from(self, location, group=None):
+        """現在地から全POI（または指定グループ）への距離（km）"""
+        points = self.points if group is None else self.points[self.groups[group]]
+        if len(points) == 0:
+            return np.zeros(0)
+        return distances_from(location, points, method=self.method)
+
+    def indices_of(self, places):
+        """POIの行番号。未登録のPOIが含まれる場合は None"""
+        try:
+            return np.array([self._index[place_key(p)] for p in places], dtype=int)
+        except KeyError:
+            return None
+
+    def _row(self, location, points):
+        """現在地から各地点への距離（道路グラフがあればネットワーク距離）"""
+        straight = distances_from(location, points, method=self.method)
+        if self.road_graph is None:
+            return straight
+        if self.hierarchy is not None:
+            network = self.hierarchy.distances_to(location, points)
+        else:
+            network = self.road_graph.distances_to(location, points)
+        return np.where(np.isfinite(network), network, straight)
+
+    def _block(self, idx):
+        """idx のPOI同士の距離行列。ネットワーク距離はまだ計算していない組だけ求める"""
+        block = self.distance[np.ix_(idx, idx)]
+        if self.road_graph is None:
+            return block
+        for a, i in enumerate(idx):
+            missing = [j for j in idx if j != i and (i, j) not in self._network]
+            if missing:
+                row = self._row(self.points[i], self.points[missing])
+                with self._lock:
+                    self._network.update(((i, j), d) for j, d in zip(missing, row))
+            block[a] = [0.0 if j == i else self._network[(i, j)] for j in idx]
+        return block
+
+    def sub_matrix(self, location, places):
+        """現在地(0番目)と places からなる距離行列（km）。POI同士は計算済みの値を使う"""
+        idx = self.indices_of(places)
+        if idx is None:
+            points = [location] + [[p['lat'], p['lon']] for p in places]
+            return distance_matrix(points, method=self.method)
+        k = len(idx)
+        matrix = np.zeros((k + 1, k + 1))
+        matrix[1:, 1:] = self._block(idx)
+        if k:
+            row = self._row(location, self.points[idx])
+            matrix[0, 1:] = row
+            matrix[1:, 0] = row
+        return matrix
+
+    def travel_sub_matrix(self, location, places, transport_mode):
+        """現在地(0番目)と places からなる所要時間行列（分）"""
+        return travel_minutes(self.sub_matrix(location, places), transport_mode)
@@ -0,0 +1,67 @@
+"""観光地・飲食店・避難所のレコード型
+
+変更不可・__slots__ 付きのデータクラスで、1件ごとの辞書より小さく、
+全セッションで同じインスタンスを共有できる。距離など操作ごとに変わる値は
+レコードに持たせず、別の配列で扱う。
+既存の表示コードのため spot['name'] / spot.get('open') の形でも参照できる。
+"""
+from dataclasses import dataclass, fields
+
+
+class _ItemAccess:
+    """属性を辞書のキーとしても参照できるようにする"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, default)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return key in self.field_names()
+
+    @classmethod
+    def field_names(cls):
+        return tuple(f.name for f in fields(cls))
+
+    @classmethod
+    def from_row(cls, row):
+        """1行分の辞書から作成（型に無い列は使わない）"""
+        values = {name: row[name] for name in cls.field_names() if name in row}
+        if "facilities" in values:
+            values["facilities"] = tuple(values["facilities"] or ())
+        return cls(**values)
+
+
+@dataclass(frozen=True, slots=True)
+class Place(_ItemAccess):
+    """観光スポット・飲食店"""
+    id: int
+    name: str
+    category: str
+    lat: float
+    lon: float
+    wait_time: int = 0
+    visit_duration: int = 0
+    description: str = ""
+    rating: float = None
+    open: str = None
+    close: str = None
+
+
+@dataclass(frozen=True, slots=True)
+class Shelter(_ItemAccess):
+    """避難所"""
+    id: int
+    name: str
+    lat: float
+    lon: float
+    type: str = ""
+    capacity: int = 0
+    facilities: tuple = ()
+    safety_level: str = ""
@@ -0,0 +1,306 @@
+"""道路・歩道ネットワークによる経路探索
+
+OpenStreetMap の抽出ファイル（.osm XML）を読み込み、CSR形式の隣接構造に
+変換する。経路探索はハバーサイン距離をヒューリスティックとするA*法。
+変換結果は .npz に保存でき、次回以降はXMLを解析せずに読み込める。
+"""
+import heapq
+import math
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from hita_navi.distance import EARTH_RADIUS_KM, haversine
+from hita_navi.spatial_index import GridIndex
+
+# 交通手段別に通行できない道路種別（highway タグ）
+EXCLUDED_HIGHWAYS = {
+    "walk": {"motorway", "motorway_link", "trunk", "trunk_link", "construction",
+             "proposed", "raceway", "bus_guideway", "abandoned"},
+    "car": {"footway", "path", "pedestrian", "steps", "cycleway", "bridleway",
+            "corridor", "platform", "construction", "proposed", "elevator", "abandoned"},
+}
+
+# 通行不可とみなす access タグ
+NO_ACCESS = {"no", "private"}
+
+
+def _haversine_scalar(lat1, lon1, lat2, lon2):
+    """スカラー版のハバーサイン距離（km）。探索の内側ループ用"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+@dataclass
+class Route:
+    """経路探索の結果（distance_km は実際の道のり、cost は危険エリアの倍率を掛けた探索上のコスト）"""
+    distance_km: float
+    geometry: list
+    nodes: list
+    cost: float = None
+
+    def __post_init__(self):
+        if self.cost is None:
+            self.cost = self.distance_km
+
+    @property
+    def found(self):
+        return math.isfinite(self.distance_km)
+
+
+def _way_allowed(tags, profile):
+    highway = tags.get("highway")
+    if highway is None or highway in EXCLUDED_HIGHWAYS[profile]:
+        return False
+    if tags.get("access") in NO_ACCESS:
+        return False
+    if profile == "walk" and tags.get("foot") in NO_ACCESS:
+        return False
+    if profile == "car" and tags.get("motor_vehicle") in NO_ACCESS:
+        return False
+    return True
+
+
+def _oneway(tags, profile):
+    """一方通行（1: 順方向のみ, -1: 逆方向のみ, 0: 双方向）。徒歩は常に双方向"""
+    if profile != "car":
+        return 0
+    value = tags.get("oneway")
+    if value in ("yes", "true", "1") or tags.get("junction") == "roundabout":
+        return 1
+    if value == "-1":
+        return -1
+    return 0
+
+
+class RoadGraph:
+    """CSR形式の道路グラフ（辺の重みは距離km）"""
+
+    def __init__(self, node_lat, node_lon, indptr, indices, weights, profile="walk"):
+        self.node_lat = np.asarray(node_lat, dtype=float)
+        self.node_lon = np.asarray(node_lon, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=float)
+        self.profile = profile
+        self._index = GridIndex(self.node_lat, self.node_lon)
+        # 探索の内側ループではPythonのリストの方が速い
+        self._lat = self.node_lat.tolist()
+        self._lon = self.node_lon.tolist()
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._weights = self.weights.tolist()
+
+    def __len__(self):
+        return len(self.node_lat)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, node_lat, node_lon, sources, targets, profile="walk"):
+        """有向辺のリストからCSR形式のグラフを作成（重みは区間の距離）"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        node_lat = np.asarray(node_lat, dtype=float)
+        node_lon = np.asarray(node_lon, dtype=float)
+        weights = haversine(node_lat[sources], node_lon[sources], node_lat[targets], node_lon[targets])
+        order = np.argsort(sources, kind="stable")
+        counts = np.bincount(sources, minlength=len(node_lat))
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        return cls(node_lat, node_lon, indptr, targets[order], weights[order], profile)
+
+    @classmethod
+    def from_osm(cls, path, profile="walk"):
+        """OSM XML（.osm）を読み込んでグラフを作成"""
+        coords = {}
+        ways = []
+        for _, elem in ET.iterparse(path, events=("end",)):
+            if elem.tag == "node":
+                coords[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+                if _way_allowed(tags, profile):
+                    refs = [nd.get("ref") for nd in elem.iter("nd")]
+                    ways.append((refs, _oneway(tags, profile)))
+                elem.clear()
+            elif elem.tag == "relation":
+                elem.clear()
+
+        # 道路で使われる節点だけに通し番号を振る
+        number = {}
+        node_lat, node_lon = [], []
+        sources, targets = [], []
+        for refs, oneway in ways:
+            refs = [ref for ref in refs if ref in coords]
+            for ref in refs:
+                if ref not in number:
+                    number[ref] = len(node_lat)
+                    lat, lon = coords[ref]
+                    node_lat.append(lat)
+                    node_lon.append(lon)
+            for a, b in zip(refs, refs[1:]):
+                u, v = number[a], number[b]
+                if u == v:
+                    continue
+                if oneway >= 0:
+                    sources.append(u)
+                    targets.append(v)
+                if oneway <= 0:
+                    sources.append(v)
+                    targets.append(u)
+        return cls.from_edges(node_lat, node_lon, sources, targets, profile)
+
+    def save(self, path):
+        """変換済みのグラフを .npz に保存"""
+        np.savez_compressed(path, node_lat=self.node_lat, node_lon=self.node_lon,
+                            indptr=self.indptr, indices=self.indices, weights=self.weights,
+                            profile=np.array(self.profile))
+
+    @classmethod
+    def load(cls, path, profile="walk"):
+        """.npz（変換済み）または .osm（XML）からグラフを読み込む"""
+        path = Path(path)
+        if path.suffix == ".npz":
+            data = np.load(path)
+            return cls(data["node_lat"], data["node_lon"], data["indptr"], data["indices"],
+                       data["weights"], str(data["profile"]))
+        return cls.from_osm(path, profile)
+
+    def nearest_node(self, lat, lon):
+        """最寄りの節点番号とその距離（km）"""
+        idx, dist = self._index.nearest(lat, lon, 1)
+        return int(idx[0]), float(dist[0])
+
+    def neighbors(self, u):
+        """節点 u から出る辺の (行き先, 距離) の一覧"""
+        start, end = self._indptr[u], self._indptr[u + 1]
+        return zip(self._indices[start:end], self._weights[start:end])
+
+    def astar(self, source, target, weights=None):
+        """A*法による最短経路。(距離km, 節点番号のリスト) を返す
+
+        weights で辺の重みを差し替えられる（元の距離以上であること。inf は通行止め）。
+        """
+        if source == target:
+            return 0.0, [source]
+        lat, lon = self._lat, self._lon
+        indptr, indices = self._indptr, self._indices
+        weights = self._weights if weights is None else weights
+        t_lat, t_lon = lat[target], lon[target]
+
+        best = {source: 0.0}
+        prev = {}
+        closed = set()
+        heap = [(_haversine_scalar(lat[source], lon[source], t_lat, t_lon), 0.0, source)]
+        while heap:
+            _, g, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in closed:
+                continue
+            closed.add(u)
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                ng = g + weights[k]
+                if ng < best.get(v, math.inf):
+                    best[v] = ng
+                    prev[v] = u
+                    heapq.heappush(heap, (ng + _haversine_scalar(lat[v], lon[v], t_lat, t_lon), ng, v))
+        else:
+            return math.inf, []
+
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        return best[target], path[::-1]
+
+    def dijkstra(self, source, targets=None, limit_km=math.inf):
+        """単一始点の最短距離。targets を指定するとすべて確定した時点で終了"""
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        remaining = set(targets) if targets is not None else None
+        best = {source: 0.0}
+        done = {}
+        heap = [(0.0, source)]
+        while heap:
+            g, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if g > limit_km:
+                break
+            done[u] = g
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                ng = g + weights[k]
+                if ng < best.get(v, math.inf):
+                    best[v] = ng
+                    heapq.heappush(heap, (ng, v))
+        return done
+
+    def node_geometry(self, nodes):
+        return [[self._lat[n], self._lon[n]] for n in nodes]
+
+    def path_length(self, nodes, weights=None):
+        """節点の列に沿った元の距離（km）。weights で探索した経路は、節点間で使った辺の距離を足す"""
+        weights = self._weights if weights is None else weights
+        total = 0.0
+        for u, v in zip(nodes, nodes[1:]):
+            edges = [k for k in range(self._indptr[u], self._indptr[u + 1]) if self._indices[k] == v]
+            total += self._weights[min(edges, key=weights.__getitem__)]
+        return total
+
+    def route(self, origin, destination, weights=None):
+        """2地点間の経路。最寄り節点までの直線区間を含めた距離と形状を返す
+
+        weights を指定した場合も distance_km は元の距離で、重み付きの値は cost に入る。
+        """
+        source, snap_a = self.nearest_node(origin[0], origin[1])
+        target, snap_b = self.nearest_node(destination[0], destination[1])
+        cost, nodes = self.astar(source, target, weights)
+        if not nodes:
+            return Route(math.inf, [list(origin), list(destination)], [])
+        geometry = [list(origin)] + self.node_geometry(nodes) + [list(destination)]
+        distance = cost if weights is None else self.path_length(nodes, weights)
+        return Route(distance + snap_a + snap_b, geometry, nodes, cost + snap_a + snap_b)
+
+    def distance_matrix(self, points):
+        """複数地点間のネットワーク距離行列（km）。到達できない組は inf"""
+        snapped = [self.nearest_node(lat, lon) for lat, lon in points]
+        nodes = [node for node, _ in snapped]
+        snaps = np.array([snap for _, snap in snapped])
+        matrix = np.full((len(points), len(points)), math.inf)
+        for i, (source, _) in enumerate(snapped):
+            done = self.dijkstra(source, targets=set(nodes))
+            matrix[i] = [done.get(node, math.inf) for node in nodes]
+        matrix += snaps[:, None] + snaps[None, :]
+        np.fill_diagonal(matrix, 0.0)
+        return matrix
+
+    def distances_to(self, origin, destinations):
+        """1地点から複数地点へのネットワーク距離（km）。到達できない地点は inf"""
+        source, snap_a = self.nearest_node(origin[0], origin[1])
+        snapped = [self.nearest_node(lat, lon) for lat, lon in destinations]
+        done = self.dijkstra(source, targets={node for node, _ in snapped})
+        return np.array([done.get(node, math.inf) + snap_a + snap_b for node, snap_b in snapped])
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("使い方: python -m hita_navi.road_graph 入力.osm 出力.npz [walk|car]")
+        sys.exit(1)
+    graph = RoadGraph.from_osm(sys.argv[1], sys.argv[3] if len(sys.argv) > 3 else "walk")
+    graph.save(sys.argv[2])
+    print(f"節点 {len(graph)} / 辺 {graph.edge_count} を {sys.argv[2]} に保存しました")
@@ -0,0 +1,113 @@
+"""全セッションで共有する最適ルートのキャッシュ
+
+キーは (出発地の格子, 目的地IDの並べ替え済みリスト, 計算方法) を正規化した
+文字列。件数の上限と有効期限（TTL）を持ち、古いものから捨てる。
+SQLite のファイルを指定すると結果をディスクにも保存し、再起動後も使える。
+値は JSON に変換できるもの（辞書・リストなど）に限る。
+"""
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from hita_navi.spatial_index import KM_PER_DEG_LAT
+
+# 出発地をまとめる格子の大きさ（m）
+START_CELL_M = 100.0
+
+# 保持件数と有効期限（秒）
+ROUTE_CACHE_SIZE = 2048
+ROUTE_CACHE_TTL = 6 * 60 * 60
+
+
+def start_cell(location, cell_m=START_CELL_M):
+    """出発地を cell_m 四方の格子番号に丸める"""
+    lat, lon = float(location[0]), float(location[1])
+    step_lat = cell_m / 1000 / KM_PER_DEG_LAT
+    step_lon = step_lat / max(math.cos(math.radians(lat)), 1e-6)
+    return (math.floor(lat / step_lat), math.floor(lon / step_lon))
+
+
+def route_key(location, destination_ids, mode, cell_m=START_CELL_M):
+    """キャッシュのキー。目的地の順番によらず同じ値になる"""
+    payload = json.dumps([start_cell(location, cell_m), sorted(destination_ids), mode],
+                         ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class RouteCache:
+    """スレッドセーフな件数上限・有効期限付きのキャッシュ（任意でSQLiteに保存）"""
+
+    def __init__(self, maxsize=ROUTE_CACHE_SIZE, ttl=ROUTE_CACHE_TTL, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS routes "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self._db.execute("DELETE FROM routes WHERE created < ?", (time.time() - ttl,))
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl
+
+    def get(self, key):
+        """キャッシュされた値。無い・期限切れの場合は None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self._data[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, created FROM routes WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    entry = (json.loads(row[0]), row[1])
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _remember(self, key, entry):
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def put(self, key, value):
+        created = time.time()
+        with self._lock:
+            self._remember(key, (value, created))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO routes VALUES (?, ?, ?)",
+                                 (key, json.dumps(value, ensure_ascii=False), created))
+                # ディスク上も件数の上限を超えた分を古い順に削除
+                self._db.execute("DELETE FROM routes WHERE key IN (SELECT key FROM routes "
+                                 "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.maxsize,))
+                self._db.commit()
+
+    def get_or_compute(self, key, compute):
+        """キャッシュに無ければ compute() で計算して保存する（計算中はロックしない）"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self), "maxsize": self.maxsize}
@@ -0,0 +1,109 @@
+"""ルート最適化のバックグラウンド実行
+
+最適化はスクリプトの実行とは別のスレッドで行う。実行中のジョブに途中の
+最良解と進み具合を記録するので、画面側は定期的に確認して表示できる。
+選択が変わったなど不要になったジョブは中止でき、局所探索はその時点の
+最良解で打ち切られる。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 同時に計算するルートの数（全セッションの合計）
+ROUTE_WORKERS = 2
+
+
+class RouteJob:
+    """1回分のルート最適化の状態（途中の最良解・進み具合・中止の指示）"""
+
+    def __init__(self, key, destination_ids=(), time_budget=None):
+        self.key = key
+        # 距離行列の1番目以降に対応する目的地のID
+        self.destination_ids = list(destination_ids)
+        self.time_budget = time_budget
+        self.started = time.perf_counter()
+        self.future = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self.stage = "queued"
+        self.best_order = None
+        self.best_length = None
+        self.updates = 0
+
+    def report(self, stage, order, length):
+        """途中経過を記録する（計算スレッドから呼ばれる）"""
+        with self._lock:
+            self.stage = stage
+            if self.best_length is None or length <= self.best_length:
+                self.best_order, self.best_length = list(order), float(length)
+                self.updates += 1
+
+    def snapshot(self):
+        """(ステージ名, 最良の訪問順, 総距離, 更新回数)"""
+        with self._lock:
+            return self.stage, self.best_order, self.best_length, self.updates
+
+    def best_ids(self):
+        """途中の最良解を目的地IDの並びで返す。まだ無ければ None"""
+        order = self.snapshot()[1]
+        if order is None:
+            return None
+        return [self.destination_ids[i - 1] for i in order]
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def should_stop(self):
+        return self._cancel.is_set()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def progress(self):
+        """進み具合（0〜1）。制限時間が無い場合は終わるまで 0"""
+        if self.done():
+            return 1.0
+        if not self.time_budget:
+            return 0.0
+        return min(self.elapsed / self.time_budget, 0.99)
+
+    def wait(self, timeout=None):
+        """終わるまで最大 timeout 秒待つ。終わっていれば True"""
+        if self.future is None:
+            return False
+        try:
+            self.future.exception(timeout=timeout)
+        except TimeoutError:
+            return False
+        except Exception:
+            pass  # 中止された場合
+        return True
+
+    def result(self):
+        """計算結果（計算中の例外はここで送出される）"""
+        return self.future.result()
+
+
+class RouteSolver:
+    """ルート最適化を実行するスレッドプール"""
+
+    def __init__(self, workers=ROUTE_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="route")
+
+    def submit(self, job, compute):
+        """compute(job) をバックグラウンドで実行する"""
+        job.future = self._executor.submit(compute, job)
+        return job
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,189 @@
+"""標高・浸水深ラスタによる避難ルートの安全度評価
+
+ラスタは NumPy の .npy タイルとして保存し、np.load(mmap_mode="r") で
+メモリマップして読み込む（必要な画素だけがディスクから読まれる）。
+各タイルには同名の .json（北端・西端の緯度経度とセルの大きさ）を置く。
+ルートの形状に沿って一定間隔で標本点を取り、複数ルートをまとめて評価する。
+GeoTIFF からの変換: python -m hita_navi.safety_raster 入力.tif 出力.npy（rasterio が必要）
+"""
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from hita_navi.distance import haversine
+
+# ルート上の標本点の間隔（km）
+SAMPLE_STEP_KM = 0.02
+
+# この浸水深（m）以上は安全度0
+FLOOD_DEPTH_LIMIT_M = 1.0
+
+# 標高による安全度: 基準標高（m）で0、基準＋幅で100
+BASE_ELEVATION_M = 80.0
+ELEVATION_RANGE_M = 20.0
+
+# 浸水深と標高の重み
+DEPTH_WEIGHT = 0.7
+
+
+@dataclass
+class RouteSafety:
+    """ルート全体の安全度（0〜100）"""
+    minimum: float
+    mean: float
+
+
+class RasterTile:
+    """メモリマップした1枚のラスタ（行は北から南、列は西から東）"""
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path.with_suffix(".json"), encoding="utf-8") as f:
+            georef = json.load(f)
+        self.data = np.load(path, mmap_mode="r")
+        self.north = float(georef["north"])
+        self.west = float(georef["west"])
+        self.cell_lat = float(georef["cell_lat"])
+        self.cell_lon = float(georef["cell_lon"])
+        self.nodata = georef.get("nodata")
+        rows, cols = self.data.shape
+        self.south = self.north - rows * self.cell_lat
+        self.east = self.west + cols * self.cell_lon
+
+    def sample(self, lats, lons, out):
+        """範囲内の点の値を out に書き込む（nodata は NaN）"""
+        inside = (lats <= self.north) & (lats > self.south) & (lons >= self.west) & (lons < self.east)
+        if not inside.any():
+            return
+        rows = ((self.north - lats[inside]) / self.cell_lat).astype(np.int64)
+        cols = ((lons[inside] - self.west) / self.cell_lon).astype(np.int64)
+        rows = np.clip(rows, 0, self.data.shape[0] - 1)
+        cols = np.clip(cols, 0, self.data.shape[1] - 1)
+        values = np.asarray(self.data[rows, cols], dtype=float)
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        out[inside] = values
+
+
+class RasterLayer:
+    """同じ種類のタイルの集まり（ディレクトリ内の 名前*.npy）"""
+
+    def __init__(self, tiles):
+        self.tiles = list(tiles)
+
+    @classmethod
+    def open(cls, directory, name):
+        return cls(RasterTile(path) for path in sorted(Path(directory).glob(f"{name}*.npy")))
+
+    def __bool__(self):
+        return bool(self.tiles)
+
+    def sample(self, lats, lons):
+        values = np.full(len(lats), np.nan)
+        for tile in self.tiles:
+            tile.sample(lats, lons, values)
+        return values
+
+
+def densify(geometry, step_km=SAMPLE_STEP_KM):
+    """折れ線を step_km 間隔の標本点に変換（緯度, 経度の配列）"""
+    points = np.asarray(geometry, dtype=float).reshape(-1, 2)
+    if len(points) < 2:
+        return points[:, 0], points[:, 1]
+    lengths = haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    counts = np.maximum(np.ceil(lengths / step_km).astype(np.int64), 1)
+    segment = np.repeat(np.arange(len(lengths)), counts)
+    # 各区間内の位置（0以上1未満）。最後に終点を加える
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = offsets / counts[segment]
+    lats = points[segment, 0] + (points[segment + 1, 0] - points[segment, 0]) * t
+    lons = points[segment, 1] + (points[segment + 1, 1] - points[segment, 1]) * t
+    return np.append(lats, points[-1, 0]), np.append(lons, points[-1, 1])
+
+
+class SafetyModel:
+    """標高・浸水深ラスタから地点の安全度（0〜100）を求める"""
+
+    def __init__(self, elevation=None, flood_depth=None):
+        self.elevation = elevation or RasterLayer([])
+        self.flood_depth = flood_depth or RasterLayer([])
+
+    @classmethod
+    def open(cls, directory):
+        """directory 内の elevation*.npy と flood_depth*.npy を読み込む"""
+        return cls(RasterLayer.open(directory, "elevation"), RasterLayer.open(directory, "flood_depth"))
+
+    @property
+    def available(self):
+        return bool(self.elevation) or bool(self.flood_depth)
+
+    def point_scores(self, lats, lons):
+        """標本点ごとの安全度。データの無い点は NaN"""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        depth = self.flood_depth.sample(lats, lons) if self.flood_depth else np.full(len(lats), np.nan)
+        height = self.elevation.sample(lats, lons) if self.elevation else np.full(len(lats), np.nan)
+        depth_score = 100 * (1 - np.clip(depth / FLOOD_DEPTH_LIMIT_M, 0, 1))
+        height_score = 100 * np.clip((height - BASE_ELEVATION_M) / ELEVATION_RANGE_M, 0, 1)
+        # 片方しか無い点はある方だけで評価
+        score = DEPTH_WEIGHT * depth_score + (1 - DEPTH_WEIGHT) * height_score
+        score = np.where(np.isnan(depth_score), height_score, score)
+        return np.where(np.isnan(height_score), depth_score, score)
+
+    def score_point(self, lat, lon):
+        value = self.point_scores([lat], [lon])[0]
+        return None if math.isnan(value) else float(value)
+
+    def score_routes(self, geometries, step_km=SAMPLE_STEP_KM):
+        """複数ルートの安全度（最小・平均）。標本点をまとめて1回でラスタを参照する"""
+        samples = [densify(geometry, step_km) for geometry in geometries]
+        if not samples:
+            return []
+        counts = np.array([len(lats) for lats, _ in samples])
+        scores = self.point_scores(np.concatenate([lats for lats, _ in samples]),
+                                   np.concatenate([lons for _, lons in samples]))
+        starts = np.cumsum(counts) - counts
+        valid = ~np.isnan(scores)
+        filled_min = np.where(valid, scores, np.inf)
+        filled_sum = np.where(valid, scores, 0.0)
+        minimum = np.minimum.reduceat(filled_min, starts)
+        total = np.add.reduceat(filled_sum, starts)
+        known = np.add.reduceat(valid.astype(np.int64), starts)
+        return [RouteSafety(float(lo), float(s / k)) if k else None
+                for lo, s, k in zip(minimum, total, known)]
+
+    def score_route(self, geometry, step_km=SAMPLE_STEP_KM):
+        return self.score_routes([geometry], step_km)[0]
+
+
+def convert_geotiff(source, destination, band=1):
+    """GeoTIFF（緯度経度の座標系）を .npy と位置情報の .json に変換する"""
+    try:
+        import rasterio
+    except ImportError as error:
+        raise RuntimeError("GeoTIFF の変換には rasterio が必要です（pip install rasterio）") from error
+    with rasterio.open(source) as src:
+        data = src.read(band)
+        transform = src.transform
+        nodata = src.nodata
+    destination = Path(destination)
+    np.save(destination, data)
+    georef = {"north": transform.f, "west": transform.c,
+              "cell_lat": -transform.e, "cell_lon": transform.a,
+              "nodata": None if nodata is None else float(nodata)}
+    with open(destination.with_suffix(".json"), "w", encoding="utf-8") as f:
+        json.dump(georef, f)
+    return georef
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("使い方: python -m hita_navi.safety_raster 入力.tif 出力.npy")
+        sys.exit(1)
+    convert_geotiff(sys.argv[1], sys.argv[2])
+    print(f"{sys.argv[2]} に保存しました")
@@ -0,0 +1,236 @@
+"""営業時間と食事時間帯を考慮した観光スケジュールの作成
+
+移動時間・待ち時間・滞在時間を合わせた総所要時間が最小になる訪問順を、
+枝刈り付きの深さ優先探索で求める。時刻はすべて0時からの経過分で扱う。
+"""
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from hita_navi.distance import distance_matrix, travel_minutes
+
+# 昼食の時間帯（食事スロット）の既定値
+DEFAULT_MEAL_WINDOW = ("11:00", "14:00")
+
+# 探索の制限時間（秒）。超えた場合はそれまでの最良解を返す
+DEFAULT_TIME_LIMIT = 1.0
+
+
+def parse_clock(text):
+    """"HH:MM" 形式を0時からの経過分に変換"""
+    hours, minutes = str(text).split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_clock(minutes):
+    """0時からの経過分を "HH:MM" 形式に変換"""
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _opening_hours(place):
+    """営業時間（開始, 終了）。未設定の場合は終日"""
+    opens = place.get('open')
+    closes = place.get('close')
+    return (parse_clock(opens) if opens else 0.0,
+            parse_clock(closes) if closes else float('inf'))
+
+
+@dataclass
+class ScheduledStop:
+    """スケジュール上の1地点"""
+    place: dict
+    arrival: float
+    start: float
+    departure: float
+    travel: float
+    is_meal: bool = False
+
+
+@dataclass
+class Schedule:
+    """スケジュール全体
+
+    feasible は探索を最後まで行って条件を満たす順序がないと分かった場合だけ False。
+    timed_out は制限時間で探索を打ち切ったこと、relaxed は stops が条件を緩めた
+    （または入力の順に並べた）ものであることを表す。
+    """
+    start_time: float
+    transport_mode: str
+    stops: list = field(default_factory=list)
+    feasible: bool = True
+    optimal: bool = True
+    timed_out: bool = False
+    relaxed: bool = False
+
+    @property
+    def end_time(self):
+        return self.stops[-1].departure if self.stops else self.start_time
+
+    @property
+    def total_minutes(self):
+        """出発から最後の地点を出るまでの総所要時間（分）"""
+        return self.end_time - self.start_time
+
+    @property
+    def route(self):
+        return [stop.place for stop in self.stops]
+
+
+def _search(travel, dwell, windows, must, options, meal_nodes, meal_window,
+            start_time, deadline):
+    """枝刈り付き深さ優先探索。(訪問順, 各地点の開始時刻, 食事地点, 探索完了か) を返す"""
+    n = len(dwell)
+    must_mask = 0
+    for j in must:
+        must_mask |= 1 << j
+    option_set = set(options)
+    meal_required = meal_window is not None
+    meal_start, meal_end = meal_window if meal_required else (0.0, 0.0)
+
+    # 下界用: 各地点へ入る最短移動時間
+    incoming = travel.copy()
+    np.fill_diagonal(incoming, np.inf)
+    min_in = incoming.min(axis=0)
+    min_in[~np.isfinite(min_in)] = 0.0
+    must_cost = {j: dwell[j] + min_in[j] for j in must}
+
+    best = {'time': float('inf'), 'order': None, 'starts': None, 'meal': None}
+    seen = {}
+    complete = [True]
+
+    def visit(node, t, mask, meal_at, order, starts, remaining):
+        if time.perf_counter() > deadline:
+            complete[0] = False
+            return
+        if mask & must_mask == must_mask and (meal_at is not None or not meal_required):
+            if t < best['time']:
+                best.update(time=t, order=list(order), starts=list(starts), meal=meal_at)
+            return
+        if t + remaining >= best['time']:
+            return
+        if meal_required and meal_at is None and t > meal_end:
+            return
+        key = (mask, node, meal_at is not None)
+        if seen.get(key, float('inf')) <= t:
+            return
+        seen[key] = t
+
+        moves = []
+        for j in range(1, n):
+            if mask >> j & 1:
+                continue
+            is_option = j in option_set
+            if is_option and meal_at is not None:
+                continue
+            arrival = t + travel[node, j]
+            begin = max(arrival, windows[j][0])
+            candidates = [(begin, False)]
+            if meal_required and meal_at is None and j in meal_nodes:
+                meal_begin = max(begin, meal_start)
+                if meal_begin <= meal_end:
+                    if is_option:
+                        candidates = [(meal_begin, True)]
+                    elif meal_begin == begin:
+                        candidates = [(begin, True)]
+                    else:
+                        candidates.append((meal_begin, True))
+            elif is_option:
+                continue  # 食事として使わない候補店は挿入しない
+            for begin, as_meal in candidates:
+                finish = begin + dwell[j]
+                if finish > windows[j][1]:
+                    continue
+                moves.append((finish, j, begin, as_meal))
+
+        moves.sort()
+        for finish, j, begin, as_meal in moves:
+            order.append(j)
+            starts.append(begin)
+            visit(j, finish, mask | 1 << j, j if as_meal else meal_at, order, starts,
+                  remaining - must_cost.get(j, 0.0))
+            order.pop()
+            starts.pop()
+
+    visit(0, start_time, 1, None, [], [], sum(must_cost.values()))
+    return best['order'], best['starts'], best['meal'], complete[0]
+
+
+def _in_order(travel, dwell, windows, order, start_time):
+    """order の順に回った場合の (訪問順, 各地点の開始時刻)。開店前に着いた地点は開店まで待つ"""
+    starts = []
+    previous, clock = 0, start_time
+    for j in order:
+        begin = max(clock + travel[previous, j], windows[j][0])
+        starts.append(begin)
+        previous, clock = j, begin + dwell[j]
+    return list(order), starts
+
+
+def plan_schedule(start_location, places, transport_mode="walk", start_time="09:00",
+                  meal_options=(), meal_window=None, method="haversine",
+                  time_limit=DEFAULT_TIME_LIMIT, poi_matrix=None):
+    """総所要時間が最小になるスケジュールを作成する
+
+    meal_window を指定すると、その時間帯に食事地点（places 内の飲食店、
+    または meal_options から1軒挿入）を1回含める。営業時間は各地点の
+    'open' / 'close'（"HH:MM"）で指定でき、未設定なら終日とみなす。
+    poi_matrix を渡すとPOI同士の所要時間は事前計算値を使う。
+    """
+    if isinstance(start_time, str):
+        start_time = parse_clock(start_time)
+    if meal_window is not None:
+        meal_window = tuple(parse_clock(v) if isinstance(v, str) else v for v in meal_window)
+
+    places = list(places)
+    extra = [r for r in meal_options if r not in places] if meal_window else []
+    nodes = places + extra
+    if poi_matrix is not None:
+        travel = poi_matrix.travel_sub_matrix(start_location, nodes, transport_mode)
+    else:
+        points = [start_location] + [[p['lat'], p['lon']] for p in nodes]
+        travel = travel_minutes(distance_matrix(points, method=method), transport_mode)
+    dwell = np.array([0.0] + [p.get('wait_time', 0) + p.get('visit_duration', 0) for p in nodes])
+    windows = [(0.0, float('inf'))] + [_opening_hours(p) for p in nodes]
+
+    must = list(range(1, len(places) + 1))
+    options = list(range(len(places) + 1, len(nodes) + 1))
+    meal_nodes = set(options) | {i + 1 for i, p in enumerate(places) if p in meal_options}
+
+    deadline = time.perf_counter() + time_limit
+    feasible, timed_out = True, False
+    # 制約を満たす解がない場合は、食事スロット→営業時間の順に緩和する
+    attempts = [(windows, meal_window if meal_nodes else None)]
+    if meal_window is not None and meal_nodes:
+        attempts.append((windows, None))
+    attempts.append(([(0.0, float('inf'))] * len(windows), None))
+    for attempt, (current_windows, current_meal) in enumerate(attempts):
+        order, starts, meal_at, complete = _search(
+            travel, dwell, current_windows, must, options if current_meal else [],
+            meal_nodes, current_meal, start_time, deadline
+        )
+        timed_out = timed_out or not complete
+        if order is not None:
+            break
+        if attempt == 0 and complete:
+            # 時間切れではなく、最後まで探索して解がなかった
+            feasible = False
+        # 時間切れでも最後の緩和は必ず解く
+        deadline = max(deadline, time.perf_counter() + time_limit / 4)
+    else:
+        # 制限時間内に解が見つからなかった場合は、入力の順に回った場合の時刻を返す
+        order, starts = _in_order(travel, dwell, windows, must, start_time)
+        meal_at, attempt = None, len(attempts)
+
+    schedule = Schedule(start_time, transport_mode, feasible=feasible, optimal=not timed_out,
+                        timed_out=timed_out, relaxed=attempt > 0)
+    previous, clock = 0, start_time
+    for j, begin in zip(order, starts):
+        arrival = clock + travel[previous, j]
+        clock = begin + dwell[j]
+        schedule.stops.append(ScheduledStop(
+            nodes[j - 1], arrival, begin, clock, travel[previous, j], is_meal=(j == meal_at)
+        ))
+        previous = j
+    return schedule
@@ -0,0 +1,318 @@
+"""収容人数を考慮した避難所の一括割り当て
+
+多数の避難者（地点ごとの人数）を、各避難所の残りの収容人数を超えないよう、
+移動距離の合計が最小になるように割り当てる（輸送問題・最小費用流）。
+避難所の数は避難者の地点数よりずっと少ないため、避難所を節点とするグラフで
+逐次最短路法を使う。避難所 s から t への辺は「s に割り当て済みの人を t へ
+移す」ことを表し、費用はその移動で増える距離の最小値。最寄りの避難所に
+空きがある地点は最短路を探さずにまとめて割り当てる。
+
+割り当てを保持しているため、収容人数（入所済みの人数）や人数が変わった
+場合は、変化した分だけを割り当て直す（空きが出た避難所へは、移した方が
+距離が短くなる人を移す）。どの避難所にも入れない人は「未割り当て」として数える。
+"""
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from hita_navi.distance import distance_matrix
+from hita_navi.spatial_index import KM_PER_DEG_LAT
+
+# 距離の比較の許容誤差（km）
+TOLERANCE_KM = 1e-9
+
+# 人口をまとめる格子の大きさ（m）
+POPULATION_CELL_M = 50.0
+
+
+def population_grid(lats, lons, counts=None, cell_m=POPULATION_CELL_M):
+    """避難者の位置を cell_m 四方の格子にまとめる。(緯度の配列, 経度の配列, 人数の配列) を返す"""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    counts = np.ones(len(lats), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+    if not len(lats):
+        return lats, lons, counts
+    step_lat = cell_m / 1000 / KM_PER_DEG_LAT
+    step_lon = step_lat / max(math.cos(math.radians(float(lats.mean()))), 1e-6)
+    rows = np.floor(lats / step_lat).astype(np.int64)
+    cols = np.floor(lons / step_lon).astype(np.int64)
+    keys = (rows - rows.min()) * (int(cols.max() - cols.min()) + 1) + (cols - cols.min())
+    _, inverse, _ = np.unique(keys, return_inverse=True, return_counts=True)
+    total = np.bincount(inverse, weights=counts)
+    # 格子内の人数で重み付けした重心を代表地点にする
+    center_lat = np.bincount(inverse, weights=lats * counts) / total
+    center_lon = np.bincount(inverse, weights=lons * counts) / total
+    return center_lat, center_lon, total.astype(np.int64)
+
+
+def travel_costs(lats, lons, shelters, road_graph=None):
+    """避難者の地点×避難所の移動距離（km）。道路グラフがあれば避難所からのネットワーク距離"""
+    points = np.column_stack((lats, lons))
+    shelter_points = [[shelter['lat'], shelter['lon']] for shelter in shelters]
+    if road_graph is None:
+        return distance_matrix(points, shelter_points)
+    snapped = [road_graph.nearest_node(lat, lon) for lat, lon in points]
+    nodes = np.array([node for node, _ in snapped])
+    snaps = np.array([snap for _, snap in snapped])
+    costs = np.empty((len(points), len(shelter_points)))
+    for j, (lat, lon) in enumerate(shelter_points):
+        # 歩行者用の道路は双方向とみなし、避難所からの最短距離を使う
+        source, snap = road_graph.nearest_node(lat, lon)
+        done = road_graph.dijkstra(source)
+        costs[:, j] = [done.get(node, math.inf) for node in nodes]
+        costs[:, j] += snaps + snap
+    return costs
+
+
+@dataclass
+class AssignmentResult:
+    """割り当ての結果（地点の番号・避難所の番号・人数の組。避難所の番号 -1 は未割り当て）"""
+    groups: np.ndarray
+    shelters: np.ndarray
+    counts: np.ndarray
+    loads: np.ndarray
+    unassigned: int
+    total_km: float
+    paths: int
+    seconds: float
+
+    def shelter_of(self, group):
+        """地点 group の人が最も多く割り当てられた避難所の番号（無ければ -1）"""
+        mine = self.groups == group
+        if not mine.any():
+            return -1
+        return int(self.shelters[mine][np.argmax(self.counts[mine])])
+
+
+class ShelterAssignment:
+    """避難者の地点と避難所の距離行列を持ち、収容人数の変化に合わせて割り当てを更新する"""
+
+    def __init__(self, costs, counts):
+        costs = np.asarray(costs, dtype=float)
+        self.group_count, self.shelter_count = costs.shape
+        # 最後の列は「未割り当て」（収容人数無制限、どの実際の距離よりも大きい費用）
+        finite = costs[np.isfinite(costs)]
+        self.overflow_cost = (float(finite.max()) if finite.size else 0.0) * 2 + 1.0
+        self._costs = np.empty((self.group_count, self.shelter_count + 1))
+        self._costs[:, :-1] = np.where(np.isfinite(costs), costs, self.overflow_cost)
+        self._costs[:, -1] = self.overflow_cost
+        self._nearest = np.argmin(self._costs, axis=1)
+        # 避難所ごとの行で持つ（割り当て済みの地点を避難所ごとに取り出すため）
+        self._costs_by_shelter = np.ascontiguousarray(self._costs.T)
+        self.counts = np.asarray(counts, dtype=np.int64).copy()
+        nodes = self.shelter_count + 1
+        self.capacity = np.zeros(nodes, dtype=np.int64)
+        self.capacity[-1] = np.iinfo(np.int64).max // 2
+        self._flow = np.zeros((nodes, self.group_count), dtype=np.int64)
+        self._loads = np.zeros(nodes, dtype=np.int64)
+        self._free = self.counts.copy()
+        # 避難所間の移し替えの費用と、その費用で移す地点（_stale の行は再計算が必要）
+        self._exchange = np.full((nodes, nodes), np.inf)
+        self._via = np.full((nodes, nodes), -1, dtype=np.int64)
+        self._stale = set()
+        # 空きが出たため、移した方が短くなる人がいないか確認が必要な避難所
+        self._opened = set()
+
+    @classmethod
+    def build(cls, lats, lons, counts, shelters, road_graph=None):
+        return cls(travel_costs(lats, lons, shelters, road_graph), counts)
+
+    def _add(self, group, shelter, amount):
+        self._flow[shelter, group] += amount
+        self._loads[shelter] += amount
+        self._joined(shelter, group)
+
+    def _joined(self, shelter, group):
+        """shelter に group の人が入った（移し替えの費用は小さくなる方向にだけ変わる）"""
+        if shelter in self._stale:
+            return
+        delta = self._costs_by_shelter[:, group] - self._costs_by_shelter[shelter, group]
+        delta[shelter] = np.inf
+        better = delta < self._exchange[shelter]
+        self._exchange[shelter, better] = delta[better]
+        self._via[shelter, better] = group
+
+    def _left(self, shelter, group):
+        """shelter から group の人が減った（いなくなり、移し替えに使っていた場合は再計算）"""
+        if self._flow[shelter, group] == 0 and (self._via[shelter] == group).any():
+            self._stale.add(int(shelter))
+
+    def _remove(self, shelter, amount, groups=None):
+        """避難所から amount 人を外して未割り当てに戻す（距離の長い地点から）"""
+        members = np.flatnonzero(self._flow[shelter]) if groups is None else groups
+        for group in members[np.argsort(-self._costs[members, shelter])]:
+            if amount <= 0:
+                break
+            moved = min(amount, self._flow[shelter, group])
+            self._flow[shelter, group] -= moved
+            self._loads[shelter] -= moved
+            self._free[group] += moved
+            amount -= moved
+            self._left(shelter, group)
+
+    def _refresh(self):
+        """割り当てが変わった避難所の移し替えの費用を計算し直す"""
+        for shelter in self._stale:
+            members = np.flatnonzero(self._flow[shelter])
+            if not len(members):
+                self._exchange[shelter] = np.inf
+                self._via[shelter] = -1
+                continue
+            costs = self._costs_by_shelter[:, members]
+            delta = costs - costs[shelter]
+            best = np.argmin(delta, axis=1)
+            self._exchange[shelter] = delta[np.arange(len(delta)), best]
+            self._exchange[shelter, shelter] = np.inf
+            self._via[shelter] = members[best]
+        self._stale.clear()
+
+    def _shift(self, path, amount):
+        """path（避難所の列）の各区間で、移し替え先の地点の人を amount 人ずつ次の避難所へ移す"""
+        for u, v in zip(path[:-1], path[1:]):
+            group = self._via[u, v]
+            self._flow[u, group] -= amount
+            self._flow[v, group] += amount
+            self._left(u, group)
+            self._joined(v, group)
+        self._loads[path[0]] -= amount
+        self._loads[path[-1]] += amount
+
+    def _bottleneck(self, path):
+        return min((self._flow[u, self._via[u, v]] for u, v in zip(path[:-1], path[1:])),
+                   default=np.iinfo(np.int64).max)
+
+    def _fill_nearest(self):
+        """最寄りの避難所に空きがある地点をまとめて割り当てる（この場合は最寄りが最短）"""
+        waiting = np.flatnonzero(self._free)
+        nearest = self._nearest[waiting]
+        order = np.lexsort((waiting, nearest))
+        waiting, nearest = waiting[order], nearest[order]
+        demand = self._free[waiting]
+        cum = np.cumsum(demand)
+        first = np.searchsorted(nearest, np.arange(self.shelter_count + 1))
+        before = np.concatenate(([0], cum))[first][nearest]
+        room = (self.capacity - self._loads)[nearest]
+        amount = np.clip(room - (cum - demand - before), 0, demand)
+        placed = amount > 0
+        for group, shelter, moved in zip(waiting[placed], nearest[placed], amount[placed]):
+            self._add(group, shelter, moved)
+            self._free[group] -= moved
+
+    def _augment(self, group):
+        """地点 group の人を、移し替えを含めた最短路で空きのある避難所へ割り当てる"""
+        self._refresh()
+        dist = self._costs[group].copy()
+        prev = np.full(len(dist), -1, dtype=np.int64)
+        for _ in range(len(dist)):
+            through = dist[:, None] + self._exchange
+            best = np.argmin(through, axis=0)
+            value = through[best, np.arange(len(dist))]
+            better = value < dist - TOLERANCE_KM
+            if not better.any():
+                break
+            dist[better] = value[better]
+            prev[better] = best[better]
+        target = int(np.argmin(np.where(self._loads < self.capacity, dist, np.inf)))
+        path = [target]
+        while prev[path[-1]] >= 0:
+            path.append(int(prev[path[-1]]))
+        path.reverse()
+        amount = min(self._free[group], self.capacity[target] - self._loads[target], self._bottleneck(path))
+        self._shift(path, amount)
+        self._add(group, path[0], amount)
+        self._free[group] -= amount
+
+    def _rebalance(self, shelter):
+        """空きのある shelter へ移した方が距離の合計が短くなる人を移す（負の閉路の解消）"""
+        while self._loads[shelter] < self.capacity[shelter]:
+            self._refresh()
+            # 各避難所から shelter までの移し替えの最短距離
+            dist = np.full(self.shelter_count + 1, np.inf)
+            dist[shelter] = 0.0
+            nxt = np.full(len(dist), -1, dtype=np.int64)
+            for _ in range(len(dist)):
+                through = self._exchange + dist[None, :]
+                best = np.argmin(through, axis=1)
+                value = through[np.arange(len(dist)), best]
+                better = value < dist - TOLERANCE_KM
+                if not better.any():
+                    break
+                dist[better] = value[better]
+                nxt[better] = best[better]
+            source = int(np.argmin(dist))
+            if dist[source] >= -TOLERANCE_KM:
+                return
+            path = [source]
+            while path[-1] != shelter:
+                path.append(int(nxt[path[-1]]))
+            amount = min(self.capacity[shelter] - self._loads[shelter], self._bottleneck(path))
+            self._shift(path, amount)
+            # 人を移した元の避難所にも空きができる
+            self._opened.add(source)
+
+    def set_counts(self, counts):
+        """地点ごとの人数を変更する（減った地点は割り当てを外し、増えた分は未割り当てにする）"""
+        counts = np.asarray(counts, dtype=np.int64)
+        for group in np.flatnonzero(counts != self.counts):
+            excess = self.counts[group] - counts[group]
+            unplaced = min(max(excess, 0), self._free[group])
+            self._free[group] -= unplaced
+            excess -= unplaced
+            for shelter in np.flatnonzero(self._flow[:, group]):
+                if excess <= 0:
+                    break
+                moved = min(excess, self._flow[shelter, group])
+                self._remove(shelter, moved, np.array([group]))
+                self._free[group] -= moved
+                self._opened.add(int(shelter))
+                excess -= moved
+            if excess < 0:
+                self._free[group] -= excess
+        self.counts = counts.copy()
+
+    def solve(self, capacity):
+        """残りの収容人数（避難所ごと）で割り当てを計算する。前回の割り当てから続けて解く"""
+        began = time.perf_counter()
+        capacity = np.maximum(np.asarray(capacity, dtype=np.int64), 0)
+        self._opened.update(int(s) for s in np.flatnonzero(capacity > self.capacity[:-1]))
+        self.capacity[:-1] = capacity
+        # 収容人数を超えた避難所からは距離の長い人を外す
+        for shelter in np.flatnonzero(self._loads > self.capacity):
+            self._remove(shelter, self._loads[shelter] - self.capacity[shelter])
+        while self._opened:
+            self._rebalance(self._opened.pop())
+        self._fill_nearest()
+        paths = 0
+        for group in np.flatnonzero(self._free):
+            while self._free[group] > 0:
+                self._augment(group)
+                paths += 1
+        return self._result(paths, time.perf_counter() - began)
+
+    def _result(self, paths, seconds):
+        shelters, groups = np.nonzero(self._flow)
+        counts = self._flow[shelters, groups]
+        overflow = shelters == self.shelter_count
+        total = float((self._costs[groups, shelters] * counts)[~overflow].sum())
+        return AssignmentResult(groups, np.where(overflow, -1, shelters), counts, self._loads[:-1].copy(),
+                                int(self._loads[-1]), total, paths, seconds)
+
+
+if __name__ == "__main__":
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    rng = np.random.default_rng(0)
+    lats, lons, counts = population_grid(33.32 + rng.normal(0, 0.02, n), 130.94 + rng.normal(0, 0.03, n))
+    shelters = [{"lat": lat, "lon": lon} for lat, lon in
+                zip(33.32 + rng.normal(0, 0.02, m), 130.94 + rng.normal(0, 0.03, m))]
+    capacity = rng.integers(n // m // 2, n // m * 2, m)
+    engine = ShelterAssignment.build(lats, lons, counts, shelters)
+    result = engine.solve(capacity)
+    print(f"{n}人（{len(counts)}地点）→ {m}箇所: {result.seconds:.2f}秒（未割り当て {result.unassigned}人）")
+    capacity[rng.choice(m, m // 4, replace=False)] -= n // m // 4
+    result = engine.solve(capacity)
+    print(f"収容人数の変化後の再計算: {result.seconds:.2f}秒（未割り当て {result.unassigned}人）")
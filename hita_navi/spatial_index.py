@@ -0,0 +1,253 @@
+"""緯度経度の格子（グリッド）による空間インデックス
+
+k近傍検索と半径検索を、全件走査ではなく周辺セルの候補だけで行う。
+ポリゴンなど広がりのある図形は、外接矩形の R-tree（BoxTree）で範囲検索する。
+ベンチマーク: python -m hita_navi.spatial_index
+"""
+import math
+import time
+
+import numpy as np
+
+from hita_navi.distance import EARTH_RADIUS_KM, haversine
+
+# 緯度1度あたりの距離（km）
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+# R-tree の1節点にまとめる子の数
+BOX_TREE_CAPACITY = 16
+
+
+class GridIndex:
+    """等間隔の緯度経度グリッドに点を振り分けた空間インデックス"""
+
+    def __init__(self, lats, lons, cell_km=None):
+        self.lats = np.asarray(lats, dtype=float).ravel()
+        self.lons = np.asarray(lons, dtype=float).ravel()
+        n = len(self.lats)
+        if n == 0:
+            self.origin = (0.0, 0.0)
+            ref_lat = 0.0
+        else:
+            self.origin = (float(self.lats.min()), float(self.lons.min()))
+            ref_lat = float(self.lats.mean())
+        self._km_per_deg_lon = KM_PER_DEG_LAT * max(math.cos(math.radians(ref_lat)), 1e-6)
+
+        if cell_km is None:
+            # 1セルあたり数点になるようにセル幅を決める
+            if n > 1:
+                height = (self.lats.max() - self.lats.min()) * KM_PER_DEG_LAT
+                width = (self.lons.max() - self.lons.min()) * self._km_per_deg_lon
+                cell_km = math.sqrt(max(height * width, 1e-6) / n * 4)
+            else:
+                cell_km = 1.0
+        self.cell_km = max(float(cell_km), 1e-3)
+        self._cell_lat = self.cell_km / KM_PER_DEG_LAT
+        self._cell_lon = self.cell_km / self._km_per_deg_lon
+
+        # セル番号でソートし、セルごとの区間を持つ（CSR形式）
+        rows, cols = self._cells(self.lats, self.lons)
+        self._order = np.lexsort((cols, rows))
+        keys = np.stack((rows[self._order], cols[self._order]), axis=1)
+        self._buckets = {}
+        if n:
+            change = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            starts = np.concatenate(([0], change))
+            ends = np.concatenate((change, [n]))
+            for start, end in zip(starts, ends):
+                self._buckets[(int(keys[start, 0]), int(keys[start, 1]))] = (start, end)
+        self._bounds = (0, -1, 0, -1)
+        self._max_ring = 0
+        if self._buckets:
+            r = np.array(list(self._buckets))
+            self._bounds = (r[:, 0].min(), r[:, 0].max(), r[:, 1].min(), r[:, 1].max())
+            self._max_ring = int(max(r[:, 0].max() - r[:, 0].min(), r[:, 1].max() - r[:, 1].min())) + 1
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats) - self.origin[0]) / self._cell_lat).astype(np.int64)
+        cols = np.floor((np.asarray(lons) - self.origin[1]) / self._cell_lon).astype(np.int64)
+        return rows, cols
+
+    def _inside(self, row, col):
+        """セルが点群の範囲内にあるか"""
+        r0, r1, c0, c1 = self._bounds
+        return r0 <= row <= r1 and c0 <= col <= c1
+
+    def _ring(self, row, col, ring):
+        """中心セルから ring 周目のセルに含まれる点の番号"""
+        if ring == 0:
+            cells = [(row, col)]
+        else:
+            cells = [(row - ring, c) for c in range(col - ring, col + ring + 1)]
+            cells += [(row + ring, c) for c in range(col - ring, col + ring + 1)]
+            cells += [(r, col - ring) for r in range(row - ring + 1, row + ring)]
+            cells += [(r, col + ring) for r in range(row - ring + 1, row + ring)]
+        found = []
+        for cell in cells:
+            span = self._buckets.get(cell)
+            if span:
+                found.append(self._order[span[0]:span[1]])
+        return found
+
+    def _all(self, lat, lon, limit=None):
+        dist = haversine(lat, lon, self.lats, self.lons)
+        order = np.argsort(dist, kind="stable")[:limit]
+        return order, dist[order]
+
+    def nearest(self, lat, lon, k=1):
+        """k近傍検索。(点の番号, 距離km) を距離の近い順に返す"""
+        n = len(self)
+        k = min(k, n)
+        if k <= 0:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        row, col = (int(v) for v in self._cells(lat, lon))
+        if k == n or not self._inside(row, col):
+            # 全件が必要な場合や、点群の範囲外からの検索は全件走査
+            return self._all(lat, lon, k)
+
+        candidates = []
+        count = 0
+        ring = 0
+        while ring <= self._max_ring:
+            for part in self._ring(row, col, ring):
+                candidates.append(part)
+                count += len(part)
+            if count >= k:
+                # ring 周目まで探索済みなら、ring × セル幅 以内の点はすべて候補に含まれる
+                idx = np.concatenate(candidates)
+                dist = haversine(lat, lon, self.lats[idx], self.lons[idx])
+                if np.partition(dist, k - 1)[k - 1] <= ring * self.cell_km * 0.999:
+                    break
+            ring += 1
+        else:
+            return self._all(lat, lon, k)
+        idx = np.concatenate(candidates)
+        dist = haversine(lat, lon, self.lats[idx], self.lons[idx])
+        top = np.argsort(dist, kind="stable")[:k]
+        return idx[top], dist[top]
+
+    def within(self, lat, lon, radius_km):
+        """半径検索。radius_km 以内の (点の番号, 距離km) を近い順に返す"""
+        if len(self) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        row, col = (int(v) for v in self._cells(lat, lon))
+        reach = int(math.ceil(radius_km / self.cell_km)) + 1
+        if (2 * reach + 1) ** 2 >= len(self._buckets):
+            idx = np.arange(len(self))
+        else:
+            parts = []
+            for r in range(row - reach, row + reach + 1):
+                for c in range(col - reach, col + reach + 1):
+                    span = self._buckets.get((r, c))
+                    if span:
+                        parts.append(self._order[span[0]:span[1]])
+            if not parts:
+                return np.zeros(0, dtype=int), np.zeros(0)
+            idx = np.concatenate(parts)
+        dist = haversine(lat, lon, self.lats[idx], self.lons[idx])
+        keep = dist <= radius_km
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        return idx[order], dist[order]
+
+
+def _str_order(boxes, capacity):
+    """STR（Sort-Tile-Recursive）法の並び順。中心の緯度で帯に分け、帯の中を経度で並べる"""
+    lat = (boxes[:, 0] + boxes[:, 2]) / 2
+    lon = (boxes[:, 1] + boxes[:, 3]) / 2
+    leaves = math.ceil(len(boxes) / capacity)
+    per_slice = math.ceil(math.sqrt(leaves)) * capacity
+    by_lat = np.argsort(lat, kind="stable")
+    return np.concatenate([part[np.argsort(lon[part], kind="stable")]
+                           for part in np.split(by_lat, range(per_slice, len(boxes), per_slice))])
+
+
+class BoxTree:
+    """外接矩形（南端, 西端, 北端, 東端）の STR 詰め込み R-tree（構築後は変更しない）"""
+
+    def __init__(self, boxes, capacity=BOX_TREE_CAPACITY):
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.capacity = capacity
+        order = _str_order(boxes, capacity) if len(boxes) else np.zeros(0, dtype=np.int64)
+        self._ids = order
+        # 下の階層から順に (節点の矩形, 子の開始位置, 子の終了位置)。最下層の子は矩形そのもの
+        self._levels = []
+        level_boxes = boxes[order]
+        while len(level_boxes) > capacity:
+            starts = np.arange(0, len(level_boxes), capacity)
+            ends = np.minimum(starts + capacity, len(level_boxes))
+            parents = np.column_stack((np.minimum.reduceat(level_boxes[:, 0], starts),
+                                       np.minimum.reduceat(level_boxes[:, 1], starts),
+                                       np.maximum.reduceat(level_boxes[:, 2], starts),
+                                       np.maximum.reduceat(level_boxes[:, 3], starts)))
+            # 上の階層も STR の順に並べ直す（子の範囲は節点と一緒に動く）
+            perm = _str_order(parents, capacity)
+            self._levels.append((parents[perm], starts[perm], ends[perm]))
+            level_boxes = parents[perm]
+        self._leaf_boxes = boxes[order]
+        self._root = level_boxes
+
+    def __len__(self):
+        return len(self._ids)
+
+    def query(self, lat_min, lon_min, lat_max, lon_max):
+        """範囲と重なる矩形の番号（昇順）"""
+        def overlaps(b):
+            return (b[:, 0] <= lat_max) & (b[:, 2] >= lat_min) & (b[:, 1] <= lon_max) & (b[:, 3] >= lon_min)
+
+        nodes = np.flatnonzero(overlaps(self._root))
+        for level in range(len(self._levels) - 1, -1, -1):
+            if not len(nodes):
+                break
+            _, starts, ends = self._levels[level]
+            nodes = np.concatenate([np.arange(a, b) for a, b in zip(starts[nodes], ends[nodes])])
+            # 子の矩形は1つ下の階層（最下層なら矩形そのもの）
+            child_boxes = self._levels[level - 1][0] if level else self._leaf_boxes
+            nodes = nodes[overlaps(child_boxes[nodes])]
+        return np.sort(self._ids[nodes])
+
+
+def linear_nearest(lats, lons, lat, lon, k=1):
+    """比較用: 全件の距離を計算してソートする線形走査"""
+    dist = haversine(lat, lon, np.asarray(lats), np.asarray(lons))
+    order = np.argsort(dist, kind="stable")[:k]
+    return order, dist[order]
+
+
+def benchmark(sizes=(1_000, 10_000, 100_000), queries=200, k=5, seed=0):
+    """線形走査とグリッドインデックスのk近傍検索を比較する"""
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in sizes:
+        # 日田市周辺（約20km四方）にランダムな点を配置
+        lats = rng.uniform(33.22, 33.42, n)
+        lons = rng.uniform(130.82, 131.06, n)
+        q_lats = rng.uniform(33.22, 33.42, queries)
+        q_lons = rng.uniform(130.82, 131.06, queries)
+
+        start = time.perf_counter()
+        index = GridIndex(lats, lons)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for lat, lon in zip(q_lats, q_lons):
+            linear_nearest(lats, lons, lat, lon, k)
+        linear = (time.perf_counter() - start) / queries
+
+        start = time.perf_counter()
+        for lat, lon in zip(q_lats, q_lons):
+            index.nearest(lat, lon, k)
+        grid = (time.perf_counter() - start) / queries
+        results.append({"points": n, "build_ms": build * 1000,
+                        "linear_ms": linear * 1000, "grid_ms": grid * 1000})
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{'点数':>8} {'構築(ms)':>10} {'線形(ms/件)':>12} {'グリッド(ms/件)':>16} {'高速化':>8}")
+    for r in benchmark():
+        print(f"{r['points']:>8} {r['build_ms']:>10.1f} {r['linear_ms']:>12.3f} "
+              f"{r['grid_ms']:>16.3f} {r['linear_ms'] / r['grid_ms']:>7.1f}x")
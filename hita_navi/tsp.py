@@ -0,0 +1,86 @@
+"""巡回ルート（出発地固定・帰着なし）の求解
+
+距離行列は0番目を出発地とし、1〜n番目を目的地とする。
+"""
+import numpy as np
+
+# 厳密解（Held-Karp法）を使う目的地数の上限
+HELD_KARP_MAX_STOPS = 16
+
+
+def route_length(dist, order):
+    """出発地(0)から order の順に巡ったときの総距離"""
+    if len(order) == 0:
+        return 0.0
+    path = np.concatenate(([0], np.asarray(order, dtype=int)))
+    return float(dist[path[:-1], path[1:]].sum())
+
+
+def nearest_neighbor_tour(dist):
+    """近隣法による近似解（目的地の訪問順を返す）"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    order = []
+    current = 0
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[current])
+        current = int(np.argmin(row))
+        visited[current] = True
+        order.append(current)
+    return order
+
+
+def held_karp_tour(dist):
+    """ビットマスク動的計画法（Held-Karp法）による厳密解"""
+    n = len(dist) - 1
+    if n <= 0:
+        return []
+    if n > HELD_KARP_MAX_STOPS:
+        raise ValueError(f"Held-Karp法は目的地{HELD_KARP_MAX_STOPS}箇所までです（{n}箇所）")
+
+    between = np.asarray(dist, dtype=float)[1:, 1:]
+    from_start = np.asarray(dist, dtype=float)[0, 1:]
+
+    full = 1 << n
+    masks = np.arange(full)
+    popcount = np.zeros(full, dtype=np.int8)
+    for b in range(n):
+        popcount += (masks >> b) & 1
+
+    # cost[mask, j]: 集合 mask を訪問し j で終わる最短距離
+    cost = np.full((full, n), np.inf)
+    parent = np.full((full, n), -1, dtype=np.int8)
+    singles = 1 << np.arange(n)
+    cost[singles, np.arange(n)] = from_start
+
+    for size in range(2, n + 1):
+        group = masks[popcount == size]
+        for j in range(n):
+            ending = group[(group >> j) & 1 == 1]
+            prev = ending ^ (1 << j)
+            cand = cost[prev] + between[:, j]
+            best = np.argmin(cand, axis=1)
+            cost[ending, j] = cand[np.arange(len(ending)), best]
+            parent[ending, j] = best
+
+    # 終点から逆にたどって順序を復元
+    mask = full - 1
+    last = int(np.argmin(cost[mask]))
+    order = []
+    while last >= 0:
+        order.append(last + 1)
+        prev_last = int(parent[mask, last])
+        mask ^= 1 << last
+        last = prev_last
+    return order[::-1]
+
+
+def solve_route(dist, exact_limit=HELD_KARP_MAX_STOPS):
+    """目的地数に応じて厳密解法と近似解法を切り替える"""
+    n = len(dist) - 1
+    if n <= 1:
+        return list(range(1, n + 1))
+    if n <= exact_limit:
+        return held_karp_tour(dist)
+    return nearest_neighbor_tour(dist)
@@ -3,11 +3,35 @@ import folium
 from streamlit_folium import st_folium
 import pandas as pd
 import numpy as np
+import hmac
 import json
+import threading
+from dataclasses import asdict
 from datetime import datetime, timedelta
-from geopy.distance import geodesic
-import itertools
-from math import radians, cos, sin, asin, sqrt
+from pathlib import Path
+from hita_navi.clustering import default_bounds, parse_bounds, visible_groups
+from hita_navi.contraction import ContractionHierarchy
+from hita_navi.coverage import ShelterCoverage
+from hita_navi.datastore import PoiIndex, load_table
+from hita_navi.hazard import load_hazards
+from hita_navi.isochrone import IsochroneEngine
+from hita_navi.local_search import ImprovementResult
+from hita_navi.location_stream import (LOCATION_DEBOUNCE_MS, LOCATION_MIN_DISTANCE_M, in_bounds, location_stream,
+                                      moved)
+from hita_navi.map_layers import LayeredMap
+from hita_navi.memo import LRUMemo, location_key
+from hita_navi.multistart import ParallelSolver
+from hita_navi.occupancy import OccupancyStore, open_backend
+from hita_navi.planner import Planner, calculate_travel_time, file_version, safety_version
+from hita_navi.poi_matrix import PoiMatrix, dataset_version, place_key
+from hita_navi.records import Place, Shelter
+from hita_navi.road_graph import RoadGraph
+from hita_navi.route_cache import RouteCache, route_key
+from hita_navi.route_jobs import RouteJob, RouteSolver
+from hita_navi.safety_raster import SafetyModel
+from hita_navi.spatial_index import GridIndex
+from hita_navi.scheduler import DEFAULT_MEAL_WINDOW, format_clock
+from hita_navi.shelter_assignment import ShelterAssignment, population_grid
 
 # ページ設定
 st.set_page_config(
@@ -85,248 +109,502 @@ st.markdown("""
 
 # 日田市の基本設定
 HITA_CENTER = [33.3200, 130.9417]  # 日田市役所周辺
+# GPSの位置を現在地として受け付ける範囲（南端, 西端, 北端, 東端。範囲外はデータが無い）
+HITA_AREA_BOUNDS = (33.0, 130.5, 34.0, 131.5)
+
+# 距離計算の精度モード（"haversine": 高速な球面近似 / "vincenty": 楕円体で高精度）
+DISTANCE_METHOD = "haversine"
+
+# 大規模ルートの改善ステージ（"2opt", "oropt", "sa"）と制限時間（秒）
+ROUTE_IMPROVERS = ("2opt", "oropt")
+ROUTE_TIME_BUDGET = 2.0
+
+# 厳密解の規模を超えるルートは複数プロセスで多スタート探索する（ワーカー数 None は CPU コア数-1）
+ROUTE_MULTISTART = True
+ROUTE_PROCESSES = None
+
+# ボタンを押した実行内でこの秒数以内に終われば、その場で結果を表示（超えたらバックグラウンドで続行）
+ROUTE_WAIT_SECONDS = 0.5
+# 計算中のルートの進み具合を確認する間隔（秒）
+ROUTE_POLL_SECONDS = 0.5
+ROUTE_STAGE_LABELS = {
+    "queued": "順番待ち", "nearest": "近隣法", "exact": "厳密解",
+    "2opt": "2-opt", "oropt": "Or-opt", "sa": "焼きなまし法", "multistart": "多スタート探索",
+}
+
+# 到達圏（N分以内に行ける範囲）の選択肢（分）
+ISOCHRONE_MINUTES = (5, 10, 15, 20, 30)
+TRANSPORT_LABELS = {"walk": "🚶 徒歩", "bicycle": "🚴 自転車", "car": "🚗 車"}
+
+# スケジュール作成時の昼食の時間帯
+MEAL_WINDOW = DEFAULT_MEAL_WINDOW
+
+# 一覧に表示する件数（現在地から近い順）
+SPOT_LIST_SIZE = 20
+SHELTER_LIST_SIZE = 10
+
+# データファイル（ファイルを更新すると再デプロイなしで自動的に再読み込みされる）
+DATA_DIR = Path(__file__).parent / "data"
 
 # 観光地データ
-TOURISM_SPOTS = [
-    {
-        "name": "日田祇園の曳山会館",
-        "category": "文化施設",
-        "lat": 33.3211,
-        "lon": 130.9425,
-        "wait_time": 30,
-        "visit_duration": 45,
-        "description": "日田祇園祭の山鉾を常設展示",
-        "rating": 4.3
-    },
-    {
-        "name": "豆田町",
-        "category": "歴史街並み",
-        "lat": 33.3234,
-        "lon": 130.9445,
-        "wait_time": 15,
-        "visit_duration": 60,
-        "description": "江戸時代の町並みが残る歴史地区",
-        "rating": 4.5
-    },
-    {
-        "name": "咸宜園跡",
-        "category": "史跡",
-        "lat": 33.3189,
-        "lon": 130.9398,
-        "wait_time": 10,
-        "visit_duration": 30,
-        "description": "江戸時代の私塾跡",
-        "rating": 4.1
-    },
-    {
-        "name": "亀山公園",
-        "category": "公園",
-        "lat": 33.3167,
-        "lon": 130.9356,
-        "wait_time": 5,
-        "visit_duration": 45,
-        "description": "桜の名所として有名",
-        "rating": 4.2
-    },
-    {
-        "name": "日田温泉",
-        "category": "温泉",
-        "lat": 33.3245,
-        "lon": 130.9412,
-        "wait_time": 20,
-        "visit_duration": 90,
-        "description": "三隈川沿いの温泉街",
-        "rating": 4.4
-    },
-    {
-        "name": "三隈川",
-        "category": "自然",
-        "lat": 33.3223,
-        "lon": 130.9401,
-        "wait_time": 0,
-        "visit_duration": 30,
-        "description": "日田市を流れる美しい川",
-        "rating": 4.0
-    },
-    {
-        "name": "日田市立博物館",
-        "category": "博物館",
-        "lat": 33.3278,
-        "lon": 130.9467,
-        "wait_time": 15,
-        "visit_duration": 60,
-        "description": "日田の歴史と文化を展示",
-        "rating": 4.1
-    },
-    {
-        "name": "小鹿田焼の里",
-        "category": "工芸",
-        "lat": 33.2756,
-        "lon": 130.8823,
-        "wait_time": 25,
-        "visit_duration": 75,
-        "description": "伝統的な陶器の里",
-        "rating": 4.6
-    }
-]
+TOURISM_SPOTS = load_table(DATA_DIR / "tourism_spots.csv", Place)
 
 # 飲食店データ
-RESTAURANTS = [
-    {
-        "name": "うなぎの寝床",
-        "category": "和食",
-        "lat": 33.3225,
-        "lon": 130.9435,
-        "wait_time": 30,
-        "visit_duration": 60,
-        "description": "日田名物のうなぎ料理",
-        "rating": 4.4
-    },
-    {
-        "name": "日田まぶし千屋",
-        "category": "郷土料理",
-        "lat": 33.3215,
-        "lon": 130.9428,
-        "wait_time": 25,
-        "visit_duration": 50,
-        "description": "日田のひつまぶし専門店",
-        "rating": 4.3
-    },
-    {
-        "name": "焼きとり鳥善",
-        "category": "焼き鳥",
-        "lat": 33.3198,
-        "lon": 130.9441,
-        "wait_time": 20,
-        "visit_duration": 45,
-        "description": "地元で人気の焼き鳥店",
-        "rating": 4.2
-    }
-]
+RESTAURANTS = load_table(DATA_DIR / "restaurants.csv", Place)
 
 # 避難所データ
-EVACUATION_CENTERS = [
-    {
-        "name": "日田市役所",
-        "type": "指定避難所",
-        "lat": 33.3200,
-        "lon": 130.9417,
-        "capacity": 500,
-        "facilities": ["医療室", "給水設備", "非常用電源"],
-        "safety_level": "高"
-    },
-    {
-        "name": "日田市民センター",
-        "type": "指定避難所",
-        "lat": 33.3234,
-        "lon": 130.9445,
-        "capacity": 300,
-        "facilities": ["給水設備", "非常用電源"],
-        "safety_level": "高"
-    },
-    {
-        "name": "日田高等学校",
-        "type": "指定避難所",
-        "lat": 33.3156,
-        "lon": 130.9489,
-        "capacity": 800,
-        "facilities": ["医療室", "給水設備", "体育館"],
-        "safety_level": "中"
-    },
-    {
-        "name": "三隈中学校",
-        "type": "指定避難所",
-        "lat": 33.3267,
-        "lon": 130.9356,
-        "capacity": 400,
-        "facilities": ["給水設備", "体育館"],
-        "safety_level": "中"
-    },
-    {
-        "name": "桂林小学校",
-        "type": "指定避難所",
-        "lat": 33.3178,
-        "lon": 130.9512,
-        "capacity": 300,
-        "facilities": ["給水設備"],
-        "safety_level": "中"
-    }
-]
+EVACUATION_CENTERS = load_table(DATA_DIR / "evacuation_centers.geojson", Shelter)
+
+# 道路ネットワーク（OSM抽出ファイル。変換済みの .npz を優先し、どちらも無い場合は直線距離で計算）
+ROAD_GRAPH_FILES = [DATA_DIR / "hita_roads.npz", DATA_DIR / "hita_roads.osm"]
+
+# 危険エリア（浸水想定区域など）。ファイルを更新すると避難ルートにすぐ反映される
+HAZARD_FILE = DATA_DIR / "hazard_areas.geojson"
+
+# 標高・浸水深ラスタ（elevation*.npy / flood_depth*.npy と位置情報の .json。無い場合は簡易計算）
+RASTER_DIR = DATA_DIR / "rasters"
+
+# 避難者の分布（任意。lat, lon, count 列のCSV。あれば収容人数を考慮した避難所の割り当てを表示）
+POPULATION_FILE = DATA_DIR / "population.csv"
+
+# 縮約階層（python -m hita_navi.contraction で事前計算。あれば避難所までの距離計算に使う）
+ROUTE_HIERARCHY_FILE = DATA_DIR / "hita_roads.ch.npz"
+
+# 避難所の到達表（python -m hita_navi.coverage で事前計算。あれば避難所一覧は表を引くだけで表示）
+COVERAGE_FILE = DATA_DIR / "shelter_coverage.npy"
+
+# 全セッション共有の最適ルートのキャッシュ（再起動後も使えるようにディスクにも保存）
+ROUTE_CACHE_FILE = Path(__file__).parent / ".cache" / "routes.sqlite"
+
+# 避難所の入所状況の保存先（"memory://" / "sqlite:///パス" / "redis://ホスト:ポート/番号"）
+OCCUPANCY_STORE_URL = f"sqlite:///{Path(__file__).parent / '.cache' / 'occupancy.sqlite'}"
+# 避難所一覧の入所状況を読み直す間隔（秒）
+OCCUPANCY_POLL_SECONDS = 5.0
+# 入所状況の記録に必要な運営者キーの st.secrets の名前（未設定の場合は記録フォームを表示しない）
+OCCUPANCY_OPERATOR_SECRET = "occupancy_operator_key"
 
 # セッション状態の初期化
 if 'current_location' not in st.session_state:
     st.session_state.current_location = HITA_CENTER
-if 'selected_spots' not in st.session_state:
-    st.session_state.selected_spots = []
-if 'optimized_route' not in st.session_state:
-    st.session_state.optimized_route = []
+# 選択中の目的地と最適ルートはPOIのIDのリストで持つ
+if 'selected_ids' not in st.session_state:
+    st.session_state.selected_ids = []
+if 'route_ids' not in st.session_state:
+    st.session_state.route_ids = []
+if 'schedule' not in st.session_state:
+    st.session_state.schedule = None
 if 'current_mode' not in st.session_state:
     st.session_state.current_mode = "tourism"
+if 'memo' not in st.session_state:
+    st.session_state.memo = LRUMemo()
+if 'route_job' not in st.session_state:
+    st.session_state.route_job = None
+# GPSから最後に反映した位置の時刻と精度
+if 'location_timestamp' not in st.session_state:
+    st.session_state.location_timestamp = None
+if 'location_accuracy' not in st.session_state:
+    st.session_state.location_accuracy = None
+# 日田市周辺の範囲外のため反映しなかったGPSの位置
+if 'location_rejected' not in st.session_state:
+    st.session_state.location_rejected = None
 
-# ユーティリティ関数
+# ユーティリティ関数（計算は hita_navi.planner に委ねる）
 def calculate_distance(lat1, lon1, lat2, lon2):
     """2点間の距離を計算（km）"""
-    return geodesic((lat1, lon1), (lat2, lon2)).kilometers
-
-def calculate_travel_time(distance_km, transport_mode):
-    """交通手段別の所要時間を計算（分）"""
-    speeds = {
-        "walk": 4.8,      # 徒歩: 4.8km/h
-        "bicycle": 15,    # 自転車: 15km/h
-        "car": 30,        # 車: 30km/h（市街地）
-        "train": 45       # 鉄道: 45km/h（平均）
-    }
-    return (distance_km / speeds[transport_mode]) * 60
+    return PLANNER.distance((lat1, lon1), (lat2, lon2))
+
+def calculate_leg_distances(start_location, route):
+    """ルート各区間（前の地点→次の地点）の距離を計算（km）"""
+    return PLANNER.leg_distances(start_location, route)
+
+def calculate_safe_route(origin, destination):
+    """危険エリアを避けた避難ルートの距離（km）と形状（避けられない場合は通常の経路）"""
+    return PLANNER.safe_route(origin, destination)
+
+def calculate_route_geometry(start_location, route):
+    """ルート全体の地図表示用の形状"""
+    return PLANNER.route_geometry(start_location, route)
 
-def optimize_route(start_location, destinations):
-    """複数目的地の最適ルートを計算（TSP問題の近似解）"""
-    if len(destinations) <= 1:
-        return destinations
+def route_problem(start_location, destinations):
+    """目的地を正規化した順に並べ、キャッシュのキーと組で返す（訪問順はこの並びの番号で持つ）
+
+    キーはIDで持つため、POIを移動しても古い訪問順を返さないようデータセットのバージョンも含める
+    """
+    destinations = sorted(destinations, key=place_key)
+    key = route_key(
+        start_location, [place_key(d) for d in destinations],
+        (DISTANCE_METHOD, DATASET_VERSION, ROAD_GRAPH_VERSION, ROUTE_IMPROVERS, ROUTE_MULTISTART)
+    )
+    return destinations, key
+
+def start_route_job(start_location, destinations):
+    """最適ルートの計算をバックグラウンドで開始（このセッションの計算中のジョブは中止）"""
+    cancel_route_job()
+    destinations, key = route_problem(start_location, destinations)
     
-    # 全ての組み合わせを試す（目的地が少ない場合）
-    if len(destinations) <= 6:
-        min_distance = float('inf')
-        best_route = destinations
-        
-        for perm in itertools.permutations(destinations):
-            total_distance = 0
-            current_pos = start_location
-            
-            for dest in perm:
-                total_distance += calculate_distance(
-                    current_pos[0], current_pos[1], dest['lat'], dest['lon']
+    def solve(job):
+        cached = ROUTE_CACHE.get(key)
+        if cached is not None:
+            return ImprovementResult(**cached)
+        dist = POI_MATRIX.sub_matrix(start_location, destinations)
+        result = PLANNER.solve_matrix(dist, on_progress=job.report, should_stop=job.should_stop)
+        # 中止された途中の解は共有のキャッシュに入れない
+        if not job.cancelled:
+            ROUTE_CACHE.put(key, asdict(result))
+        return result
+    
+    job = RouteJob(key, [place['id'] for place in destinations], ROUTE_TIME_BUDGET)
+    st.session_state.route_job = ROUTE_SOLVER.submit(job, solve)
+    return job
+
+def cancel_route_job():
+    """計算中のジョブを中止して結果を捨てる。中止したら True"""
+    job = st.session_state.route_job
+    st.session_state.route_job = None
+    if job is None or job.done():
+        return False
+    job.cancel()
+    return True
+
+def show_route_result(job):
+    """終わったジョブの結果をルートとして確定して表示"""
+    st.session_state.route_job = None
+    if job.future.cancelled():
+        st.info("ルートの計算を中止しました")
+        return
+    result = job.result()
+    st.session_state.route_ids = [job.destination_ids[i - 1] for i in result.order]
+    if job.cancelled:
+        st.warning(f"計算を中止しました。途中までの最良ルート（{len(result.order)}箇所）を表示しています")
+        return
+    st.success(f"{len(result.order)}箇所の最適ルートを計算しました！")
+    if result.iterations:
+        st.caption(f"局所探索で {result.improvement_pct:.1f}% 短縮（改善 {result.iterations}回）")
+
+@st.fragment(run_every=ROUTE_POLL_SECONDS)
+def route_job_status(shown_updates):
+    """計算中のルートの進み具合（終わった・最良解が更新されたら画面全体を再実行して地図に反映）"""
+    job = st.session_state.route_job
+    if job is None:
+        return
+    stage, _, length, updates = job.snapshot()
+    if job.done() or updates != shown_updates:
+        st.rerun()
+    text = f"ルートを計算中…（{ROUTE_STAGE_LABELS.get(stage, stage)}"
+    if length is not None:
+        text += f"・現在の最良 {length:.1f}km"
+    st.progress(job.progress(), text=text + "）")
+    if st.button("⏹️ 計算を中止", key="cancel_route", disabled=job.cancelled):
+        job.cancel()
+
+def occupancy_label(occupied, capacity):
+    """入所状況の表示（満員・残りわずか・空きあり）"""
+    if occupied >= capacity:
+        return "🔴 満員"
+    if occupied >= capacity * 0.8:
+        return f"🟡 残りわずか（あと{capacity - occupied}人）"
+    return f"🟢 空きあり（あと{capacity - occupied}人）"
+
+@st.fragment(run_every=OCCUPANCY_POLL_SECONDS)
+def shelter_occupancy_status(shelters):
+    """一覧の避難所の現在の入所状況（定期的に読み直す。読み取りは全セッションで共有のキャッシュを通る）"""
+    occupied = OCCUPANCY.occupancy([shelter['id'] for shelter in shelters])
+    st.dataframe(pd.DataFrame({
+        "避難所": [shelter['name'] for shelter in shelters],
+        "避難者数": occupied,
+        "収容人数": [shelter['capacity'] for shelter in shelters],
+        "状況": [occupancy_label(count, shelter['capacity']) for count, shelter in zip(occupied, shelters)],
+    }), hide_index=True, use_container_width=True)
+    st.caption(f"{datetime.now().strftime('%H:%M:%S')} 時点（{OCCUPANCY_POLL_SECONDS:.0f}秒ごとに更新）")
+
+@st.cache_resource(max_entries=2)
+def load_road_graph(path, version):
+    """道路グラフ（ファイルの更新ごとに1回だけ読み込み、全セッションで共有）"""
+    return RoadGraph.load(path)
+
+def get_road_graph():
+    """利用できる道路グラフとそのバージョン。ファイルが無い場合は (None, "")"""
+    for path in ROAD_GRAPH_FILES:
+        if path.exists():
+            version = file_version(path)
+            return load_road_graph(str(path), version), version
+    return None, ""
+
+def score_evacuation_routes(geometries):
+    """ルートごとの安全度（最小・平均）。ラスタが無い・範囲外のルートは None"""
+    return PLANNER.score_routes(geometries)
+
+@st.cache_resource
+def load_route_cache():
+    """最適ルートのキャッシュ（プロセス全体で1つ）"""
+    return RouteCache(path=ROUTE_CACHE_FILE)
+
+def occupancy_operator_key():
+    """st.secrets の運営者キー（secrets.toml が無い・未設定の場合は None）"""
+    try:
+        return st.secrets.get(OCCUPANCY_OPERATOR_SECRET)
+    except FileNotFoundError:
+        return None
+
+@st.cache_resource
+def load_occupancy_store():
+    """避難所の入所状況（プロセス全体で1つ。読み取りは短時間キャッシュし、記録はまとめて書き込む）"""
+    return OccupancyStore(open_backend(OCCUPANCY_STORE_URL))
+
+@st.cache_resource
+def load_route_solver():
+    """ルート最適化用のスレッドプール（プロセス全体で1つ）"""
+    return RouteSolver()
+
+@st.cache_resource
+def load_parallel_solver():
+    """多スタート探索用のプロセスプール（プロセス全体で1つ、ワーカーは最初の利用時に起動）"""
+    return ParallelSolver(ROUTE_PROCESSES)
+
+@st.cache_resource(max_entries=2)
+def load_safety_model(version):
+    """標高・浸水深ラスタ（メモリマップのため読み込みは位置情報のみ）"""
+    return SafetyModel.open(RASTER_DIR)
+
+def get_safety_model():
+    """ラスタとそのバージョン（ファイル名と更新時刻）"""
+    version = safety_version(DATA_DIR)
+    return load_safety_model(version), version
+
+def memoized(kind, compute, *key):
+    """(種類, 丸めた現在地, key, データのバージョン) ごとにセッション内で結果を使い回す"""
+    full_key = (kind, location_key(st.session_state.current_location), *key,
+                DATASET_VERSION, ROAD_GRAPH_VERSION, HAZARDS.version, SAFETY_VERSION)
+    return st.session_state.memo.get(full_key, compute)
+
+def session_map(key, version, build):
+    """セッションごとの地図（静的レイヤーは最初の1回だけ作り、version が変わったら作り直す）"""
+    cached = st.session_state.get(f"{key}_base")
+    if cached is None or cached[0] != version:
+        cached = (version, build())
+        st.session_state[f"{key}_base"] = cached
+    return cached[1]
+
+def build_tourism_map():
+    """観光モードの背景地図（スポットは表示範囲に応じて都度追加）"""
+    return LayeredMap(HITA_CENTER, 14)
+
+def build_disaster_map():
+    """防災モードの地図（危険エリアの静的レイヤーを作成済み）"""
+    # 危険エリア（通行止めは赤、迂回推奨は橙で表示）
+    hazards = folium.FeatureGroup(name="危険エリア")
+    for area in HAZARDS:
+        area_color = 'red' if area.blocked else 'orange'
+        folium.Polygon(
+            locations=[list(point) for point in area.polygon],
+            color=area_color,
+            weight=2,
+            opacity=0.8,
+            fill=True,
+            fillColor=area_color,
+            fillOpacity=0.2,
+            popup=area.message or area.name
+        ).add_to(hazards)
+    return LayeredMap(HITA_CENTER, 13, [hazards])
+
+def map_viewport(key, zoom):
+    """前回の地図操作で返された表示範囲とズーム（初回や現在地が範囲外の場合は現在地の周辺）"""
+    state = st.session_state.get(key) or {}
+    zoom = state.get('zoom') or zoom
+    bounds = parse_bounds(state.get('bounds'))
+    lat, lon = st.session_state.current_location
+    if bounds is None or not (bounds[0] <= lat <= bounds[2] and bounds[1] <= lon <= bounds[3]):
+        bounds = default_bounds(st.session_state.current_location, zoom)
+    return bounds, zoom
+
+def poi_layer(name, places, viewport, add_marker, skip=None):
+    """表示範囲内のPOIだけのレイヤー（密集している場合は件数付きのクラスタにまとめる）"""
+    bounds, zoom = viewport
+    layer = folium.FeatureGroup(name=name)
+    for members, lat, lon in visible_groups(places.column('lat'), places.column('lon'), bounds, zoom):
+        if len(members) == 1:
+            place = places[int(members[0])]
+            if skip is None or not skip(place):
+                add_marker(place, layer)
+        else:
+            folium.Marker(
+                [lat, lon],
+                tooltip=f"{len(members)}件（拡大すると表示）",
+                icon=folium.DivIcon(
+                    html=f'<div style="background-color: rgba(102, 126, 234, 0.8); color: white; border-radius: 50%; width: 36px; height: 36px; display: flex; justify-content: center; align-items: center; font-weight: bold;">{len(members)}</div>',
+                    icon_size=(36, 36)
                 )
-                current_pos = [dest['lat'], dest['lon']]
-            
-            if total_distance < min_distance:
-                min_distance = total_distance
-                best_route = list(perm)
-        
-        return best_route
-    else:
-        # 近隣法による近似解
-        unvisited = destinations.copy()
-        route = []
-        current_pos = start_location
-        
-        while unvisited:
-            nearest = min(unvisited, key=lambda x: calculate_distance(
-                current_pos[0], current_pos[1], x['lat'], x['lon']
-            ))
-            route.append(nearest)
-            unvisited.remove(nearest)
-            current_pos = [nearest['lat'], nearest['lon']]
-        
-        return route
+            ).add_to(layer)
+    return layer
+
+def add_spot_marker(spot, layer):
+    folium.Marker(
+        [spot['lat'], spot['lon']],
+        popup=spot['name'],
+        tooltip=spot['name'],
+        icon=folium.Icon(color='lightgray', icon='info-sign')
+    ).add_to(layer)
+
+def add_shelter_marker(shelter, layer):
+    # 安全レベルに応じた色分け
+    color = 'green' if shelter['safety_level'] == '高' else 'orange' if shelter['safety_level'] == '中' else 'red'
+    
+    folium.Marker(
+        [shelter['lat'], shelter['lon']],
+        popup=f"""
+        <b>{shelter['name']}</b><br>
+        収容人数: {shelter['capacity']}人<br>
+        設備: {', '.join(shelter['facilities'])}<br>
+        安全レベル: {shelter['safety_level']}
+        """,
+        tooltip=f"{shelter['name']} ({shelter['safety_level']})",
+        icon=folium.Icon(color=color, icon='home')
+    ).add_to(layer)
+
+def show_map(layered_map, layers, key):
+    """セッションの地図に動的レイヤーだけを追加して表示（表示範囲・ズームが変わったときだけ再実行）"""
+    with layered_map.dynamic(layers) as m:
+        return st_folium(
+            m, key=key, width=700, height=500, render=False,
+            center=st.session_state.current_location,
+            feature_group_to_add=layers, returned_objects=['bounds', 'zoom']
+        )
+
+@st.cache_resource(max_entries=2)
+def load_shelter_assignment(version, dataset_version, road_version):
+    """避難者の分布と避難所の割り当て器（全セッションで共有。更新は lock を取ってから行う）"""
+    population = pd.read_csv(POPULATION_FILE)
+    counts = population['count'] if 'count' in population else None
+    lats, lons, counts = population_grid(population['lat'], population['lon'], counts)
+    engine = ShelterAssignment.build(lats, lons, counts, EVACUATION_CENTERS, ROAD_GRAPH)
+    return engine, threading.Lock()
+
+def get_shelter_assignment():
+    """残りの収容人数（入所済みの人数を除く）での割り当て結果。避難者の分布ファイルが無い場合は None"""
+    if not POPULATION_FILE.exists():
+        return None
+    version = f"{POPULATION_FILE.name}:{POPULATION_FILE.stat().st_mtime_ns}"
+    engine, lock = load_shelter_assignment(version, DATASET_VERSION, ROAD_GRAPH_VERSION)
+    with lock:
+        # 前回の割り当てから続けて解くため、収容人数が変わらなければすぐ終わる
+        return engine.solve(OCCUPANCY.remaining(EVACUATION_CENTERS))
+
+@st.cache_resource(max_entries=2)
+def load_route_hierarchy(path, version):
+    """縮約階層（ファイルの更新ごとに1回だけ読み込み、全セッションで共有）"""
+    return ContractionHierarchy.load(path)
 
-def get_safe_route_score(lat, lon):
-    """避難ルートの安全性スコアを計算（簡易版）"""
-    # 川からの距離、標高、建物密度などを考慮
-    # 実際の実装では地理データベースとの連携が必要
-    river_distance = abs(lat - 33.3223)  # 三隈川からの距離
-    elevation_factor = (lat - 33.31) * 100  # 簡易標高計算
-    safety_score = min(100, max(0, 50 + river_distance * 1000 + elevation_factor))
-    return safety_score
+def get_route_hierarchy():
+    """道路グラフと節点数が一致する縮約階層とそのバージョン。無い場合は (None, "")"""
+    path = ROUTE_HIERARCHY_FILE
+    if ROAD_GRAPH is None or not path.exists():
+        return None, ""
+    version = file_version(path)
+    hierarchy = load_route_hierarchy(str(path), version)
+    return (hierarchy, version) if len(hierarchy) == len(ROAD_GRAPH) else (None, "")
+
+@st.cache_resource(max_entries=4)
+def load_poi_matrix(version, method, road_version, hierarchy_version):
+    """POI間の距離行列（データセットのバージョンごとに1回だけ作成し、全セッションで共有。ネットワーク距離は使う組だけ計算）"""
+    return PoiMatrix({
+        "tourism": TOURISM_SPOTS,
+        "restaurants": RESTAURANTS,
+        "shelters": EVACUATION_CENTERS
+    }, method=method, road_graph=ROAD_GRAPH, hierarchy=ROUTE_HIERARCHY)
+
+@st.cache_resource(max_entries=4)
+def load_spatial_index(version):
+    """観光地・飲食店・避難所ごとの空間インデックス（データセットのバージョンごとに1回だけ構築）"""
+    return {
+        name: GridIndex(places.column('lat'), places.column('lon'))
+        for name, places in (("tourism", TOURISM_SPOTS), ("restaurants", RESTAURANTS), ("shelters", EVACUATION_CENTERS))
+    }
+
+@st.cache_resource(max_entries=2)
+def load_shelter_coverage(version, dataset_version, road_version, raster_version):
+    """避難所の到達表（メモリマップのため読み込みは位置情報のみ）。避難所・道路・ラスタと合わない場合は None"""
+    return ShelterCoverage.open(COVERAGE_FILE, EVACUATION_CENTERS, road_version, raster_version)
+
+def get_shelter_coverage():
+    """到達表とそのバージョン。ファイルが無い場合は (None, "")"""
+    if not COVERAGE_FILE.exists():
+        return None, ""
+    version = f"{COVERAGE_FILE.name}:{COVERAGE_FILE.stat().st_mtime_ns}"
+    return load_shelter_coverage(version, DATASET_VERSION, ROAD_GRAPH_VERSION, SAFETY_VERSION), version
+
+@st.cache_resource(max_entries=2)
+def load_isochrone_engine(road_version):
+    """到達圏の計算（出発地の格子・交通手段・分ごとの結果を全セッションで共有）"""
+    return IsochroneEngine(ROAD_GRAPH)
+
+def reach_area():
+    """サイドバーで到達圏の表示を選んでいれば、その到達圏。選んでいなければ None"""
+    if not st.session_state.get("isochrone_on"):
+        return None
+    return PLANNER.isochrone(st.session_state.current_location, st.session_state.isochrone_minutes,
+                             st.session_state.isochrone_mode)
+
+def add_isochrone_layer(area, layer):
+    """到達圏の輪郭を地図に追加（穴のある形は偶奇規則で塗られる）"""
+    if area is None:
+        return
+    rings = area.rings()
+    if rings:
+        folium.Polygon(
+            locations=rings,
+            color='purple',
+            weight=1,
+            fill=True,
+            fillColor='purple',
+            fillOpacity=0.12,
+            tooltip=f"{TRANSPORT_LABELS[area.transport_mode]}で{area.minutes:.0f}分以内"
+        ).add_to(layer)
+
+@st.cache_resource(max_entries=4)
+def load_poi_index(version):
+    """全POIの ID → データの索引（データセットのバージョンごとに1回だけ作成）"""
+    return PoiIndex(TOURISM_SPOTS, RESTAURANTS, EVACUATION_CENTERS)
+
+def selected_places():
+    """選択中の目的地（選択した順）"""
+    return POI_INDEX.records(st.session_state.selected_ids)
+
+def route_places():
+    """最適ルートの訪問順の目的地"""
+    return POI_INDEX.records(st.session_state.route_ids)
+
+def set_selected(poi_id, selected):
+    """チェックボックスの状態に合わせて選択中のIDを更新"""
+    if selected and poi_id not in st.session_state.selected_ids:
+        st.session_state.selected_ids.append(poi_id)
+    elif not selected and poi_id in st.session_state.selected_ids:
+        st.session_state.selected_ids.remove(poi_id)
+
+def nearest_places(group, location, k, keep=None):
+    """現在地から近い順に最大 k 件の (POIのリスト, 距離kmの配列) を返す。keep で絞り込み条件を指定"""
+    return PLANNER.nearest(group, location, k, keep)
+
+DATASET_VERSION = dataset_version(TOURISM_SPOTS, RESTAURANTS, EVACUATION_CENTERS)
+POI_INDEX = load_poi_index(DATASET_VERSION)
+ROAD_GRAPH, ROAD_GRAPH_VERSION = get_road_graph()
+ROUTE_HIERARCHY, ROUTE_HIERARCHY_VERSION = get_route_hierarchy()
+HAZARDS = load_hazards(HAZARD_FILE)
+SAFETY_MODEL, SAFETY_VERSION = get_safety_model()
+ROUTE_CACHE = load_route_cache()
+OCCUPANCY = load_occupancy_store()
+ROUTE_SOLVER = load_route_solver()
+PARALLEL_SOLVER = load_parallel_solver() if ROUTE_MULTISTART else None
+POI_MATRIX = load_poi_matrix(DATASET_VERSION, DISTANCE_METHOD, ROAD_GRAPH_VERSION, ROUTE_HIERARCHY_VERSION)
+SPATIAL_INDEX = load_spatial_index(DATASET_VERSION)
+ISOCHRONES = load_isochrone_engine(ROAD_GRAPH_VERSION)
+SHELTER_COVERAGE, COVERAGE_VERSION = get_shelter_coverage()
+PLANNER = Planner(
+    TOURISM_SPOTS, RESTAURANTS, EVACUATION_CENTERS,
+    road_graph=ROAD_GRAPH, hierarchy=ROUTE_HIERARCHY, hazards=HAZARDS, safety=SAFETY_MODEL,
+    method=DISTANCE_METHOD, improvers=ROUTE_IMPROVERS, time_budget=ROUTE_TIME_BUDGET,
+    parallel_solver=PARALLEL_SOLVER, poi_matrix=POI_MATRIX, spatial_index=SPATIAL_INDEX, poi_index=POI_INDEX,
+    isochrones=ISOCHRONES, coverage=SHELTER_COVERAGE
+)
 
 # メインタイトル
 st.markdown('<h1 class="main-header">🗾 日田市ナビゲーションアプリ</h1>', unsafe_allow_html=True)
@@ -349,152 +627,26 @@ if st.session_state.current_mode == "tourism":
 else:
     st.markdown('<div class="mode-header disaster-mode">🚨 防災モード - 安全な避難ルートを確保</div>', unsafe_allow_html=True)
 
-# GPS位置情報を受信するためのJavaScript（ページ上部に配置）
-st.markdown("""
-<script>
-// GPS位置情報をStreamlitに送信する関数
-function sendLocationToStreamlit(lat, lon, accuracy) {
-    // StreamlitのSession Stateを更新するためのカスタムイベント
-    const event = new CustomEvent('gps_update', {
-        detail: {
-            latitude: lat,
-            longitude: lon,
-            accuracy: accuracy
-        }
-    });
-    window.dispatchEvent(event);
-    
-    // より確実にStreamlitに情報を渡すためのフォールバック
-    if (window.streamlitGPS) {
-        window.streamlitGPS(lat, lon, accuracy);
-    }
-}
-
-// メッセージリスナーでGPS情報を受信
-window.addEventListener('message', function(event) {
-    if (event.data && event.data.type === 'gps_location') {
-        const lat = event.data.latitude;
-        const lon = event.data.longitude;
-        const accuracy = event.data.accuracy;
-        
-        // StreamlitのSession Stateを更新
-        sendLocationToStreamlit(lat, lon, accuracy);
-        
-        // ローカルストレージにも保存
-        localStorage.setItem('gps_lat', lat);
-        localStorage.setItem('gps_lon', lon);
-        localStorage.setItem('gps_accuracy', accuracy);
-        localStorage.setItem('gps_timestamp', Date.now());
-    }
-});
-
-// ページ読み込み時にローカルストレージから復元
-window.addEventListener('load', function() {
-    const stored_lat = localStorage.getItem('gps_lat');
-    const stored_lon = localStorage.getItem('gps_lon');
-    const stored_timestamp = localStorage.getItem('gps_timestamp');
-    
-    // 5分以内のデータなら復元
-    if (stored_lat && stored_lon && stored_timestamp) {
-        const age = Date.now() - parseInt(stored_timestamp);
-        if (age < 300000) { // 5分 = 300000ms
-            sendLocationToStreamlit(parseFloat(stored_lat), parseFloat(stored_lon), 
-                                   parseFloat(localStorage.getItem('gps_accuracy') || 0));
-        }
-    }
-});
-</script>
-""", unsafe_allow_html=True)
-
-# GPS情報を受信してSession Stateに保存
-# ブラウザのローカルストレージからGPS情報を取得
-js_code = """
-<script>
-function checkGPSData() {
-    const lat = localStorage.getItem('gps_lat');
-    const lon = localStorage.getItem('gps_lon');
-    const accuracy = localStorage.getItem('gps_accuracy');
-    const timestamp = localStorage.getItem('gps_timestamp');
-    
-    if (lat && lon) {
-        // データの更新時刻をチェック
-        const age = Date.now() - parseInt(timestamp || 0);
-        const ageMinutes = Math.floor(age / 60000);
-        
-        document.getElementById('gps-data').innerHTML = 
-            `<div style="background: #e8f5e9; padding: 10px; border-radius: 5px; margin: 5px 0;">
-                <strong>📍 GPS位置情報</strong><br>
-                緯度: ${parseFloat(lat).toFixed(6)}<br>
-                経度: ${parseFloat(lon).toFixed(6)}<br>
-                精度: ${Math.round(accuracy || 0)}m<br>
-                取得: ${ageMinutes}分前
-            </div>`;
-        
-        // Streamlitの隠しフィールドに値を設定
-        const latInput = document.querySelector('input[aria-label="GPS緯度"]');
-        const lonInput = document.querySelector('input[aria-label="GPS経度"]');
-        if (latInput) latInput.value = lat;
-        if (lonInput) lonInput.value = lon;
-        
-        return true;
-    }
-    return false;
-}
-
-// 定期的にGPSデータをチェック
-setInterval(checkGPSData, 1000);
-checkGPSData(); // 初回実行
-</script>
-<div id="gps-data"></div>
-"""
-
-# GPS位置をStreamlitで使用するための処理
-if st.sidebar.button("💾 GPS位置を現在地に適用", type="primary"):
-    # JavaScriptからGPS情報を取得するためのスクリプト
-    get_gps_script = """
-    <script>
-    function applyGPSLocation() {
-        const lat = localStorage.getItem('gps_lat');
-        const lon = localStorage.getItem('gps_lon');
-        
-        if (lat && lon) {
-            // 隠れた入力フィールドに値を設定
-            const hiddenLat = document.querySelector('input[data-testid="gps-lat-hidden"]');
-            const hiddenLon = document.querySelector('input[data-testid="gps-lon-hidden"]');
-            
-            if (hiddenLat && hiddenLon) {
-                hiddenLat.value = lat;
-                hiddenLon.value = lon;
-                hiddenLat.dispatchEvent(new Event('input', {bubbles: true}));
-                hiddenLon.dispatchEvent(new Event('input', {bubbles: true}));
-            }
-            
-            alert('GPS位置を適用しました:\\n緯度: ' + parseFloat(lat).toFixed(6) + '\\n経度: ' + parseFloat(lon).toFixed(6));
-        } else {
-            alert('GPS情報が見つかりません。\\n先にGPS取得ボタンを押してください。');
-        }
-    }
-    applyGPSLocation();
-    </script>
-    """
-    st.sidebar.markdown(get_gps_script, unsafe_allow_html=True)
-
-# 隠れた入力フィールド（JavaScriptからの値受け取り用）
-gps_lat_hidden = st.sidebar.number_input("", value=0.0, format="%.6f", key="gps-lat-hidden", 
-                                         label_visibility="collapsed")
-gps_lon_hidden = st.sidebar.number_input("", value=0.0, format="%.6f", key="gps-lon-hidden", 
-                                         label_visibility="collapsed")
-
-# GPS情報が有効な場合、現在地として設定
-if gps_lat_hidden != 0.0 and gps_lon_hidden != 0.0:
-    # 日田市周辺の範囲チェック
-    if 33.0 <= gps_lat_hidden <= 34.0 and 130.5 <= gps_lon_hidden <= 131.5:
-        old_location = st.session_state.current_location.copy()
-        st.session_state.current_location = [gps_lat_hidden, gps_lon_hidden]
-        
-        if old_location != st.session_state.current_location:
-            st.sidebar.success(f"📍 GPS位置を現在地に設定しました!")
-            st.rerun()
+# GPSによる現在地の追跡（ブラウザ側で一定距離以上動いた場合だけ位置が送られ、再実行される）
+st.sidebar.markdown("#### 🛰️ GPS")
+st.sidebar.toggle("GPSで現在地を追跡", key="gps_tracking")
+with st.sidebar:
+    position = location_stream(enabled=st.session_state.gps_tracking,
+                               min_distance_m=LOCATION_MIN_DISTANCE_M, debounce_ms=LOCATION_DEBOUNCE_MS)
+# 同じ位置の値は再実行のたびに返るため、新しく届いた位置だけを反映する（手動入力を上書きしない）
+if position and "lat" in position and position.get("timestamp") != st.session_state.location_timestamp:
+    st.session_state.location_timestamp = position.get("timestamp")
+    if not in_bounds(position, HITA_AREA_BOUNDS):
+        st.session_state.location_rejected = [position["lat"], position["lon"]]
+    else:
+        st.session_state.location_rejected = None
+        if moved(st.session_state.current_location, position, LOCATION_MIN_DISTANCE_M):
+            st.session_state.current_location = [position["lat"], position["lon"]]
+            st.session_state.location_accuracy = position.get("accuracy")
+if st.session_state.location_rejected is not None:
+    rejected_lat, rejected_lon = st.session_state.location_rejected
+    st.sidebar.warning(f"⚠️ GPSの位置（{rejected_lat:.5f}, {rejected_lon:.5f}）は日田市周辺の範囲外のため、"
+                       "現在地に反映していません")
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("#### ✏️ 手動入力")
@@ -503,6 +655,7 @@ manual_lon = st.sidebar.number_input("経度", value=st.session_state.current_lo
 
 if st.sidebar.button("手動入力の位置を設定"):
     st.session_state.current_location = [manual_lat, manual_lon]
+    st.session_state.location_accuracy = None
     st.sidebar.success("現在地を更新しました")
     st.rerun()
 
@@ -522,220 +675,25 @@ st.sidebar.info(f"""
 
 **距離:** 日田市中心部から {distance_to_center:.1f}km
 """)
-<script>
-function getCurrentLocation() {
-    if (navigator.geolocation) {
-        navigator.geolocation.getCurrentPosition(
-            function(position) {
-                const lat = position.coords.latitude;
-                const lon = position.coords.longitude;
-                const accuracy = position.coords.accuracy;
-                
-                // Streamlitに位置情報を送信
-                window.parent.postMessage({
-                    type: 'gps_location',
-                    latitude: lat,
-                    longitude: lon,
-                    accuracy: accuracy
-                }, '*');
-                
-                document.getElementById('gps-status').innerHTML = 
-                    `<div style="color: green;">GPS位置取得成功<br>
-                    精度: ${Math.round(accuracy)}m</div>`;
-            },
-            function(error) {
-                let errorMsg = "";
-                switch(error.code) {
-                    case error.PERMISSION_DENIED:
-                        errorMsg = "❌ GPS許可が拒否されました";
-                        break;
-                    case error.POSITION_UNAVAILABLE:
-                        errorMsg = "❌ 位置情報が利用できません";
-                        break;
-                    case error.TIMEOUT:
-                        errorMsg = "❌ GPS取得がタイムアウトしました";
-                        break;
-                    default:
-                        errorMsg = "❌ 不明なエラーが発生しました";
-                        break;
-                }
-                document.getElementById('gps-status').innerHTML = 
-                    `<div style="color: red;">${errorMsg}</div>`;
-            },
-            {
-                enableHighAccuracy: true,
-                timeout: 10000,
-                maximumAge: 60000
-            }
-        );
-        document.getElementById('gps-status').innerHTML = 
-            '<div style="color: blue;">📡 GPS位置を取得中...</div>';
-    } else {
-        document.getElementById('gps-status').innerHTML = 
-            '<div style="color: red;">❌ お使いのブラウザはGPSに対応していません</div>';
-    }
-}
-
-// ページ読み込み時に位置情報の許可状態をチェック
-window.addEventListener('load', function() {
-    if ('geolocation' in navigator) {
-        navigator.permissions.query({name: 'geolocation'}).then(function(result) {
-            if (result.state === 'granted') {
-                document.getElementById('gps-permission').innerHTML = 
-                    '<div style="color: green;">✅ GPS許可済み</div>';
-            } else if (result.state === 'prompt') {
-                document.getElementById('gps-permission').innerHTML = 
-                    '<div style="color: orange;">⚠️ GPS許可が必要です</div>';
-            } else {
-                document.getElementById('gps-permission').innerHTML = 
-                    '<div style="color: red;">❌ GPS許可が拒否されています</div>';
-            }
-        });
-    }
-});
-
-// Streamlitからのメッセージを受信
-window.addEventListener('message', function(event) {
-    if (event.data.type === 'request_location') {
-        getCurrentLocation();
-    }
-});
-</script>
-
-<div id="gps-permission"></div>
-<div id="gps-status"></div>
-<button onclick="getCurrentLocation()" style="
-    background-color: #4CAF50;
-    color: white;
-    padding: 10px 20px;
-    border: none;
-    border-radius: 5px;
-    cursor: pointer;
-    font-size: 14px;
-    margin: 10px 0;
-">📍 GPS で現在地を取得</button>
-"""
-
-# 緊急GPS取得ボタン（常に表示）
-st.markdown("### 📍 現在地取得")
-col_gps1, col_gps2 = st.columns(2)
-
-with col_gps1:
-    if st.button("🛰️ GPSで現在地取得", type="primary", use_container_width=True):
-        st.markdown("""
-        <script>
-        if (navigator.geolocation) {
-            navigator.geolocation.getCurrentPosition(
-                function(position) {
-                    const lat = position.coords.latitude;
-                    const lon = position.coords.longitude;
-                    const accuracy = position.coords.accuracy;
-                    
-                    localStorage.setItem('current_gps_lat', lat);
-                    localStorage.setItem('current_gps_lon', lon);
-                    localStorage.setItem('current_gps_accuracy', accuracy);
-                    localStorage.setItem('current_gps_time', Date.now());
-                    
-                    alert('GPS位置を取得しました!\\n緯度: ' + lat.toFixed(6) + '\\n経度: ' + lon.toFixed(6) + '\\n精度: ' + Math.round(accuracy) + 'm');
-                    
-                    window.location.reload();
-                },
-                function(error) {
-                    let msg = "GPS取得エラー: ";
-                    switch(error.code) {
-                        case 1: msg += "位置情報の許可が拒否されました"; break;
-                        case 2: msg += "位置情報が利用できません"; break;
-                        case 3: msg += "タイムアウトしました"; break;
-                        default: msg += "不明なエラー"; break;
-                    }
-                    alert(msg);
-                },
-                {
-                    enableHighAccuracy: true,
-                    timeout: 15000,
-                    maximumAge: 300000
-                }
-            );
-        } else {
-            alert("お使いのブラウザはGPSに対応していません");
-        }
-        </script>
-        """, unsafe_allow_html=True)
-
-with col_gps2:
-    # ローカルストレージからGPS情報を読み取る
-    gps_check_js = """
-    <script>
-    function updateGPSInfo() {
-        const lat = localStorage.getItem('current_gps_lat');
-        const lon = localStorage.getItem('current_gps_lon');
-        const accuracy = localStorage.getItem('current_gps_accuracy');
-        const time = localStorage.getItem('current_gps_time');
-        
-        if (lat && lon) {
-            const age = Math.floor((Date.now() - parseInt(time || 0)) / 60000);
-            document.getElementById('gps-info').innerHTML = 
-                '<div style="background: #e8f5e9; padding: 8px; border-radius: 5px; font-size: 12px;">' +
-                '<strong>📍 最新GPS位置</strong><br>' +
-                parseFloat(lat).toFixed(4) + ', ' + parseFloat(lon).toFixed(4) + '<br>' +
-                '精度: ' + Math.round(accuracy || 0) + 'm (' + age + '分前)' +
-                '</div>';
-        } else {
-            document.getElementById('gps-info').innerHTML = 
-                '<div style="color: #666; font-size: 12px;">GPS未取得</div>';
-        }
-    }
-    updateGPSInfo();
-    setInterval(updateGPSInfo, 3000);
-    </script>
-    <div id="gps-info"></div>
-    """
-    st.markdown(gps_check_js, unsafe_allow_html=True)
+if st.session_state.location_accuracy is not None:
+    st.sidebar.caption(f"🛰️ GPSの精度: 約{st.session_state.location_accuracy:.0f}m")
 
-# JavaScriptからGPS座標を取得してStreamlitで使用
-gps_coordinates = st.empty()
+# 最寄りの避難所（空間インデックスで検索）
+nearest_shelter = memoized(
+    "nearest_shelter", lambda: nearest_places("shelters", st.session_state.current_location, 1)
+)
+if nearest_shelter[0]:
+    shelter, shelter_distance = nearest_shelter[0][0], nearest_shelter[1][0]
+    st.sidebar.caption(f"🏫 最寄りの避難所: {shelter['name']}（{shelter_distance:.1f}km）")
 
-# GPS座標入力フィールド（JavaScriptで自動入力される）
-with st.expander("🛠️ GPS座標確認・設定"):
-    js_gps_lat = st.number_input("GPS取得緯度", value=st.session_state.current_location[0], 
-                                format="%.6f", key="js_gps_lat")
-    js_gps_lon = st.number_input("GPS取得経度", value=st.session_state.current_location[1], 
-                                format="%.6f", key="js_gps_lon")
-    
-    # JavaScript自動入力用のスクリプト
-    st.markdown(f"""
-    <script>
-    function fillGPSFields() {{
-        const lat = localStorage.getItem('current_gps_lat');
-        const lon = localStorage.getItem('current_gps_lon');
-        
-        if (lat && lon) {{
-            const latField = document.querySelector('input[step="1e-06"]');
-            const lonField = document.querySelectorAll('input[step="1e-06"]')[1];
-            
-            if (latField && lonField) {{
-                latField.value = parseFloat(lat).toFixed(6);
-                lonField.value = parseFloat(lon).toFixed(6);
-                
-                latField.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                lonField.dispatchEvent(new Event('input', {{ bubbles: true }}));
-            }}
-        }}
-    }}
-    
-    setTimeout(fillGPSFields, 1000);
-    setInterval(fillGPSFields, 5000);
-    </script>
-    """, unsafe_allow_html=True)
-    
-    if st.button("📍 GPS座標を現在地に適用"):
-        if abs(js_gps_lat - st.session_state.current_location[0]) > 0.0001 or \
-           abs(js_gps_lon - st.session_state.current_location[1]) > 0.0001:
-            st.session_state.current_location = [js_gps_lat, js_gps_lon]
-            st.success(f"GPS位置を現在地に設定しました: {js_gps_lat:.6f}, {js_gps_lon:.6f}")
-            st.rerun()
-        else:
-            st.info("GPS位置は既に現在地として設定されています")
+# 到達圏（地図に表示し、一覧を到達できる地点に絞り込む）
+st.sidebar.markdown("#### ⏱️ 到達圏")
+st.sidebar.checkbox("N分以内に行ける範囲を表示", key="isochrone_on")
+if st.session_state.isochrone_on:
+    st.sidebar.select_slider("時間（分）", ISOCHRONE_MINUTES, value=10, key="isochrone_minutes")
+    st.sidebar.selectbox("交通手段", list(TRANSPORT_LABELS), format_func=TRANSPORT_LABELS.get, key="isochrone_mode")
+REACH_AREA = reach_area()
+REACH_KEY = None if REACH_AREA is None else (REACH_AREA.minutes, REACH_AREA.transport_mode)
 
 # GPS機能の使用方法説明
 with st.expander("📱 GPS機能の使用方法"):
@@ -743,15 +701,12 @@ with st.expander("📱 GPS機能の使用方法"):
     ### 🛰️ GPS位置取得の手順
     
     **1. ブラウザの位置情報許可**
-    - 「GPSで現在地取得」ボタンをクリック
+    - サイドバーの「GPSで現在地を追跡」をオンにする
     - ブラウザから位置情報の許可を求められたら「許可」を選択
     
-    **2. GPS位置の確認**
-    - 取得された位置情報が右側に表示されます
+    **2. 現在地の自動更新**
+    - 移動に合わせて現在地が自動的に更新されます（約25m以上移動した場合のみ）
     - 精度(m)が小さいほど正確な位置です
-    
-    **3. 現在地への適用**
-    - 「GPS座標を現在地に適用」ボタンで現在地として設定
     - 地図とルート計算に自動的に反映されます
     
     ### ⚠️ 注意事項
@@ -760,8 +715,8 @@ with st.expander("📱 GPS機能の使用方法"):
     - 位置情報は定期的に更新することをお勧めします
     
     ### 🔒 プライバシー
-    - GPS情報はブラウザのローカルストレージにのみ保存されます
-    - サーバーには送信されませんのでご安心ください
+    - GPS情報は現在地の計算のためにのみ使い、保存しません
+    - 追跡をオフにすると位置情報の取得を停止します
     """)
 
 # 現在地から日田市中心部までの距離チェック
@@ -782,45 +737,6 @@ if distance_to_hita > 50:  # 50km以上離れている場合
 elif distance_to_hita > 10:  # 10km以上離れている場合
     st.info(f"📍 現在地は日田市中心部から {distance_to_hita:.1f}km の位置です。")
 
-# GPS機能のHTML/JSを表示
-st.sidebar.markdown("#### 🛰️ GPS自動取得")
-st.sidebar.markdown(gps_js, unsafe_allow_html=True)
-
-# GPS情報チェック機能
-gps_check_script = """
-<script>
-function checkAndDisplayGPS() {
-    const lat = localStorage.getItem('gps_lat');
-    const lon = localStorage.getItem('gps_lon');
-    const accuracy = localStorage.getItem('gps_accuracy');
-    const timestamp = localStorage.getItem('gps_timestamp');
-    
-    if (lat && lon && timestamp) {
-        const age = Math.floor((Date.now() - parseInt(timestamp)) / 60000);
-        document.getElementById('gps-data-display').innerHTML = 
-            '<div style="background: #e8f5e9; padding: 8px; border-radius: 5px; font-size: 12px; margin: 5px 0;">' +
-            '<strong>📍 GPS位置情報</strong><br>' +
-            '緯度: ' + parseFloat(lat).toFixed(6) + '<br>' +
-            '経度: ' + parseFloat(lon).toFixed(6) + '<br>' +
-            '精度: ' + Math.round(accuracy || 0) + 'm<br>' +
-            '取得: ' + age + '分前' +
-            '</div>';
-        return {lat: parseFloat(lat), lon: parseFloat(lon), age: age};
-    } else {
-        document.getElementById('gps-data-display').innerHTML = 
-            '<div style="color: #666; font-size: 12px; margin: 5px 0;">GPS情報なし</div>';
-        return null;
-    }
-}
-
-checkAndDisplayGPS();
-setInterval(checkAndDisplayGPS, 3000);
-</script>
-<div id="gps-data-display"></div>
-"""
-
-st.sidebar.markdown(gps_check_script, unsafe_allow_html=True)
-
 # メイン処理
 if st.session_state.current_mode == "tourism":
     # 観光モード
@@ -830,50 +746,40 @@ if st.session_state.current_mode == "tourism":
         st.markdown("### 🏛️ 観光スポット")
         
         # カテゴリフィルター
-        categories = list(set([spot['category'] for spot in TOURISM_SPOTS]))
+        categories = np.unique(TOURISM_SPOTS.column('category')).tolist()
         selected_categories = st.multiselect("カテゴリで絞り込み", categories, default=categories)
         
-        # 距離でソート
-        spots_with_distance = []
-        for spot in TOURISM_SPOTS:
-            if spot['category'] in selected_categories:
-                distance = calculate_distance(
-                    st.session_state.current_location[0],
-                    st.session_state.current_location[1],
-                    spot['lat'],
-                    spot['lon']
-                )
-                spots_with_distance.append({**spot, 'distance': distance})
-        
-        spots_with_distance.sort(key=lambda x: x['distance'])
+        # 距離順（空間インデックスで近い順に取得）
+        nearby_spots, spot_distances = memoized("spots", lambda: nearest_places(
+            "tourism", st.session_state.current_location, SPOT_LIST_SIZE,
+            keep=lambda spot: spot['category'] in selected_categories and (
+                REACH_AREA is None or REACH_AREA.contains_point(spot['lat'], spot['lon']))
+        ), tuple(selected_categories), REACH_KEY)
+        if REACH_AREA is not None:
+            st.caption(f"⏱️ {TRANSPORT_LABELS[REACH_AREA.transport_mode]}で{REACH_AREA.minutes:.0f}分以内に行けるスポットのみ表示")
         
         # スポット選択
         st.write("**目的地を選択（複数選択可能）:**")
-        for spot in spots_with_distance:
-            is_selected = spot in st.session_state.selected_spots
+        for spot, distance in zip(nearby_spots, spot_distances):
+            is_selected = spot['id'] in st.session_state.selected_ids
             
             with st.container():
                 st.markdown(f'<div class="spot-card">', unsafe_allow_html=True)
                 col_check, col_info = st.columns([1, 4])
                 
                 with col_check:
-                    if st.checkbox("", key=f"spot_{spot['name']}", value=is_selected):
-                        if spot not in st.session_state.selected_spots:
-                            st.session_state.selected_spots.append(spot)
-                    else:
-                        if spot in st.session_state.selected_spots:
-                            st.session_state.selected_spots.remove(spot)
+                    set_selected(spot['id'], st.checkbox("", key=f"spot_{spot['id']}", value=is_selected))
                 
                 with col_info:
                     st.write(f"**{spot['name']}**")
                     st.write(f"📍 {spot['category']} | ⭐ {spot['rating']}")
-                    st.write(f"📏 {spot['distance']:.1f}km")
+                    st.write(f"📏 {distance:.1f}km")
                     
                     # 交通手段別時間表示
                     st.markdown('<div class="time-info">', unsafe_allow_html=True)
-                    walk_time = calculate_travel_time(spot['distance'], 'walk')
-                    bicycle_time = calculate_travel_time(spot['distance'], 'bicycle')
-                    car_time = calculate_travel_time(spot['distance'], 'car')
+                    walk_time = calculate_travel_time(distance, 'walk')
+                    bicycle_time = calculate_travel_time(distance, 'bicycle')
+                    car_time = calculate_travel_time(distance, 'car')
                     
                     st.write(f"🚶 {walk_time:.0f}分 | 🚴 {bicycle_time:.0f}分 | 🚗 {car_time:.0f}分")
                     st.write(f"⏰ 待ち時間: {spot['wait_time']}分 | 滞在: {spot['visit_duration']}分")
@@ -885,27 +791,21 @@ if st.session_state.current_mode == "tourism":
         
         # 飲食店セクション
         st.markdown("### 🍽️ 飲食店")
-        for restaurant in RESTAURANTS:
-            distance = calculate_distance(
-                st.session_state.current_location[0],
-                st.session_state.current_location[1],
-                restaurant['lat'],
-                restaurant['lon']
-            )
-            
-            is_selected = restaurant in st.session_state.selected_spots
+        nearest_restaurants = memoized(
+            "restaurants", lambda: nearest_places(
+                "restaurants", st.session_state.current_location, SPOT_LIST_SIZE,
+                keep=None if REACH_AREA is None else lambda place: REACH_AREA.contains_point(place['lat'], place['lon'])
+            ), REACH_KEY
+        )
+        for restaurant, distance in zip(*nearest_restaurants):
+            is_selected = restaurant['id'] in st.session_state.selected_ids
             
             with st.container():
                 st.markdown(f'<div class="spot-card">', unsafe_allow_html=True)
                 col_check, col_info = st.columns([1, 4])
                 
                 with col_check:
-                    if st.checkbox("", key=f"restaurant_{restaurant['name']}", value=is_selected):
-                        if restaurant not in st.session_state.selected_spots:
-                            st.session_state.selected_spots.append(restaurant)
-                    else:
-                        if restaurant in st.session_state.selected_spots:
-                            st.session_state.selected_spots.remove(restaurant)
+                    set_selected(restaurant['id'], st.checkbox("", key=f"restaurant_{restaurant['id']}", value=is_selected))
                 
                 with col_info:
                     st.write(f"**{restaurant['name']}**")
@@ -924,17 +824,65 @@ if st.session_state.current_mode == "tourism":
                 st.markdown('</div>', unsafe_allow_html=True)
         
         # ルート最適化ボタン
-        if st.session_state.selected_spots:
-            if st.button("🗺️ 最適ルートを計算", type="primary"):
-                st.session_state.optimized_route = optimize_route(
-                    st.session_state.current_location,
-                    st.session_state.selected_spots
+        if st.session_state.selected_ids:
+            with st.expander("⏰ スケジュール設定"):
+                schedule_enabled = st.checkbox("待ち時間・滞在時間・営業時間を含めた総所要時間で最適化", key="schedule_enabled")
+                schedule_mode = st.selectbox("移動手段", 
+                    ["walk", "bicycle", "car"], 
+                    format_func=lambda x: {"walk": "🚶 徒歩", "bicycle": "🚴 自転車", "car": "🚗 車"}[x],
+                    key="schedule_mode"
                 )
-                st.success(f"{len(st.session_state.optimized_route)}箇所の最適ルートを計算しました！")
+                schedule_start = st.time_input("出発時刻", value=datetime.strptime("09:00", "%H:%M").time(), key="schedule_start")
+                include_meal = st.checkbox(f"昼食（{MEAL_WINDOW[0]}〜{MEAL_WINDOW[1]}）に飲食店を入れる", value=True, key="schedule_meal")
+            
+            # 選択・現在地が変わったら計算中の古いルートは中止
+            route_job = st.session_state.route_job
+            if route_job is not None and route_job.key != route_problem(st.session_state.current_location, selected_places())[1]:
+                if cancel_route_job():
+                    st.info("選択が変わったため、計算中のルートを中止しました")
+            
+            if st.button("🗺️ 最適ルートを計算", type="primary"):
+                if schedule_enabled:
+                    cancel_route_job()
+                    schedule = PLANNER.plan_schedule(
+                        st.session_state.current_location,
+                        selected_places(),
+                        transport_mode=schedule_mode,
+                        start_time=schedule_start.strftime("%H:%M"),
+                        meal_options=RESTAURANTS if include_meal else (),
+                        meal_window=MEAL_WINDOW if include_meal else None
+                    )
+                    st.session_state.schedule = schedule
+                    st.session_state.route_ids = [place['id'] for place in schedule.route]
+                    st.success(f"{len(schedule.stops)}箇所のスケジュールを作成しました！（{format_clock(schedule.start_time)}〜{format_clock(schedule.end_time)}）")
+                    if not schedule.feasible:
+                        st.warning("営業時間・昼食の条件をすべて満たす順序が見つからなかったため、条件を緩めて作成しました")
+                    elif schedule.relaxed:
+                        st.warning("制限時間内に営業時間・昼食の条件を満たす順序が見つからなかったため、条件を緩めて作成しました")
+                    elif schedule.timed_out:
+                        st.info("制限時間内に探索が終わらなかったため、それまでに見つかった最良のスケジュールを表示しています")
+                else:
+                    st.session_state.schedule = None
+                    start_route_job(st.session_state.current_location, selected_places()).wait(ROUTE_WAIT_SECONDS)
+            
+            # バックグラウンドの計算：終わっていれば確定、計算中なら途中の最良解を地図に表示
+            route_job = st.session_state.route_job
+            if route_job is not None:
+                if route_job.done():
+                    show_route_result(route_job)
+                else:
+                    best_ids = route_job.best_ids()
+                    if best_ids:
+                        st.session_state.route_ids = best_ids
+                    route_job_status(route_job.snapshot()[3])
     
     with col2:
-        # 地図表示
-        m = folium.Map(location=st.session_state.current_location, zoom_start=14)
+        selected_spots = selected_places()
+        optimized_route = route_places()
+        
+        # 地図表示（全スポットは共有の静的レイヤー、ここでは変化する部分だけを作る）
+        layer = folium.FeatureGroup(name="現在のルート")
+        add_isochrone_layer(REACH_AREA, layer)
         
         # 現在地マーカー
         folium.Marker(
@@ -942,22 +890,22 @@ if st.session_state.current_mode == "tourism":
             popup="現在地",
             tooltip="あなたの現在地",
             icon=folium.Icon(color='blue', icon='home')
-        ).add_to(m)
+        ).add_to(layer)
         
         # 選択された観光スポットのマーカー
-        for i, spot in enumerate(st.session_state.selected_spots):
+        for i, spot in enumerate(selected_spots):
             folium.Marker(
                 [spot['lat'], spot['lon']],
                 popup=f"{spot['name']}<br>待ち時間: {spot['wait_time']}分",
                 tooltip=spot['name'],
                 icon=folium.Icon(color='red', icon='star')
-            ).add_to(m)
+            ).add_to(layer)
         
         # 最適化ルートの表示
-        if st.session_state.optimized_route:
-            route_points = [st.session_state.current_location]
-            for spot in st.session_state.optimized_route:
-                route_points.append([spot['lat'], spot['lon']])
+        if optimized_route:
+            route_points = calculate_route_geometry(
+                st.session_state.current_location, optimized_route
+            )
             
             folium.PolyLine(
                 route_points,
@@ -965,10 +913,10 @@ if st.session_state.current_mode == "tourism":
                 color='red',
                 opacity=0.8,
                 popup="最適ルート"
-            ).add_to(m)
+            ).add_to(layer)
             
             # ルート番号の表示
-            for i, spot in enumerate(st.session_state.optimized_route):
+            for i, spot in enumerate(optimized_route):
                 folium.Marker(
                     [spot['lat'], spot['lon']],
                     popup=f"順序: {i+1}",
@@ -976,36 +924,33 @@ if st.session_state.current_mode == "tourism":
                         html=f'<div style="background-color: white; border: 2px solid red; border-radius: 50%; width: 25px; height: 25px; display: flex; justify-content: center; align-items: center; font-weight: bold;">{i+1}</div>',
                         icon_size=(25, 25)
                     )
-                ).add_to(m)
+                ).add_to(layer)
         
-        # 全ての観光スポットを薄いマーカーで表示
-        for spot in TOURISM_SPOTS:
-            if spot not in st.session_state.selected_spots:
-                folium.Marker(
-                    [spot['lat'], spot['lon']],
-                    popup=spot['name'],
-                    tooltip=spot['name'],
-                    icon=folium.Icon(color='lightgray', icon='info-sign')
-                ).add_to(m)
+        # 観光スポット（表示範囲内のみ、選択済みは上の赤いマーカーで表示）
+        spots_layer = poi_layer(
+            "観光スポット", TOURISM_SPOTS, map_viewport("tourism_map", 14), add_spot_marker,
+            skip=lambda spot: spot['id'] in st.session_state.selected_ids
+        )
         
-        st_folium(m, width=700, height=500)
+        show_map(session_map("tourism_map", "", build_tourism_map), [spots_layer, layer], "tourism_map")
         
         # ルート情報表示
-        if st.session_state.optimized_route:
+        if optimized_route:
             st.markdown('<div class="route-info">', unsafe_allow_html=True)
             st.markdown("### 📋 最適ルート詳細")
             
             total_distance = 0
             total_time = 0
-            current_pos = st.session_state.current_location
+            leg_distances = calculate_leg_distances(
+                st.session_state.current_location, optimized_route
+            )
             
             transport_mode = st.selectbox("交通手段を選択", 
                 ["walk", "bicycle", "car"], 
                 format_func=lambda x: {"walk": "🚶 徒歩", "bicycle": "🚴 自転車", "car": "🚗 車"}[x]
             )
             
-            for i, spot in enumerate(st.session_state.optimized_route):
-                distance = calculate_distance(current_pos[0], current_pos[1], spot['lat'], spot['lon'])
+            for i, (spot, distance) in enumerate(zip(optimized_route, leg_distances)):
                 travel_time = calculate_travel_time(distance, transport_mode)
                 
                 total_distance += distance
@@ -1015,11 +960,20 @@ if st.session_state.current_mode == "tourism":
                 st.write(f"📏 移動距離: {distance:.1f}km | ⏰ 移動時間: {travel_time:.0f}分")
                 st.write(f"⌛ 待ち時間: {spot['wait_time']}分 | 🏛️ 滞在時間: {spot['visit_duration']}分")
                 st.write("---")
-                
-                current_pos = [spot['lat'], spot['lon']]
             
             st.write(f"**合計距離:** {total_distance:.1f}km")
             st.write(f"**合計所要時間:** {total_time:.0f}分 ({total_time/60:.1f}時間)")
+            
+            # 時間を考慮したスケジュール
+            schedule = st.session_state.schedule
+            if schedule:
+                st.markdown("### 📅 スケジュール")
+                for i, stop in enumerate(schedule.stops):
+                    meal_label = " 🍽️ 昼食" if stop.is_meal else ""
+                    st.write(f"**{format_clock(stop.start)}〜{format_clock(stop.departure)}** {i+1}. {stop.place['name']}{meal_label}")
+                    if stop.start - stop.arrival >= 1:
+                        st.caption(f"{format_clock(stop.arrival)} 到着・開始まで {stop.start - stop.arrival:.0f}分待機")
+                st.write(f"**終了予定:** {format_clock(schedule.end_time)}（総所要時間 {schedule.total_minutes:.0f}分）")
             st.markdown('</div>', unsafe_allow_html=True)
 
 else:
@@ -1029,42 +983,48 @@ else:
     with col1:
         st.markdown("### 🚨 避難所一覧")
         
-        # 避難所を距離順でソート
-        shelters_with_distance = []
-        for shelter in EVACUATION_CENTERS:
-            distance = calculate_distance(
-                st.session_state.current_location[0],
-                st.session_state.current_location[1],
-                shelter['lat'],
-                shelter['lon']
-            )
-            safety_score = get_safe_route_score(shelter['lat'], shelter['lon'])
-            shelters_with_distance.append({**shelter, 'distance': distance, 'safety_score': safety_score})
-        
-        shelters_with_distance.sort(key=lambda x: (x['distance'], -x['safety_score']))
+        # 避難所を距離順でソート（近い候補について道路上の距離で並べ直す）
+        ranked_shelters, shelter_distances, shelter_safety = memoized(
+            "shelters", lambda: PLANNER.rank_shelters(st.session_state.current_location, SHELTER_LIST_SIZE),
+            COVERAGE_VERSION
+        )
         
         selected_shelter = None
+        occupancy = OCCUPANCY.counts()
+        # 収容人数を考慮した全避難者の割り当て（避難者の分布ファイルがある場合）
+        assignment = get_shelter_assignment()
         
-        for shelter in shelters_with_distance:
+        for shelter, distance, safety_score in zip(ranked_shelters, shelter_distances, shelter_safety):
             with st.container():
                 st.markdown(f'<div class="evacuation-card">', unsafe_allow_html=True)
                 
-                if st.button(f"📍 {shelter['name']}", key=f"shelter_{shelter['name']}", use_container_width=True):
+                if st.button(f"📍 {shelter['name']}", key=f"shelter_{shelter['id']}", use_container_width=True):
                     selected_shelter = shelter
+                    selected_safety = safety_score
                 
                 st.write(f"🏢 **種別:** {shelter['type']}")
-                st.write(f"📏 **距離:** {shelter['distance']:.1f}km")
-                st.write(f"👥 **収容人数:** {shelter['capacity']}人")
+                st.write(f"📏 **距離:** {distance:.1f}km")
+                occupied = occupancy.get(shelter['id'], 0)
+                st.write(f"👥 **収容人数:** {occupied}/{shelter['capacity']}人 {occupancy_label(occupied, shelter['capacity'])}")
+                if assignment is not None:
+                    assigned = assignment.loads[EVACUATION_CENTERS.row_of(shelter['id'])]
+                    remaining = max(shelter['capacity'] - occupied, 0)
+                    full_label = "（満員見込み）" if assigned >= remaining else ""
+                    st.write(f"🧮 **割り当て予定:** {assigned}/{remaining}人{full_label}")
                 st.write(f"🛡️ **安全レベル:** {shelter['safety_level']}")
+                if REACH_AREA is not None:
+                    reachable = REACH_AREA.contains_point(shelter['lat'], shelter['lon'])
+                    st.write(f"⏱️ **到達圏:** {TRANSPORT_LABELS[REACH_AREA.transport_mode]}で"
+                             f"{REACH_AREA.minutes:.0f}分{'以内' if reachable else 'を超える'}")
                 
                 # 安全性スコア表示
-                safety_color = "🟢" if shelter['safety_score'] > 70 else "🟡" if shelter['safety_score'] > 40 else "🔴"
-                st.write(f"📊 **安全スコア:** {safety_color} {shelter['safety_score']:.0f}/100")
+                safety_color = "🟢" if safety_score > 70 else "🟡" if safety_score > 40 else "🔴"
+                st.write(f"📊 **安全スコア:** {safety_color} {safety_score:.0f}/100")
                 
                 # 移動時間計算
-                walk_time = calculate_travel_time(shelter['distance'], 'walk')
-                bicycle_time = calculate_travel_time(shelter['distance'], 'bicycle')
-                car_time = calculate_travel_time(shelter['distance'], 'car')
+                walk_time = calculate_travel_time(distance, 'walk')
+                bicycle_time = calculate_travel_time(distance, 'bicycle')
+                car_time = calculate_travel_time(distance, 'car')
                 
                 st.markdown('<div class="time-info">', unsafe_allow_html=True)
                 st.write(f"⏰ **到着時間:** 🚶{walk_time:.0f}分 | 🚴{bicycle_time:.0f}分 | 🚗{car_time:.0f}分")
@@ -1074,6 +1034,51 @@ else:
                 
                 st.markdown('</div>', unsafe_allow_html=True)
         
+        st.markdown("### 👥 入所状況")
+        shelter_occupancy_status(ranked_shelters)
+        operator_key = occupancy_operator_key()
+        if operator_key:
+            # 入所状況は全セッションの表示と割り当てに使われるため、記録は運営者キーを知る人だけに限る
+            with st.expander("📝 入所状況の記録（避難所の運営者向け）"):
+                if not st.session_state.get('occupancy_operator'):
+                    entered = st.text_input("運営者キー", type="password", key="occupancy_operator_input")
+                    if entered and hmac.compare_digest(entered.encode(), str(operator_key).encode()):
+                        st.session_state.occupancy_operator = True
+                        st.rerun()
+                    elif entered:
+                        st.error("運営者キーが正しくありません")
+                else:
+                    record_shelter = st.selectbox(
+                        "避難所", ranked_shelters, format_func=lambda shelter: shelter['name'], key="occupancy_shelter"
+                    )
+                    record_count = st.number_input("人数", min_value=0, value=1, step=1, key="occupancy_count")
+                    col_in, col_out, col_set = st.columns(3)
+                    recorded = True
+                    if col_in.button("入所", key="occupancy_in", use_container_width=True):
+                        OCCUPANCY.add(record_shelter['id'], record_count)
+                    elif col_out.button("退所", key="occupancy_out", use_container_width=True):
+                        OCCUPANCY.add(record_shelter['id'], -record_count)
+                    elif col_set.button("人数を上書き", key="occupancy_set", use_container_width=True):
+                        OCCUPANCY.report(record_shelter['id'], record_count)
+                    else:
+                        recorded = False
+                    if recorded:
+                        # 一覧と割り当てに反映する（保存先への書き込みはまとめて後で行われる）
+                        st.rerun()
+        
+        if assignment is not None:
+            with st.expander("🧮 避難所ごとの割り当て（収容人数を考慮）"):
+                st.write(f"割り当て済み {int(assignment.loads.sum())}人 / 平均移動距離 "
+                         f"{assignment.total_km / max(int(assignment.loads.sum()), 1):.2f}km")
+                if assignment.unassigned:
+                    st.error(f"🚨 収容人数が不足しています（{assignment.unassigned}人が未割り当て）")
+                st.dataframe(pd.DataFrame({
+                    "避難所": EVACUATION_CENTERS.column('name'),
+                    "割り当て": assignment.loads,
+                    "残りの収容人数": OCCUPANCY.remaining(EVACUATION_CENTERS),
+                }), hide_index=True, use_container_width=True)
+                st.caption(f"計算時間 {assignment.seconds:.2f}秒")
+        
         # 災害情報
         st.markdown("### ⚠️ 災害情報・注意事項")
         st.markdown("""
@@ -1088,8 +1093,9 @@ else:
         """, unsafe_allow_html=True)
     
     with col2:
-        # 避難所マップ
-        m = folium.Map(location=st.session_state.current_location, zoom_start=13)
+        # 避難所マップ（避難所・危険エリアは共有の静的レイヤー）
+        layer = folium.FeatureGroup(name="避難ルート")
+        add_isochrone_layer(REACH_AREA, layer)
         
         # 現在地マーカー
         folium.Marker(
@@ -1097,50 +1103,15 @@ else:
             popup="現在地<br>ここから避難開始",
             tooltip="現在地",
             icon=folium.Icon(color='blue', icon='home')
-        ).add_to(m)
-        
-        # 避難所マーカー
-        for shelter in EVACUATION_CENTERS:
-            # 安全レベルに応じた色分け
-            color = 'green' if shelter['safety_level'] == '高' else 'orange' if shelter['safety_level'] == '中' else 'red'
-            
-            folium.Marker(
-                [shelter['lat'], shelter['lon']],
-                popup=f"""
-                <b>{shelter['name']}</b><br>
-                収容人数: {shelter['capacity']}人<br>
-                設備: {', '.join(shelter['facilities'])}<br>
-                安全レベル: {shelter['safety_level']}
-                """,
-                tooltip=f"{shelter['name']} ({shelter['safety_level']})",
-                icon=folium.Icon(color=color, icon='home')
-            ).add_to(m)
-        
-        # 危険エリア（簡易的な表示）
-        # 三隈川周辺を危険エリアとして表示
-        folium.Polygon(
-            locations=[
-                [33.3200, 130.9380],
-                [33.3250, 130.9380],
-                [33.3250, 130.9420],
-                [33.3200, 130.9420]
-            ],
-            color='red',
-            weight=2,
-            opacity=0.8,
-            fill=True,
-            fillColor='red',
-            fillOpacity=0.2,
-            popup="洪水危険エリア<br>避難時は迂回してください"
-        ).add_to(m)
+        ).add_to(layer)
         
         # 選択された避難所へのルート表示
         if 'selected_shelter' in locals() and selected_shelter:
-            # 安全ルートの計算（危険エリアを避けたルート）
-            route_points = [
+            # 危険エリアを避けた避難ルート
+            shelter_route_distance, route_points = calculate_safe_route(
                 st.session_state.current_location,
                 [selected_shelter['lat'], selected_shelter['lon']]
-            ]
+            )
             
             folium.PolyLine(
                 route_points,
@@ -1148,16 +1119,24 @@ else:
                 color='green',
                 opacity=0.8,
                 popup=f"安全な避難ルート<br>目的地: {selected_shelter['name']}"
-            ).add_to(m)
+            ).add_to(layer)
+        
+        # 避難所（表示範囲内のみ）
+        shelters_layer = poi_layer("避難所", EVACUATION_CENTERS, map_viewport("disaster_map", 13), add_shelter_marker)
         
-        st_folium(m, width=700, height=500)
+        show_map(session_map("disaster_map", HAZARDS.version, build_disaster_map), [shelters_layer, layer],
+                 "disaster_map")
         
         # 避難ルート詳細情報
         if 'selected_shelter' in locals() and selected_shelter:
             st.markdown('<div class="route-info">', unsafe_allow_html=True)
             st.markdown(f"### 🗺️ {selected_shelter['name']}への避難ルート")
             
-            distance = selected_shelter['distance']
+            distance = shelter_route_distance
+            # 実際の避難ルートに沿った安全度で評価し直す
+            safety = score_evacuation_routes([route_points])[0]
+            if safety is not None:
+                selected_safety = safety.minimum
             walk_time = calculate_travel_time(distance, 'walk')
             bicycle_time = calculate_travel_time(distance, 'bicycle')
             car_time = calculate_travel_time(distance, 'car')
@@ -1168,19 +1147,23 @@ else:
             with col_b:
                 st.metric("徒歩", f"{walk_time:.0f}分")
             with col_c:
-                st.metric("安全スコア", f"{selected_shelter['safety_score']:.0f}/100")
+                st.metric("安全スコア", f"{selected_safety:.0f}/100")
             
             st.write("**避難経路のポイント:**")
-            if selected_shelter['safety_score'] > 70:
+            if selected_safety > 70:
                 st.success("✅ 安全性の高いルートです")
-            elif selected_shelter['safety_score'] > 40:
+            elif selected_safety > 40:
                 st.warning("⚠️ 注意が必要なルートです")
             else:
                 st.error("🚨 危険なルートです。他の避難所を検討してください")
             
-            st.write(f"- 川からの距離を考慮した安全ルート")
+            if safety is not None:
+                st.write(f"- ルート上の安全度: 最低 {safety.minimum:.0f} / 平均 {safety.mean:.0f}（標高・浸水深データ）")
+            else:
+                st.write(f"- 川からの距離を考慮した安全ルート")
             st.write(f"- 避難所設備: {', '.join(selected_shelter['facilities'])}")
-            st.write(f"- 収容可能人数: {selected_shelter['capacity']}人")
+            occupied = occupancy.get(selected_shelter['id'], 0)
+            st.write(f"- 収容可能人数: {selected_shelter['capacity']}人（現在 {occupied}人・{occupancy_label(occupied, selected_shelter['capacity'])}）")
             
             st.markdown('</div>', unsafe_allow_html=True)
         
@@ -1207,7 +1190,7 @@ with col1:
 
 with col2:
     if st.session_state.current_mode == "tourism":
-        st.metric("選択中の目的地", f"{len(st.session_state.selected_spots)}箇所")
+        st.metric("選択中の目的地", f"{len(st.session_state.selected_ids)}箇所")
     else:
         st.metric("最寄り避難所数", f"{len(EVACUATION_CENTERS)}箇所")
 
@@ -1215,14 +1198,22 @@ with col3:
     st.metric("現在時刻", datetime.now().strftime("%H:%M"))
 
 with col4:
-    if st.session_state.current_mode == "tourism" and st.session_state.optimized_route:
-        total_time = sum([spot.get('wait_time', 0) + spot.get('visit_duration', 0) for spot in st.session_state.optimized_route])
-        travel_time = sum([calculate_travel_time(calculate_distance(
-            st.session_state.current_location[0] if i == 0 else st.session_state.optimized_route[i-1]['lat'],
-            st.session_state.current_location[1] if i == 0 else st.session_state.optimized_route[i-1]['lon'],
-            spot['lat'], spot['lon']
-        ), 'walk') for i, spot in enumerate(st.session_state.optimized_route)])
-        st.metric("総所要時間", f"{(total_time + travel_time)/60:.1f}時間")
+    if st.session_state.current_mode == "tourism" and st.session_state.schedule:
+        st.metric("総所要時間", f"{st.session_state.schedule.total_minutes/60:.1f}時間")
+    elif st.session_state.current_mode == "tourism" and st.session_state.route_ids:
+        optimized_route = route_places()
+        
+        def route_total_minutes():
+            total_time = sum([spot.get('wait_time', 0) + spot.get('visit_duration', 0) for spot in optimized_route])
+            travel_time = calculate_travel_time(calculate_leg_distances(
+                st.session_state.current_location, optimized_route
+            ).sum(), 'walk')
+            return total_time + travel_time
+        total_minutes = memoized(
+            "route_total", route_total_minutes,
+            tuple(st.session_state.route_ids), 'walk'
+        )
+        st.metric("総所要時間", f"{total_minutes/60:.1f}時間")
     else:
         st.metric("アプリ版本", "v1.0.0")
 
@@ -1293,6 +1284,20 @@ st.markdown("""
 
 # キャッシュクリア機能（開発者用）
 if st.sidebar.button("🔄 データリセット"):
-    st.session_state.selected_spots = []
-    st.session_state.optimized_route = []
-    st.sidebar.success("データをリセットしました")
\ No newline at end of file
+    cancel_route_job()
+    st.session_state.selected_ids = []
+    st.session_state.route_ids = []
+    st.session_state.schedule = None
+    st.session_state.memo.clear()
+    st.sidebar.success("データをリセットしました")
+
+# 計算結果のメモ化の状況（開発者用）
+with st.sidebar.expander("🛠️ デバッグ情報"):
+    memo_stats = st.session_state.memo.stats()
+    st.write(f"メモ: ヒット {memo_stats['hits']}回 / ミス {memo_stats['misses']}回（ヒット率 {memo_stats['hit_rate']:.0%}）")
+    st.write(f"保持件数: {memo_stats['size']}/{memo_stats['maxsize']}")
+    route_stats = ROUTE_CACHE.stats()
+    st.write(f"ルートキャッシュ（全セッション共有）: ヒット {route_stats['hits']}回 / ミス {route_stats['misses']}回 / {route_stats['size']}件")
+    if SHELTER_COVERAGE is not None:
+        rows, cols, k = SHELTER_COVERAGE.table.shape
+        st.write(f"避難所の到達表: {rows}×{cols}格子・各{k}件")
@@ -0,0 +1,45 @@
+"""hita_navi.batch.handle_request の入力チェックのテスト"""
+import pytest
+
+from hita_navi.batch import handle_request
+from hita_navi.planner import Planner
+
+START = [33.32, 130.94]
+
+
+@pytest.fixture(scope="module")
+def planner():
+    return Planner.open()
+
+
+@pytest.mark.parametrize("request_, message", [
+    ({"mode": "reachable", "minutes": -5}, "minutes に正の数（分）を指定してください"),
+    ({"mode": "reachable", "minutes": "10"}, "minutes に正の数（分）を指定してください"),
+    ({"mode": "schedule", "start_time": "9時"}, 'start_time に "HH:MM" 形式の時刻を指定してください'),
+    ({"mode": "schedule", "start_time": "25:00"}, 'start_time に "HH:MM" 形式の時刻を指定してください'),
+    ({"mode": "schedule", "meal": True, "meal_window": "11:00"},
+     'meal_window に ["HH:MM", "HH:MM"]（開始, 終了）を指定してください'),
+    ({"mode": "schedule", "meal": True, "meal_window": ["14:00", "11:00"]},
+     'meal_window に ["HH:MM", "HH:MM"]（開始, 終了）を指定してください'),
+    ({"mode": "schedule", "meal": True, "meal_window": ["11:00", "noon"]},
+     'meal_window に "HH:MM" 形式の時刻を指定してください'),
+    ({"mode": "shelters", "k": 0}, "k に1以上の整数を指定してください"),
+    ({"mode": "shelters", "start": [33.32, "north"]}, "start に [緯度, 経度] を指定してください"),
+    ({"mode": "shelters", "start": [33.32, 130.94, 0]}, "start に [緯度, 経度] を指定してください"),
+])
+def test_invalid_requests_get_readable_errors(planner, request_, message):
+    output = handle_request(planner, {"request_id": "r1", "start": START, **request_})
+    assert output == {"request_id": "r1", "mode": request_["mode"], "error": message}
+
+
+def test_valid_requests(planner):
+    output = handle_request(planner, {"mode": "reachable", "start": START, "minutes": 10})
+    assert "error" not in output and output["minutes"] == 10
+    output = handle_request(planner, {"mode": "shelters", "start": START, "k": 3})
+    assert "error" not in output and len(output["shelters"]) == 3
+    ids = [stop["id"] for stop in handle_request(planner, {"mode": "reachable", "start": START,
+                                                           "minutes": 30})["places"][:2]]
+    assert len(ids) == 2
+    output = handle_request(planner, {"mode": "schedule", "start": START, "destinations": ids,
+                                      "start_time": "09:30", "meal": True, "meal_window": ["11:30", "13:30"]})
+    assert "error" not in output and output["start_time"] == "09:30"
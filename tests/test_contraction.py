@@ -0,0 +1,88 @@
+"""hita_navi.contraction の距離を RoadGraph.dijkstra と比べるテスト"""
+import math
+
+import numpy as np
+import pytest
+
+from hita_navi import contraction
+from hita_navi.contraction import ContractionHierarchy
+from hita_navi.road_graph import RoadGraph
+
+SIZE = 8
+
+
+def directed_grid(seed):
+    """一方通行を含む格子状の道路と、行き止まり・孤立した区画を持つグラフ"""
+    rng = np.random.default_rng(seed)
+    lat = np.repeat(np.linspace(33.30, 33.33, SIZE), SIZE)
+    lon = np.tile(np.linspace(130.92, 130.95, SIZE), SIZE)
+    sources, targets = [], []
+    for r in range(SIZE):
+        for c in range(SIZE):
+            u = r * SIZE + c
+            for v in ([u + 1] if c + 1 < SIZE else []) + ([u + SIZE] if r + 1 < SIZE else []):
+                kind = rng.integers(3)   # 0: 双方向, 1: 順方向のみ, 2: 逆方向のみ
+                if kind != 2:
+                    sources.append(u)
+                    targets.append(v)
+                if kind != 1:
+                    sources.append(v)
+                    targets.append(u)
+    # 入るだけの節点と、格子とつながらない2節点の区画
+    n = SIZE * SIZE
+    lat = np.concatenate((lat, [33.335, 33.34, 33.341]))
+    lon = np.concatenate((lon, [130.955, 130.96, 130.961]))
+    sources += [n - 1, n + 1, n + 2]
+    targets += [n, n + 2, n + 1]
+    return RoadGraph.from_edges(lat, lon, sources, targets, profile="car")
+
+
+@pytest.fixture(scope="module", params=range(3))
+def graphs(request):
+    graph = directed_grid(request.param)
+    return graph, ContractionHierarchy.build(graph)
+
+
+def test_distances_match_dijkstra(graphs):
+    graph, hierarchy = graphs
+    unreachable = 0
+    for source in range(len(graph)):
+        done = graph.dijkstra(source)
+        for target in range(len(graph)):
+            expected = done.get(target, math.inf)
+            unreachable += not math.isfinite(expected)
+            assert hierarchy.distance(source, target) == pytest.approx(expected, rel=1e-9)
+    assert unreachable > 0
+
+
+def test_truncated_witness_search_keeps_distances(monkeypatch):
+    # 証人探索を打ち切るとショートカットは増えるが、距離は変わらない
+    graph = directed_grid(0)
+    full = ContractionHierarchy.build(graph)
+    monkeypatch.setattr(contraction, "WITNESS_SETTLE_LIMIT", 2)
+    monkeypatch.setattr(contraction, "WITNESS_HOP_LIMIT", 1)
+    truncated = ContractionHierarchy.build(graph)
+    assert truncated.edge_count >= full.edge_count
+    for source in range(len(graph)):
+        done = graph.dijkstra(source)
+        assert [truncated.distance(source, t) for t in range(len(graph))] == pytest.approx(
+            [done.get(t, math.inf) for t in range(len(graph))], rel=1e-9)
+
+
+def test_distances_to_matches_road_graph(graphs):
+    graph, hierarchy = graphs
+    rng = np.random.default_rng(0)
+    points = np.column_stack((rng.uniform(33.30, 33.342, 30), rng.uniform(130.92, 130.962, 30)))
+    for origin in points[:10]:
+        expected = graph.distances_to(origin, points)
+        # 2回目は目的地のキャッシュを通る
+        for _ in range(2):
+            assert hierarchy.distances_to(origin, points) == pytest.approx(expected, rel=1e-9)
+
+
+def test_save_and_load(graphs, tmp_path):
+    graph, hierarchy = graphs
+    hierarchy.save(tmp_path / "roads.ch.npz")
+    loaded = ContractionHierarchy.load(tmp_path / "roads.ch.npz")
+    assert len(loaded) == len(hierarchy) and loaded.edge_count == hierarchy.edge_count
+    assert [loaded.distance(0, t) for t in range(len(graph))] == [hierarchy.distance(0, t) for t in range(len(graph))]
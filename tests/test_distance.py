@@ -0,0 +1,59 @@
+"""hita_navi.distance を geopy の測地線距離と比べるテスト"""
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from hita_navi.distance import METHODS, distance_matrix, distances_from, haversine, vincenty
+
+# 日田市周辺の範囲（緯度・経度）
+HITA_LAT = (33.2, 33.45)
+HITA_LON = (130.75, 131.1)
+
+# Vincenty法は楕円体の測地線距離と 1mm 以内、ハバーサインは球近似のため 0.5% 以内
+TOLERANCES = {"vincenty": {"rel": 1e-9, "abs": 1e-6}, "haversine": {"rel": 5e-3}}
+
+
+def random_points(count, seed):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(*HITA_LAT, count), rng.uniform(*HITA_LON, count)))
+
+
+def geodesic_km(a, b):
+    return geodesic(tuple(a), tuple(b)).km
+
+
+def test_vincenty_matches_geodesic():
+    a, b = random_points(500, 0), random_points(500, 1)
+    expected = [geodesic_km(p, q) for p, q in zip(a, b)]
+    assert vincenty(a[:, 0], a[:, 1], b[:, 0], b[:, 1]) == pytest.approx(expected, **TOLERANCES["vincenty"])
+
+
+def test_haversine_matches_geodesic():
+    a, b = random_points(500, 2), random_points(500, 3)
+    expected = [geodesic_km(p, q) for p, q in zip(a, b)]
+    assert haversine(a[:, 0], a[:, 1], b[:, 0], b[:, 1]) == pytest.approx(expected, **TOLERANCES["haversine"])
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_distances_from_matches_geodesic(method):
+    origin = random_points(1, 4)[0]
+    points = random_points(200, 5)
+    expected = [geodesic_km(origin, point) for point in points]
+    assert distances_from(origin, points, method) == pytest.approx(expected, **TOLERANCES[method])
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_distance_matrix_matches_geodesic(method):
+    origins, destinations = random_points(20, 6), random_points(30, 7)
+    expected = [[geodesic_km(p, q) for q in destinations] for p in origins]
+    matrix = distance_matrix(origins, destinations, method)
+    assert matrix.shape == (20, 30)
+    assert matrix.ravel() == pytest.approx(np.ravel(expected), **TOLERANCES[method])
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_distance_matrix_of_origins_is_symmetric(method):
+    points = random_points(15, 8)
+    matrix = distance_matrix(points, method=method)
+    assert np.diag(matrix) == pytest.approx(np.zeros(15), abs=1e-9)
+    assert matrix == pytest.approx(matrix.T, abs=1e-9)
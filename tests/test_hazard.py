@@ -0,0 +1,47 @@
+"""hita_navi.hazard の危険エリアの索引と読み込みのテスト"""
+import numpy as np
+import pytest
+
+from hita_navi.hazard import HazardArea, HazardSet, load_hazards
+
+
+def random_areas(count, seed):
+    """日田市周辺にランダムな大きさの四角形の危険エリアを置く"""
+    rng = np.random.default_rng(seed)
+    areas = []
+    for n in range(count):
+        lat, lon = rng.uniform(33.2, 33.45), rng.uniform(130.75, 131.1)
+        dlat, dlon = rng.uniform(0.0005, 0.02, 2)
+        polygon = ((lat, lon), (lat + dlat, lon), (lat + dlat, lon + dlon), (lat, lon + dlon))
+        areas.append(HazardArea(f"area-{n}", polygon))
+    return areas
+
+
+@pytest.mark.parametrize("count", [0, 5, 16, 17, 300])
+def test_candidates_match_bounding_box_scan(count):
+    areas = random_areas(count, count)
+    hazards = HazardSet(areas)
+    rng = np.random.default_rng(100 + count)
+    for _ in range(50):
+        lat_min, lon_min = rng.uniform(33.2, 33.45), rng.uniform(130.75, 131.1)
+        lat_max, lon_max = lat_min + rng.uniform(0, 0.05), lon_min + rng.uniform(0, 0.05)
+        expected = [i for i, area in enumerate(areas)
+                    if min(p[0] for p in area.polygon) <= lat_max and max(p[0] for p in area.polygon) >= lat_min
+                    and min(p[1] for p in area.polygon) <= lon_max and max(p[1] for p in area.polygon) >= lon_min]
+        assert hazards.candidates(lat_min, lon_min, lat_max, lon_max).tolist() == expected
+
+
+def test_candidates_follow_updates():
+    hazards = HazardSet(random_areas(40, 1))
+    area = HazardArea("new", ((33.30, 130.90), (33.31, 130.90), (33.31, 130.91)))
+    hazards.add(area)
+    assert hazards.areas[-1] == area
+    assert len(hazards) - 1 in hazards.candidates(33.305, 130.905, 33.305, 130.905)
+    hazards.remove("new")
+    assert all(a.name != "new" for a in hazards.areas_at(33.305, 130.905))
+
+
+def test_missing_file_gives_empty_set(tmp_path):
+    hazards = load_hazards(tmp_path / "hazard_areas.geojson")
+    assert len(hazards) == 0
+    assert hazards.areas_at(33.32, 130.94) == []
@@ -0,0 +1,38 @@
+"""hita_navi.local_search の改善ステージのテスト"""
+import time
+
+import numpy as np
+import pytest
+
+from hita_navi.local_search import IMPROVERS, improve_route
+from hita_navi.tsp import held_karp_tour, route_length
+
+
+def random_matrix(n, seed):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 10, (n + 1, 2))
+    return np.linalg.norm(points[:, None] - points[None], axis=2)
+
+
+@pytest.mark.parametrize("stage", sorted(IMPROVERS))
+def test_stage_counts_improving_moves(stage):
+    dist = random_matrix(12, 0)
+    order = list(range(12, 0, -1))
+    improved, count = IMPROVERS[stage](dist, order, deadline=time.perf_counter() + 1.0)
+    assert sorted(improved) == sorted(order)
+    assert route_length(dist, improved) < route_length(dist, order)
+    assert count >= 1
+    # 最適解からは経路を短くする手がない
+    optimal = held_karp_tour(dist)
+    options = {"initial_temperature": 1e-5, "seed": 0} if stage == "sa" else {}
+    again, count = IMPROVERS[stage](dist, optimal, deadline=time.perf_counter() + 1.0, **options)
+    assert count == 0 and route_length(dist, again) == pytest.approx(route_length(dist, optimal))
+
+
+def test_improve_route_sums_stage_counts():
+    dist = random_matrix(20, 1)
+    order = list(range(1, 21))
+    result = improve_route(dist, order, stages=("2opt", "oropt", "sa"), time_budget=0.2)
+    assert result.initial_length == pytest.approx(route_length(dist, order))
+    assert result.length == pytest.approx(route_length(dist, result.order)) and result.length < result.initial_length
+    assert result.iterations >= 1
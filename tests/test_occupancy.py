@@ -0,0 +1,102 @@
+"""hita_navi.occupancy.OccupancyStore のまとめ書き込みと再送のテスト"""
+import pytest
+
+from hita_navi.occupancy import MemoryBackend, OccupancyStore
+
+
+class FlakyBackend(MemoryBackend):
+    """指定した回数だけ書き込みに失敗する保存先。during_write は書き込み中に実行する処理"""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = 0
+        self.during_write = None
+
+    def write(self, absolute, deltas):
+        if self.during_write is not None:
+            hook, self.during_write = self.during_write, None
+            hook()
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("保存先に接続できません")
+        super().write(absolute, deltas)
+
+
+@pytest.fixture
+def backend():
+    return FlakyBackend()
+
+
+@pytest.fixture
+def store(backend):
+    # 自動の書き込みは起こさず、flush() を明示的に呼ぶ。キャッシュは使わず毎回読む
+    store = OccupancyStore(backend, ttl=-1, flush_seconds=3600, max_pending=10 ** 6)
+    yield store
+    backend.failures = 0
+    store.close()
+
+
+def test_counts_include_unflushed_records(store, backend):
+    backend.write({1: 10}, {})
+    store.add(1, 3)
+    store.report(2, 5)
+    store.add(3, -2)
+    assert backend.read_all() == {1: 10}
+    assert store.counts() == {1: 13, 2: 5, 3: 0}
+    store.flush()
+    assert backend.read_all() == {1: 13, 2: 5, 3: 0}
+    assert store.counts() == {1: 13, 2: 5, 3: 0}
+
+
+def test_failed_write_keeps_pending_records(store, backend):
+    store.add(1, 3)
+    store.report(2, 5)
+    backend.failures = 1
+    with pytest.raises(ConnectionError):
+        store.flush()
+    assert backend.read_all() == {}
+    assert store.counts() == {1: 3, 2: 5}
+    store.flush()
+    assert backend.read_all() == {1: 3, 2: 5}
+    assert store.flushes == 1
+
+
+def test_records_made_during_failed_write_are_merged(store, backend):
+    backend.write({1: 10, 2: 10}, {})
+    store.add(1, 3)
+    store.add(2, 1)
+    store.report(3, 8)
+
+    def during_write():
+        store.report(1, 4)   # 失敗した増減より新しい数え直しが優先される
+        store.add(2, 2)      # 増減同士は足し合わせる
+        store.report(3, 6)   # 新しい数え直しが古い数え直しを置き換える
+
+    backend.failures = 1
+    backend.during_write = during_write
+    with pytest.raises(ConnectionError):
+        store.flush()
+    assert store.counts() == {1: 4, 2: 13, 3: 6}
+    store.flush()
+    assert backend.read_all() == {1: 4, 2: 13, 3: 6}
+
+
+def test_report_after_failed_write_replaces_restored_delta(store, backend):
+    backend.write({1: 10}, {})
+    store.add(1, 3)
+    store.report(2, 10)
+    backend.failures = 1
+    with pytest.raises(ConnectionError):
+        store.flush()
+    store.report(1, 7)
+    store.add(2, 2)      # 戻した数え直しの後の増減
+    assert store.counts() == {1: 7, 2: 12}
+    store.flush()
+    assert backend.read_all() == {1: 7, 2: 12}
+
+
+def test_close_writes_pending_records(backend):
+    store = OccupancyStore(backend, flush_seconds=3600)
+    store.add(1, 2)
+    store.close()
+    assert backend.read_all() == {1: 2}
@@ -0,0 +1,89 @@
+"""hita_navi.route_cache の有効期限・件数の上限・SQLite への保存のテスト"""
+import types
+
+import pytest
+
+from hita_navi import route_cache
+from hita_navi.route_cache import RouteCache, route_key
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(route_cache, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = RouteCache(ttl=60)
+    cache.put("a", {"order": [1, 2]})
+    clock.now += 60
+    assert cache.get("a") == {"order": [1, 2]}
+    clock.now += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = RouteCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_get_or_compute_computes_once(clock):
+    cache = RouteCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [3, 1, 2]
+
+    assert cache.get_or_compute("a", compute) == [3, 1, 2]
+    assert cache.get_or_compute("a", compute) == [3, 1, 2]
+    assert len(calls) == 1
+
+
+def test_entries_persist_in_sqlite(clock, tmp_path):
+    path = tmp_path / "cache" / "routes.sqlite"
+    RouteCache(ttl=60, path=path).put("a", {"order": [2, 1], "length": 1.5})
+    clock.now += 30
+    reopened = RouteCache(ttl=60, path=path)
+    assert len(reopened) == 0
+    assert reopened.get("a") == {"order": [2, 1], "length": 1.5}
+    # 期限切れの行は開くときに削除され、読み込まれない
+    clock.now += 31
+    assert RouteCache(ttl=3600, path=path).get("a") is not None
+    assert RouteCache(ttl=60, path=path).get("a") is None
+    assert RouteCache(ttl=3600, path=path).get("a") is None
+
+
+def test_sqlite_keeps_newest_entries_up_to_maxsize(clock, tmp_path):
+    path = tmp_path / "routes.sqlite"
+    cache = RouteCache(maxsize=2, path=path)
+    for key in "abc":
+        cache.put(key, key)
+        clock.now += 1
+    reopened = RouteCache(maxsize=10, path=path)
+    assert reopened.get("a") is None
+    assert reopened.get("b") == "b" and reopened.get("c") == "c"
+
+
+def test_route_key_ignores_destination_order():
+    location = (33.3200, 130.9400)
+    nearby = (33.3200, 130.94001)
+    assert route_key(location, [3, 1, 2], "walk") == route_key(nearby, [1, 2, 3], "walk")
+    assert route_key(location, [1, 2, 3], "walk") != route_key(location, [1, 2, 3], "car")
+    assert route_key(location, [1, 2, 3], "walk") != route_key((33.33, 130.94), [1, 2, 3], "walk")
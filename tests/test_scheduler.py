@@ -0,0 +1,48 @@
+"""hita_navi.scheduler.plan_schedule のテスト"""
+import itertools
+
+from hita_navi import scheduler
+from hita_navi.scheduler import parse_clock, plan_schedule
+
+START = (33.32, 130.9417)
+PLACES = [
+    {'name': "豆田町", 'lat': 33.3267, 'lon': 130.9381, 'wait_time': 0, 'visit_duration': 60,
+     'open': "10:00", 'close': "17:00"},
+    {'name': "亀山公園", 'lat': 33.3172, 'lon': 130.9447, 'wait_time': 5, 'visit_duration': 30},
+]
+
+
+def test_finds_feasible_optimal_schedule():
+    schedule = plan_schedule(START, PLACES)
+    assert schedule.feasible and schedule.optimal
+    assert not schedule.timed_out and not schedule.relaxed
+    assert sorted(stop.place['name'] for stop in schedule.stops) == sorted(place['name'] for place in PLACES)
+
+
+def test_reports_proven_infeasibility():
+    # 9時に出発して9時5分に閉まる地点で60分過ごすことはできない
+    places = [dict(PLACES[0], open="09:00", close="09:05"), PLACES[1]]
+    schedule = plan_schedule(START, places)
+    assert not schedule.feasible and schedule.relaxed
+    assert not schedule.timed_out and schedule.optimal
+    assert len(schedule.stops) == 2
+
+
+def test_returns_best_schedule_found_before_time_limit(monkeypatch):
+    # 呼ばれるたびに1秒進む時計: 最初の解を見つけた直後に制限時間を超える
+    clock = itertools.count()
+    monkeypatch.setattr(scheduler.time, "perf_counter", lambda: next(clock))
+    schedule = plan_schedule(START, PLACES, time_limit=3.5)
+    assert schedule.feasible and schedule.timed_out
+    assert not schedule.relaxed and not schedule.optimal
+    assert len(schedule.stops) == 2
+
+
+def test_falls_back_to_input_order_without_time():
+    schedule = plan_schedule(START, PLACES, time_limit=0)
+    # 時間切れは条件を満たせないことの証明ではない
+    assert schedule.feasible and schedule.timed_out and schedule.relaxed and not schedule.optimal
+    assert [stop.place['name'] for stop in schedule.stops] == [place['name'] for place in PLACES]
+    # 開店前に着いた地点は開店まで待ち、次の地点は前の地点を出てから着く
+    assert schedule.stops[0].start == parse_clock("10:00")
+    assert schedule.stops[1].arrival > schedule.stops[0].departure
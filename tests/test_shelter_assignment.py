@@ -0,0 +1,101 @@
+"""hita_navi.shelter_assignment の割り当てを総当たり・作り直した場合と比べるテスト"""
+import itertools
+
+import numpy as np
+import pytest
+
+from hita_navi.shelter_assignment import ShelterAssignment
+
+
+def random_instance(seed, groups, shelters, max_count, max_capacity):
+    rng = np.random.default_rng(seed)
+    costs = rng.uniform(0.1, 5.0, (groups, shelters))
+    # 一部の組は到達できない
+    costs[rng.random((groups, shelters)) < 0.1] = np.inf
+    counts = rng.integers(0, max_count + 1, groups)
+    capacity = rng.integers(0, max_capacity + 1, shelters)
+    return costs, counts, capacity
+
+
+def objective(engine, result):
+    """最小費用流の目的関数（距離の合計＋未割り当ての人数×割り当てられない費用）"""
+    return result.total_km + result.unassigned * engine.overflow_cost
+
+
+def brute_force(engine, costs, counts, capacity):
+    """1人ずつ避難所（または未割り当て）を選ぶ全通りの最小値"""
+    people = [group for group, count in enumerate(counts) for _ in range(count)]
+    cost = np.where(np.isfinite(costs), costs, engine.overflow_cost)
+    best = np.inf
+    for choice in itertools.product(range(len(capacity) + 1), repeat=len(people)):
+        loads = np.bincount(choice, minlength=len(capacity) + 1)[:-1]
+        if (loads > capacity).any():
+            continue
+        total = sum(engine.overflow_cost if s == len(capacity) else cost[g, s] for g, s in zip(people, choice))
+        best = min(best, total)
+    return best
+
+
+def check_consistent(result, counts, capacity):
+    """人数・収容人数の制約を満たしているか"""
+    assigned = np.bincount(result.groups, weights=result.counts, minlength=len(counts))
+    assert assigned.tolist() == list(counts)
+    real = result.shelters >= 0
+    loads = np.bincount(result.shelters[real], weights=result.counts[real], minlength=len(capacity))
+    assert loads.tolist() == result.loads.tolist()
+    assert (result.loads <= capacity).all()
+    assert result.unassigned == int(result.counts[~real].sum())
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_matches_brute_force(seed):
+    costs, counts, capacity = random_instance(seed, groups=4, shelters=3, max_count=2, max_capacity=3)
+    engine = ShelterAssignment(costs, counts)
+    result = engine.solve(capacity)
+    check_consistent(result, counts, capacity)
+    assert objective(engine, result) == pytest.approx(brute_force(engine, costs, counts, capacity))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_capacity_change_matches_fresh_solve(seed):
+    costs, counts, capacity = random_instance(seed, groups=40, shelters=6, max_count=5, max_capacity=40)
+    engine = ShelterAssignment(costs, counts)
+    engine.solve(capacity)
+    rng = np.random.default_rng(seed + 100)
+    for _ in range(3):
+        capacity = np.maximum(capacity + rng.integers(-15, 16, len(capacity)), 0)
+        result = engine.solve(capacity)
+        fresh = ShelterAssignment(costs, counts)
+        check_consistent(result, counts, capacity)
+        assert objective(engine, result) == pytest.approx(objective(fresh, fresh.solve(capacity)))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_count_change_matches_fresh_solve(seed):
+    costs, counts, capacity = random_instance(seed, groups=40, shelters=6, max_count=5, max_capacity=40)
+    engine = ShelterAssignment(costs, counts)
+    engine.solve(capacity)
+    rng = np.random.default_rng(seed + 200)
+    for _ in range(3):
+        counts = np.maximum(counts + rng.integers(-3, 4, len(counts)), 0)
+        engine.set_counts(counts)
+        result = engine.solve(capacity)
+        fresh = ShelterAssignment(costs, counts)
+        check_consistent(result, counts, capacity)
+        assert objective(engine, result) == pytest.approx(objective(fresh, fresh.solve(capacity)))
+
+
+def test_demand_over_capacity_leaves_people_unassigned():
+    costs, _, _ = random_instance(0, groups=20, shelters=4, max_count=0, max_capacity=0)
+    costs = np.where(np.isfinite(costs), costs, 10.0)
+    counts = np.full(20, 5)
+    capacity = np.array([10, 20, 0, 30])
+    engine = ShelterAssignment(costs, counts)
+    result = engine.solve(capacity)
+    check_consistent(result, counts, capacity)
+    assert result.loads.tolist() == capacity.tolist()
+    assert result.unassigned == counts.sum() - capacity.sum()
+    # 空きができれば未割り当ての人が入る
+    result = engine.solve(capacity + 10)
+    check_consistent(result, counts, capacity + 10)
+    assert result.unassigned == counts.sum() - capacity.sum() - 40
@@ -0,0 +1,55 @@
+"""hita_navi.tsp の Held-Karp 法を総当たりと比べるテスト"""
+import itertools
+
+import numpy as np
+import pytest
+
+from hita_navi.tsp import (HELD_KARP_MAX_STOPS, held_karp_tour, nearest_neighbor_tour, route_length,
+                           solve_route)
+
+
+def random_matrix(n, seed, symmetric):
+    """出発地(0)と n 箇所の目的地の距離行列"""
+    rng = np.random.default_rng(seed)
+    dist = rng.uniform(0.1, 10.0, (n + 1, n + 1))
+    if symmetric:
+        dist = (dist + dist.T) / 2
+    np.fill_diagonal(dist, 0.0)
+    return dist
+
+
+def brute_force_length(dist):
+    n = len(dist) - 1
+    return min(route_length(dist, order) for order in itertools.permutations(range(1, n + 1)))
+
+
+@pytest.mark.parametrize("symmetric", [True, False], ids=["symmetric", "asymmetric"])
+@pytest.mark.parametrize("n", range(1, 9))
+@pytest.mark.parametrize("seed", range(3))
+def test_held_karp_matches_brute_force(n, seed, symmetric):
+    dist = random_matrix(n, seed, symmetric)
+    order = held_karp_tour(dist)
+    assert sorted(order) == list(range(1, n + 1))
+    assert route_length(dist, order) == pytest.approx(brute_force_length(dist))
+
+
+def test_no_destinations():
+    assert held_karp_tour(np.zeros((1, 1))) == []
+    assert solve_route(np.zeros((1, 1))) == []
+
+
+def test_held_karp_at_stop_limit():
+    dist = random_matrix(HELD_KARP_MAX_STOPS, 0, symmetric=False)
+    order = solve_route(dist)
+    assert sorted(order) == list(range(1, HELD_KARP_MAX_STOPS + 1))
+    assert route_length(dist, order) <= route_length(dist, nearest_neighbor_tour(dist)) + 1e-9
+
+
+def test_falls_back_above_stop_limit():
+    dist = random_matrix(HELD_KARP_MAX_STOPS + 1, 0, symmetric=True)
+    with pytest.raises(ValueError):
+        held_karp_tour(dist)
+    assert solve_route(dist) == nearest_neighbor_tour(dist)
+    # 上限を下げると厳密解の代わりに近似解を使う
+    small = random_matrix(6, 1, symmetric=True)
+    assert solve_route(small, exact_limit=5) == nearest_neighbor_tour(small)